@@ -0,0 +1,123 @@
+"""Size and decode time of cached users: JSON + validated UserOut vs. common.codec + trusted UserOut.
+
+    python cache_codec.py --users 100000
+    python cache_codec.py --users 100000 --redis redis://localhost:6379/15   # also Redis used_memory
+
+"json" is what auth.py stored before: the key user_token:<JWT> and
+json.dumps(to_redis_dict()) as the value, read back with from_redis_dict.
+"codec" is the key cache:user_token:<digest> and common.codec (msgpack)
+as the value, read back with UserOut.from_cache. With --redis both sets are
+written to that database (it is flushed) and the growth of used_memory is
+reported. The last lines compare a large value, a product catalog, with and
+without zstd.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path[:0] = [ROOT, os.path.join(ROOT, "user_service")]
+
+from jose import jwt  # noqa: E402
+
+import schemas  # noqa: E402
+from common import codec  # noqa: E402
+
+
+def make_users(n: int):
+    now = datetime.now(timezone.utc)
+    users = []
+    for i in range(n):
+        created = now - timedelta(days=random.randint(1, 1000), seconds=random.randint(0, 86400))
+        users.append(schemas.UserOut(
+            id=i + 1, username=f"user_{i}", email=f"user_{i}@example.com", full_name=f"User Number {i}",
+            role=random.choice(list(schemas.UserRole)), created_at=created,
+            last_login=created + timedelta(days=random.randint(0, 30)), login_count=random.randint(0, 500),
+            updated_at=created + timedelta(hours=1) if i % 3 else None,
+        ))
+    return users
+
+
+def make_token(user: schemas.UserOut) -> str:
+    expire = datetime.utcnow() + timedelta(minutes=30)
+    return jwt.encode({"sub": user.username, "uid": user.id, "exp": expire, "type": "access"},
+                      "benchmark-secret", algorithm="HS256")
+
+
+FORMATS = {
+    "json": (lambda token: f"user_token:{token}",
+             lambda user: json.dumps(user.to_redis_dict()).encode(),
+             lambda raw: schemas.UserOut.from_redis_dict(json.loads(raw))),
+    "codec": (lambda token: f"cache:user_token:{codec.short_key(token)}",
+              lambda user: codec.dumps(schemas.UserOut.record(user)),
+              lambda raw: schemas.UserOut.from_cache(codec.loads(raw))),
+}
+
+
+def used_memory(client) -> int:
+    return client.info("memory")["used_memory"]
+
+
+def main(args):
+    random.seed(42)
+    users = make_users(args.users)
+    tokens = [make_token(user) for user in users]
+    client = None
+    if args.redis:
+        import redis
+
+        client = redis.Redis.from_url(args.redis)
+        client.flushdb()
+
+    print(f"{args.users} users, JWT {sum(map(len, tokens)) / len(tokens):.0f} chars on average")
+    print(f"{'format':6} {'key B':>7} {'value B':>8} {'total MiB':>10} {'decode us':>10}"
+          + (f" {'Redis MiB':>10}" if client else ""))
+    for name, (make_key, encode, decode) in FORMATS.items():
+        keys = [make_key(token) for token in tokens]
+        values = [encode(user) for user in users]
+        started = time.perf_counter()
+        for raw in values:
+            decode(raw)
+        decode_us = (time.perf_counter() - started) / len(values) * 1e6
+        key_bytes = sum(map(len, keys)) / len(keys)
+        value_bytes = sum(map(len, values)) / len(values)
+        total = (sum(map(len, keys)) + sum(map(len, values))) / 2**20
+        line = f"{name:6} {key_bytes:7.0f} {value_bytes:8.0f} {total:10.1f} {decode_us:10.2f}"
+        if client:
+            before = used_memory(client)
+            pipe = client.pipeline(transaction=False)
+            for i, (key, value) in enumerate(zip(keys, values)):
+                pipe.set(key, value, ex=300)
+                if i % 1000 == 999:
+                    pipe.execute()
+            pipe.execute()
+            line += f" {(used_memory(client) - before) / 2**20:10.1f}"
+            client.flushdb()
+        print(line)
+
+    catalog = [{"_id": f"{i:024x}", "name": f"Product {i}", "description": "A fairly ordinary product " * 4,
+                "price": round(random.uniform(1, 500), 2), "version": random.randint(1, 9),
+                "updated_at": datetime.utcnow()} for i in range(args.catalog)]
+    as_json = json.dumps(catalog, default=str).encode()
+    packed = codec.dumps(catalog)
+    threshold, codec.CACHE_COMPRESS_THRESHOLD = codec.CACHE_COMPRESS_THRESHOLD, 1 << 62
+    uncompressed = codec.dumps(catalog)
+    codec.CACHE_COMPRESS_THRESHOLD = threshold
+    started = time.perf_counter()
+    codec.loads(packed)
+    decode_ms = (time.perf_counter() - started) * 1000
+    print(f"catalog of {args.catalog}: json {len(as_json) / 1024:.0f} KiB, msgpack {len(uncompressed) / 1024:.0f} KiB, "
+          f"msgpack+zstd {len(packed) / 1024:.0f} KiB (decode {decode_ms:.1f} ms)"
+          + ("" if codec.zstandard else " [zstandard not installed]"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--catalog", type=int, default=5000)
+    parser.add_argument("--redis", help="Redis URL whose database is flushed and used to measure used_memory")
+    main(parser.parse_args())
@@ -0,0 +1,70 @@
+"""Many simultaneous add-to-cart calls against one cart.
+
+    python cart_concurrency.py --url http://localhost:8002 --requests 2000 --concurrency 200
+
+The token is minted with SECRET_KEY (same as user_service) unless --token is given.
+After the run the cart must contain exactly --requests units of the product.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+from datetime import datetime, timedelta
+
+import httpx
+from jose import jwt
+
+
+def mint_token(user_id: int) -> str:
+    payload = {
+        "sub": f"bench_{user_id}",
+        "uid": user_id,
+        "type": "access",
+        "exp": datetime.utcnow() + timedelta(minutes=30),
+    }
+    return jwt.encode(payload, os.getenv("SECRET_KEY", "fallback-secret-key"),
+                      algorithm=os.getenv("JWT_ALGORITHM", "HS256"))
+
+
+async def run(args):
+    headers = {"Authorization": f"Bearer {args.token or mint_token(args.user_id)}"}
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, headers=headers, limits=limits, timeout=30) as client:
+        await client.delete("/cart")
+        semaphore = asyncio.Semaphore(args.concurrency)
+        latencies = []
+
+        async def add_one():
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.post("/cart", json={"product_id": args.product_id, "quantity": 1})
+                latencies.append(time.perf_counter() - started)
+                response.raise_for_status()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(add_one() for _ in range(args.requests)))
+        elapsed = time.perf_counter() - started
+
+        cart = (await client.get("/cart")).json()
+        quantity = sum(line["quantity"] for line in cart["items"] if line["product_id"] == args.product_id)
+
+    latencies.sort()
+    print(f"requests:    {args.requests} @ concurrency {args.concurrency}")
+    print(f"throughput:  {args.requests / elapsed:.0f} req/s")
+    print(f"latency p50: {statistics.median(latencies) * 1000:.2f} ms")
+    print(f"latency p99: {latencies[int(len(latencies) * 0.99) - 1] * 1000:.2f} ms")
+    print(f"final quantity: {quantity} (expected {args.requests})")
+    if quantity != args.requests:
+        raise SystemExit("lost updates detected")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8002")
+    parser.add_argument("--token")
+    parser.add_argument("--user-id", type=int, default=1)
+    parser.add_argument("--product-id", default="6463a1f0c2a4b5d6e7f80912")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,93 @@
+"""Tail latency of cart enrichment against a stubbed product_service.
+
+    python cart_enrichment.py --carts 2000 --lines 20 --concurrency 100 --stub-latency-ms 5
+
+Starts an in-process product_service stub on --stub-port and drives
+cart_service's ProductClient with carts of random products, reporting
+p50/p95/p99 per enriched cart. The client's L2 is an in-memory Redis unless
+REDIS_URL is set.
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request, Response
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path[:0] = [ROOT, os.path.join(ROOT, "cart_service")]
+os.environ.setdefault("REDIS_URL", "fakeredis://cart-enrichment")
+
+from product_client import ProductClient  # noqa: E402
+
+
+def build_stub(latency_ms: float, jitter_ms: float) -> FastAPI:
+    stub = FastAPI()
+
+    @stub.get("/products/{product_id}")
+    async def product(product_id: str, request: Request):
+        await asyncio.sleep(max(0.0, random.gauss(latency_ms, jitter_ms)) / 1000)
+        etag = f'"{product_id}-1"'
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"ETag": etag})
+        return Response(
+            content=f'{{"_id":"{product_id}","name":"p{product_id}","description":"","price":9.99,"version":1}}',
+            media_type="application/json",
+            headers={"ETag": etag},
+        )
+
+    return stub
+
+
+async def run(args):
+    server = uvicorn.Server(uvicorn.Config(build_stub(args.stub_latency_ms, args.stub_jitter_ms),
+                                           port=args.stub_port, log_level="warning"))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+
+    client = ProductClient(base_url=f"http://127.0.0.1:{args.stub_port}", ttl=args.cache_ttl,
+                           l1_ttl=args.cache_l1_ttl, pool_size=args.pool_size, bus=None)
+    await client.start()
+    catalog = [f"{i:024x}" for i in range(args.catalog)]
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = []
+
+    async def enrich_one():
+        cart = random.sample(catalog, args.lines)
+        async with semaphore:
+            started = time.perf_counter()
+            await client.get_products(cart)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(enrich_one() for _ in range(args.carts)))
+    elapsed = time.perf_counter() - started
+    await client.close()
+    server.should_exit = True
+    await server_task
+
+    latencies.sort()
+    pct = lambda p: latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+    print(f"carts: {args.carts} x {args.lines} lines @ concurrency {args.concurrency}")
+    print(f"throughput: {args.carts / elapsed:.0f} carts/s")
+    print(f"p50 {statistics.median(latencies) * 1000:.2f} ms  p95 {pct(0.95):.2f} ms  p99 {pct(0.99):.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--carts", type=int, default=2000)
+    parser.add_argument("--lines", type=int, default=20)
+    parser.add_argument("--catalog", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--pool-size", type=int, default=100)
+    parser.add_argument("--cache-ttl", type=float, default=300.0)
+    parser.add_argument("--cache-l1-ttl", type=float, default=60.0)
+    parser.add_argument("--stub-port", type=int, default=18001)
+    parser.add_argument("--stub-latency-ms", type=float, default=5.0)
+    parser.add_argument("--stub-jitter-ms", type=float, default=2.0)
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,81 @@
+"""Memory of the compact in-process cart store vs. a list of pydantic CartItem models.
+
+    python cart_memory.py --carts 100000 --lines 10
+
+Both representations hold the same synthetic carts; sizes are measured with
+tracemalloc. Also times a snapshot round trip of the compact store.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "cart_service"))
+
+from memory_store import MemoryCartStore  # noqa: E402
+from schemas import CartItem  # noqa: E402
+
+
+async def measure(build):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    result = build()
+    if asyncio.iscoroutine(result):
+        result = await result
+    elapsed = time.perf_counter() - started
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return result, size, elapsed
+
+
+async def run(args):
+    random.seed(42)
+    catalog = [f"{i:024x}" for i in range(args.catalog)]
+    carts = [[(random.choice(catalog), random.randint(1, 5)) for _ in range(args.lines)]
+             for _ in range(args.carts)]
+    lines = args.carts * args.lines
+
+    def build_models():
+        return {user_id: [CartItem(product_id=p, quantity=q) for p, q in cart]
+                for user_id, cart in enumerate(carts)}
+
+    async def build_compact():
+        store = MemoryCartStore(snapshot_interval=0)
+        for user_id, cart in enumerate(carts):
+            for product_id, quantity in cart:
+                await store.change_item(user_id, product_id, "incr", quantity, 9.99)
+        return store
+
+    models, models_size, models_time = await measure(build_models)
+    del models
+    store, compact_size, compact_time = await measure(build_compact)
+
+    print(f"{args.carts} carts x {args.lines} lines = {lines} lines")
+    print(f"list of CartItem: {models_size / 2**20:8.1f} MiB  {models_size / lines:6.1f} B/line  build {models_time:.1f}s")
+    print(f"compact store:    {compact_size / 2**20:8.1f} MiB  {compact_size / lines:6.1f} B/line  build {compact_time:.1f}s")
+    print(f"ratio: {models_size / compact_size:.1f}x smaller")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store.snapshot_path = os.path.join(tmp, "carts.snapshot")
+        started = time.perf_counter()
+        await store.snapshot()
+        written = time.perf_counter() - started
+        restored = MemoryCartStore(snapshot_path=store.snapshot_path, snapshot_interval=0)
+        started = time.perf_counter()
+        restored.load()
+        loaded = time.perf_counter() - started
+        print(f"snapshot: {os.path.getsize(store.snapshot_path) / 2**20:.1f} MiB, "
+              f"write {written:.2f}s, load {loaded:.2f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--carts", type=int, default=100_000)
+    parser.add_argument("--lines", type=int, default=10)
+    parser.add_argument("--catalog", type=int, default=50_000)
+    asyncio.run(run(parser.parse_args()))
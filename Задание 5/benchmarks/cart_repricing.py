@@ -0,0 +1,113 @@
+"""Throughput of the vectorised cart repricing job, end to end.
+
+    python cart_repricing.py --lines 1000000 --products 1000       # embedded Postgres (pgserver)
+    python cart_repricing.py --database-url postgresql://...       # a scratch database
+
+Loads synthetic cart_items (and the users they reference) with COPY, then
+reprices every product through repricing.reprice(), the function behind
+POST /admin/reprice, and reports lines/second for the read-and-compute phase
+and for the whole job including the write-back. The Redis step is off:
+nothing but Postgres holds these carts. users and cart_items are dropped and
+recreated, so never point --database-url at a database you care about.
+"""
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Same cart_items as user_service/init_db.py; users only for the foreign key
+SCHEMA_SQL = """
+DROP TABLE IF EXISTS cart_items;
+DROP TABLE IF EXISTS users;
+CREATE TABLE users (id INTEGER PRIMARY KEY);
+CREATE TABLE cart_items (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    product_id VARCHAR(24) NOT NULL,
+    quantity INTEGER NOT NULL DEFAULT 1 CHECK (quantity > 0),
+    price_at_add NUMERIC(10, 2) NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE,
+    CONSTRAINT unique_user_product UNIQUE (user_id, product_id)
+);
+"""
+
+
+def database_url(args) -> str:
+    if args.database_url:
+        return args.database_url
+    try:
+        import pgserver
+    except ImportError:
+        raise SystemExit("without --database-url this needs the optional pgserver package: pip install pgserver")
+    return pgserver.get_server(tempfile.mkdtemp(prefix="cart-repricing-"), cleanup_mode="delete").get_uri()
+
+
+def load(engine, args, product_ids) -> None:
+    """COPY --lines rows, --lines-per-cart distinct products per cart"""
+    rng = np.random.default_rng(42)
+    carts = -(-args.lines // args.lines_per_cart)
+    first_product = rng.integers(0, args.products, carts)
+    raw = engine.raw_connection()
+    try:
+        with raw.cursor() as cursor:
+            cursor.execute(SCHEMA_SQL)
+            cursor.execute("INSERT INTO users (id) SELECT generate_series(1, %s)", (carts,))
+            for start in range(0, args.lines, args.chunk):
+                line = np.arange(start, min(start + args.chunk, args.lines))
+                users = line // args.lines_per_cart
+                codes = (first_product[users] + line % args.lines_per_cart) % args.products
+                quantities = rng.integers(1, 5, len(line))
+                prices = rng.integers(100, 100_000, len(line))
+                buffer = io.StringIO("".join(
+                    f"{user + 1}\t{product_ids[code]}\t{quantity}\t{price / 100:.2f}\n"
+                    for user, code, quantity, price in zip(users.tolist(), codes.tolist(),
+                                                           quantities.tolist(), prices.tolist())
+                ))
+                cursor.copy_expert("COPY cart_items (user_id, product_id, quantity, price_at_add) FROM STDIN",
+                                   buffer)
+            cursor.execute("ANALYZE cart_items")
+        raw.commit()
+    finally:
+        raw.close()
+
+
+def main(args):
+    if args.lines_per_cart > args.products:
+        raise SystemExit("--lines-per-cart cannot exceed --products")
+    # cart_service reads its backends from the environment at import time
+    os.environ["DATABASE_URL"] = database_url(args)
+    os.environ.setdefault("REPRICE_CHUNK_SIZE", str(args.chunk))
+    sys.path[:0] = [os.path.join(ROOT, "cart_service"), ROOT]
+    from database import engine
+    from repricing import reprice
+
+    product_ids = [f"{i:024x}" for i in range(args.products)]
+    started = time.perf_counter()
+    load(engine, args, product_ids)
+    print(f"loaded {args.lines} lines in {time.perf_counter() - started:.1f}s")
+
+    rng = np.random.default_rng(7)
+    changes = {p: float(rng.integers(100, 100_000)) / 100 for p in product_ids}
+    report = reprice(changes, sync_redis=False)
+
+    computed, elapsed = report["compute_seconds"], report["elapsed_seconds"]
+    print(f"lines: {report['lines']}  carts: {report['carts']}  total delta: {report['total_delta']:.2f}")
+    print(f"read + compute: {computed:.1f}s  ({report['lines'] / computed:,.0f} lines/s)")
+    print(f"whole job:      {elapsed:.1f}s  ({report['lines'] / elapsed:,.0f} lines/s, incl. write-back)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default=None)
+    parser.add_argument("--lines", type=int, default=1_000_000)
+    parser.add_argument("--products", type=int, default=1000)
+    parser.add_argument("--lines-per-cart", type=int, default=4)
+    parser.add_argument("--chunk", type=int, default=500_000)
+    main(parser.parse_args())
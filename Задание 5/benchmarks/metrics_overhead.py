@@ -0,0 +1,100 @@
+"""Per-request cost of common.metrics.PrometheusMiddleware.
+
+    python metrics_overhead.py --requests 200000
+
+Calls ASGI apps directly, with no server or sockets, so the difference
+between runs is the middleware alone. Two pairs are compared:
+  bare     a minimal ASGI app that answers immediately, with and without the
+           middleware (no routing: the route label is <unmatched>)
+  fastapi  a FastAPI app with a /items/{item_id} route and a health route
+           behind two paths, with and without the middleware (route template
+           lookup included)
+Each run is repeated and the best one is reported, which filters out
+scheduler noise. The loop-lag probe is disabled so it does not wake up during
+the runs.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from fastapi import FastAPI  # noqa: E402
+from fastapi.responses import Response  # noqa: E402
+
+from common.metrics import PrometheusMiddleware  # noqa: E402
+
+BODY = b'{"id": 1}'
+
+
+async def bare_app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"application/json")]})
+    await send({"type": "http.response.body", "body": BODY})
+
+
+def fastapi_app(with_metrics: bool) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/items/{item_id}")
+    async def read_item(item_id: int):
+        return Response(BODY, media_type="application/json")
+
+    @app.get("/health")
+    @app.get("/healthcheck")
+    async def health():
+        return Response(BODY, media_type="application/json")
+
+    if with_metrics:
+        app.add_middleware(PrometheusMiddleware, lag_interval=0)
+    return app
+
+
+async def receive():
+    return {"type": "http.request", "body": b"", "more_body": False}
+
+
+async def send(message):
+    pass
+
+
+def make_scope(path: str) -> dict:
+    return {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+            "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "", "query_string": b"",
+            "headers": [(b"host", b"localhost")], "client": ("127.0.0.1", 1), "server": ("localhost", 80)}
+
+
+async def run(app, paths, requests: int) -> float:
+    """Seconds per request"""
+    for path in paths:  # warm-up: builds the middleware stack and caches label children
+        await app(make_scope(path), receive, send)
+    started = time.perf_counter()
+    for i in range(requests):
+        await app(make_scope(paths[i % len(paths)]), receive, send)
+    return (time.perf_counter() - started) / requests
+
+
+async def best(app, paths, requests: int, repeat: int) -> float:
+    return min([await run(app, paths, requests) for _ in range(repeat)])
+
+
+async def main(args):
+    paths = ["/items/1", "/items/2", "/healthcheck", "/missing"]
+    pairs = {
+        "bare": (bare_app, PrometheusMiddleware(bare_app, lag_interval=0), ["/items/1"]),
+        "fastapi": (fastapi_app(False), fastapi_app(True), paths),
+    }
+    print(f"{args.requests} requests x {args.repeat}, best run")
+    print(f"{'app':8} {'plain us':>9} {'metrics us':>11} {'overhead us':>12}")
+    for name, (plain, measured, app_paths) in pairs.items():
+        without = await best(plain, app_paths, args.requests, args.repeat)
+        with_metrics = await best(measured, app_paths, args.requests, args.repeat)
+        print(f"{name:8} {without * 1e6:9.2f} {with_metrics * 1e6:11.2f} {(with_metrics - without) * 1e6:12.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,124 @@
+"""Order placement throughput and exactly-once placement under retries.
+
+    python order_placement.py --users 50 --rounds 5 --duplicates 5 --product-id <id>
+
+Every simulated user fills a cart and then fires --duplicates identical
+POST /orders at once, all with one Idempotency-Key, as a client retrying on
+timeouts would. A run passes only if
+- every request of a burst succeeds (200/201, never an error such as an
+  empty-cart 400 seen by a duplicate that lost the race) and the burst
+  resolves to a single order id,
+- each user ends up with exactly --rounds orders, and
+- stock drops by exactly the units that were ordered.
+Tokens are minted with SECRET_KEY like in cart_concurrency.py.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+
+import httpx
+
+from cart_concurrency import mint_token
+
+
+async def place(client: httpx.AsyncClient, args, user_id: int, latencies: list, failures: list):
+    headers = {"Authorization": f"Bearer {mint_token(user_id)}"}
+    await client.delete(f"{args.cart_url}/cart", headers=headers)
+    for _ in range(args.rounds):
+        response = await client.post(f"{args.cart_url}/cart", headers=headers,
+                                     json={"product_id": args.product_id, "quantity": args.quantity})
+        response.raise_for_status()
+        key = uuid.uuid4().hex
+        order_headers = {**headers, "Idempotency-Key": key}
+
+        async def attempt():
+            started = time.perf_counter()
+            response = await client.post(f"{args.orders_url}/orders", headers=order_headers)
+            return time.perf_counter() - started, response
+
+        results = await asyncio.gather(*(attempt() for _ in range(args.duplicates)))
+        latencies.extend(elapsed for elapsed, _ in results)
+        codes = [r.status_code for _, r in results]
+        ids = {r.json()["id"] for _, r in results if r.status_code in (200, 201)}
+        if len(ids) != 1 or codes.count(201) != 1 or any(code not in (200, 201) for code in codes):
+            failures.append((user_id, key, codes, ids))
+
+
+async def user_orders(client: httpx.AsyncClient, args, users) -> list:
+    orders = []
+    for user_id in users:
+        headers = {"Authorization": f"Bearer {mint_token(user_id)}"}
+        response = await client.get(f"{args.orders_url}/orders", headers=headers, params={"limit": 500})
+        response.raise_for_status()
+        orders.append(response.json())
+    return orders
+
+
+async def run(args):
+    limits = httpx.Limits(max_connections=args.connections, max_keepalive_connections=args.connections)
+    async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+        stock = args.users * args.rounds * args.quantity
+        response = await client.put(f"{args.orders_url}/admin/inventory/{args.product_id}",
+                                    json={"available": stock})
+        response.raise_for_status()
+
+        latencies, failures = [], []
+        users = range(args.first_user, args.first_user + args.users)
+        before = [len(orders) for orders in await user_orders(client, args, users)]
+        started = time.perf_counter()
+        await asyncio.gather(*(place(client, args, user_id, latencies, failures) for user_id in users))
+        elapsed = time.perf_counter() - started
+
+        after = [len(orders) for orders in await user_orders(client, args, users)]
+        orders_per_user = [a - b for a, b in zip(after, before)]
+        left = (await client.get(f"{args.orders_url}/admin/inventory/{args.product_id}")).json()["available"]
+
+        confirmed = None
+        if args.wait_confirmed:
+            deadline = time.monotonic() + args.wait_confirmed
+            while time.monotonic() < deadline:
+                statuses = [order["status"]
+                            for orders, skip in zip(await user_orders(client, args, users), before)
+                            for order in orders[:len(orders) - skip]]
+                confirmed = statuses.count("confirmed")
+                if confirmed == len(statuses):
+                    break
+                await asyncio.sleep(1)
+
+    orders = args.users * args.rounds
+    latencies.sort()
+    print(f"orders:      {orders} ({args.users} users x {args.rounds}), {args.duplicates} requests each")
+    print(f"throughput:  {orders / elapsed:.0f} orders/s ({len(latencies) / elapsed:.0f} req/s)")
+    print(f"latency p50: {statistics.median(latencies) * 1000:.1f} ms")
+    print(f"latency p99: {latencies[int(len(latencies) * 0.99) - 1] * 1000:.1f} ms")
+    print(f"stock left:  {left} (expected 0)")
+    if confirmed is not None:
+        print(f"confirmed:   {confirmed}/{orders}")
+    problems = []
+    if failures:
+        problems.append(f"{len(failures)} bursts failed or did not resolve to exactly one order: "
+                        f"{failures[:3]}")
+    if any(count != args.rounds for count in orders_per_user):
+        problems.append(f"orders per user differ from {args.rounds}: {sorted(set(orders_per_user))}")
+    if left != 0:
+        problems.append(f"stock left is {left}, expected 0")
+    if problems:
+        raise SystemExit("order placement check failed:\n" + "\n".join(problems))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders-url", default="http://localhost:8004")
+    parser.add_argument("--cart-url", default="http://localhost:8002")
+    parser.add_argument("--product-id", default="6463a1f0c2a4b5d6e7f80912")
+    parser.add_argument("--first-user", type=int, default=1)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--quantity", type=int, default=1)
+    parser.add_argument("--duplicates", type=int, default=5)
+    parser.add_argument("--connections", type=int, default=200)
+    parser.add_argument("--wait-confirmed", type=float, default=0,
+                        help="seconds to wait for the outbox to confirm every order")
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,90 @@
+"""Build time, memory and lookup latency of the co-occurrence recommendation model.
+
+    python recommendations.py --carts 1000000 --products 20000
+
+Generates carts with Zipf-distributed product popularity, builds the model
+straight from arrays (no Postgres), then times recommend() lookups, the
+endpoint handler and one incremental refresh.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "recommendation_service"))
+
+from model import CoOccurrenceModel  # noqa: E402
+
+
+def percentiles(samples_ns):
+    samples = np.asarray(samples_ns) / 1000
+    return "p50 {:.1f}us  p99 {:.1f}us  max {:.1f}us".format(
+        np.percentile(samples, 50), np.percentile(samples, 99), samples.max())
+
+
+def synthetic_carts(rng, carts, products, mean_lines, skew):
+    sizes = 1 + rng.poisson(mean_lines - 1, carts)
+    users = np.repeat(np.arange(carts, dtype=np.int64), sizes)
+    weights = 1 / np.arange(1, products + 1) ** skew
+    items = rng.choice(products, size=len(users), p=weights / weights.sum()).astype(np.int32)
+    return users, items
+
+
+def main(args):
+    rng = np.random.default_rng(42)
+    users, items = synthetic_carts(rng, args.carts, args.products, args.lines_per_cart, args.skew)
+    print(f"carts: {args.carts:,}  lines: {len(users):,}  products: {args.products:,}")
+
+    model = CoOccurrenceModel(top_k=args.top_k)
+    for i in range(args.products):
+        model.intern(f"{i:024x}")
+    started = time.perf_counter()
+    model.build_from_arrays(users, items)
+    print(f"build: {time.perf_counter() - started:.2f}s  {model.stats()}")
+
+    product_ids = model.product_ids
+    queries = [product_ids[i] for i in rng.integers(0, args.products, args.queries)]
+    samples = []
+    for product_id in queries:
+        t = time.perf_counter_ns()
+        model.recommend(product_id, 10)
+        samples.append(time.perf_counter_ns() - t)
+    print(f"recommend(): {percentiles(samples)}")
+
+    import main as service  # noqa: E402
+
+    service.model, service.ready = model, True
+
+    async def handler():
+        samples = []
+        for product_id in queries[:args.queries // 10]:
+            t = time.perf_counter_ns()
+            await service.get_recommendations(product_id, 10)
+            samples.append(time.perf_counter_ns() - t)
+        return samples
+
+    print(f"handler:     {percentiles(asyncio.run(handler()))}")
+
+    # Incremental: new lines into existing and new carts
+    for _ in range(args.events):
+        model.add(int(rng.integers(0, args.carts * 2)), product_ids[int(rng.integers(0, args.products))])
+    started = time.perf_counter()
+    dirty = model.refresh(*model.take_delta())
+    print(f"refresh: {args.events:,} events, {dirty:,} products re-ranked in "
+          f"{time.perf_counter() - started:.2f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--carts", type=int, default=1_000_000)
+    parser.add_argument("--products", type=int, default=20_000)
+    parser.add_argument("--lines-per-cart", type=float, default=4.0)
+    parser.add_argument("--skew", type=float, default=1.0, help="Zipf exponent of product popularity")
+    parser.add_argument("--top-k", type=int, default=20)
+    parser.add_argument("--queries", type=int, default=100_000)
+    parser.add_argument("--events", type=int, default=10_000)
+    main(parser.parse_args())
@@ -0,0 +1,158 @@
+"""How dependency tail latency propagates into order placement, with and without hedging.
+
+    python tail_latency.py --orders 2000 --concurrency 10
+
+Starts the payment and delivery stubs as local uvicorn processes, then plays
+the downstream half of order placement: the payment and delivery calls of
+each order run concurrently through order_service's Downstream client, so an
+order is as slow as the slower of its two calls. Every mode is run twice,
+without and with hedged requests, and reports p50/p99/p99.9 per dependency
+and per order, deadline misses and the extra load hedging put on the stubs.
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+import uuid
+
+import httpx
+import numpy as np
+
+HERE = os.path.dirname(__file__)
+STUBS_DIR = os.path.join(HERE, "..", "stubs")
+
+sys.path.insert(0, os.path.join(HERE, ".."))
+sys.path.insert(0, os.path.join(HERE, "..", "order_service"))
+
+import clients  # noqa: E402
+from common.http import deadline  # noqa: E402
+
+
+def start_stub(name: str, port: int, args) -> subprocess.Popen:
+    env = {**os.environ, "STUB_NAME": name, "STUB_LATENCY_DIST": args.distribution,
+           "STUB_LATENCY_MS": str(args.latency_ms), "STUB_LATENCY_SPREAD": str(args.spread),
+           "STUB_TAIL_PROBABILITY": str(args.tail_probability), "STUB_TAIL_MS": str(args.tail_ms),
+           "STUB_ERROR_RATE": str(args.error_rate)}
+    return subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(port),
+                             "--log-level", "warning"], cwd=STUBS_DIR, env=env)
+
+
+async def wait_ready(urls):
+    async with httpx.AsyncClient() as client:
+        for url in urls:
+            for _ in range(100):
+                try:
+                    if (await client.get(f"{url}/health")).status_code == 200:
+                        break
+                except httpx.HTTPError:
+                    pass
+                await asyncio.sleep(0.1)
+            else:
+                raise SystemExit(f"stub at {url} did not start")
+
+
+async def stub_requests(urls) -> int:
+    total = 0
+    async with httpx.AsyncClient() as client:
+        for url in urls:
+            for line in (await client.get(f"{url}/metrics")).text.splitlines():
+                if line.startswith("stub_requests_total{"):
+                    total += float(line.rsplit(" ", 1)[1])
+    return int(total)
+
+
+async def run_mode(args, hedging: bool, urls) -> dict:
+    downstream = clients.Downstream(deadline=args.call_deadline, hedging=hedging)
+    await downstream.start()
+    timings = {"payment": [], "delivery": [], "order": []}
+    misses = errors = 0
+    queue = asyncio.Queue()
+
+    async def call(topic, order_id):
+        started = time.perf_counter()
+        await downstream.send(topic, {"order_id": order_id}, f"bench-{order_id}-{topic}")
+        timings[topic].append(time.perf_counter() - started)
+
+    async def worker():
+        nonlocal misses, errors
+        while not queue.empty():
+            queue.get_nowait()
+            order_id = uuid.uuid4().hex
+            started = time.perf_counter()
+            try:
+                with deadline(args.order_deadline):
+                    await asyncio.gather(call("payment", order_id), call("delivery", order_id))
+                timings["order"].append(time.perf_counter() - started)
+            except asyncio.TimeoutError:
+                misses += 1
+            except httpx.HTTPError:
+                errors += 1
+
+    async def drive(orders: int) -> float:
+        for _ in range(orders):
+            queue.put_nowait(None)
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        return time.perf_counter() - started
+
+    # Warm up the latency windows the hedge delay is derived from
+    await drive(200)
+    timings = {name: [] for name in timings}
+    misses = errors = 0
+    before = await stub_requests(urls)
+    elapsed = await drive(args.orders)
+    sent = await stub_requests(urls) - before
+    await downstream.close()
+    return {"timings": timings, "misses": misses, "errors": errors, "elapsed": elapsed,
+            "amplification": sent / (2 * args.orders)}
+
+
+def report(title: str, result: dict):
+    print(f"\n{title}: {result['elapsed']:.1f}s, deadline misses {result['misses']}, "
+          f"errors {result['errors']}, stub requests per call {result['amplification']:.3f}")
+    for name, samples in result["timings"].items():
+        if not samples:
+            continue
+        ms = np.asarray(samples) * 1000
+        p50, p99, p999 = np.percentile(ms, [50, 99, 99.9])
+        print(f"  {name:<9} p50 {p50:7.1f} ms  p99 {p99:7.1f} ms  p99.9 {p999:7.1f} ms  max {ms.max():7.1f} ms")
+
+
+async def main(args):
+    ports = {"payment": args.port, "delivery": args.port + 1}
+    urls = [f"http://127.0.0.1:{port}" for port in ports.values()]
+    clients.TOPICS["payment"] = (urls[0], "/payments")
+    clients.TOPICS["delivery"] = (urls[1], "/deliveries")
+    stubs = [start_stub(name, port, args) for name, port in ports.items()]
+    try:
+        await wait_ready(urls)
+        print(f"stubs: {args.distribution} median {args.latency_ms} ms spread {args.spread}, "
+              f"tail {args.tail_probability:.1%} at {args.tail_ms} ms, errors {args.error_rate:.1%}")
+        # With two independent calls per order, P(order hits a dependency's p99) = 1 - 0.99^2
+        print(f"orders: {args.orders} x (payment || delivery), concurrency {args.concurrency}, "
+              f"order deadline {args.order_deadline}s")
+        report("without hedging", await run_mode(args, False, urls))
+        report("with hedging", await run_mode(args, True, urls))
+    finally:
+        for stub in stubs:
+            stub.terminate()
+            stub.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--port", type=int, default=18010)
+    parser.add_argument("--distribution", default="lognormal",
+                        choices=["fixed", "uniform", "normal", "lognormal", "exponential"])
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--spread", type=float, default=0.5)
+    parser.add_argument("--tail-probability", type=float, default=0.01)
+    parser.add_argument("--tail-ms", type=float, default=500)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--call-deadline", type=float, default=2.0)
+    parser.add_argument("--order-deadline", type=float, default=3.0)
+    asyncio.run(main(parser.parse_args()))
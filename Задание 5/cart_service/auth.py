@@ -0,0 +1,37 @@
+import os
+from fastapi import Depends, HTTPException, status
+from fastapi.security import OAuth2PasswordBearer
+from jose import JWTError, jwt
+
+# Tokens are issued by user_service with the same secret
+SECRET_KEY = os.getenv("SECRET_KEY", "fallback-secret-key")
+ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
+
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+
+
+def _access_payload(token: str) -> dict:
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        raise credentials_exception
+    if payload.get("type", "access") != "access" or payload.get("uid") is None:
+        raise credentials_exception
+    return payload
+
+
+def get_current_user_id(token: str = Depends(oauth2_scheme)) -> int:
+    return int(_access_payload(token)["uid"])
+
+
+def get_admin_user_id(token: str = Depends(oauth2_scheme)) -> int:
+    payload = _access_payload(token)
+    # role is put into the token by user_service /token
+    if payload.get("role") != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin privileges required")
+    return int(payload["uid"])
@@ -0,0 +1,212 @@
+import asyncio
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+from redis.asyncio import Redis
+from sqlalchemy import text
+from database import SessionLocal, redis_client
+from events import emit
+from product_client import product_client
+from schemas import Cart, CartItem, CartLine, CartSummary
+
+# Sliding TTL: every mutation pushes the expiry of the whole cart forward
+CART_TTL_SECONDS = int(os.getenv("CART_TTL_SECONDS", str(7 * 24 * 3600)))
+
+# Carts untouched for this long are expired by the sweeper (see expiry.py)
+CART_IDLE_TTL_SECONDS = int(os.getenv("CART_IDLE_TTL_SECONDS", str(CART_TTL_SECONDS)))
+# Width of one activity bucket: cart:active:{n} holds users that changed their cart in it
+ACTIVITY_BUCKET_SECONDS = int(os.getenv("CART_ACTIVITY_BUCKET_SECONDS", "60"))
+# Buckets are deleted by the sweeper; the TTL only bounds them if it is not running
+ACTIVITY_BUCKET_TTL = 2 * CART_IDLE_TTL_SECONDS + ACTIVITY_BUCKET_SECONDS
+
+# Carts changed in Redis but not yet written to Postgres; score = first unflushed change
+DIRTY_KEY = "cart:dirty"
+
+# Hash layout: {product_id} -> quantity, price:{product_id} -> price_at_add,
+# plus service fields: __loaded__ marks a cart present in Redis (even when empty),
+# __v is bumped on every mutation so the flusher can tell whether it is behind,
+# __count/__lines/__subtotal (kopecks) are running aggregates kept in step with
+# every mutation, so the cart summary never needs to scan the lines;
+# __touched is the time of the last mutation.
+LOADED_FIELD = "__loaded__"
+VERSION_FIELD = "__v"
+COUNT_FIELD = "__count"
+LINES_FIELD = "__lines"
+SUBTOTAL_FIELD = "__subtotal"
+TOUCHED_FIELD = "__touched"
+PRICE_PREFIX = "price:"
+
+# Set or increment one line and adjust the aggregates by the difference.
+# Returns nil when the cart is not in Redis, so the caller loads it from
+# Postgres and retries; otherwise {old quantity, new quantity}.
+CHANGE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then return nil end
+local product_id = ARGV[1]
+local old = tonumber(redis.call('HGET', KEYS[1], product_id) or '0')
+local new
+if ARGV[2] == 'set' then new = tonumber(ARGV[3]) else new = old + tonumber(ARGV[3]) end
+if new < 0 then new = 0 end
+redis.call('HSET', KEYS[1], '__touched', ARGV[6])
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+redis.call('SADD', KEYS[3], ARGV[7])
+redis.call('EXPIRE', KEYS[3], ARGV[8])
+if new == old then return {old, new} end
+local price = redis.call('HGET', KEYS[1], 'price:' .. product_id) or ARGV[4]
+local kopecks = math.floor(tonumber(price) * 100 + 0.5)
+if new == 0 then
+    redis.call('HDEL', KEYS[1], product_id, 'price:' .. product_id)
+    redis.call('HINCRBY', KEYS[1], '__lines', -1)
+else
+    redis.call('HSET', KEYS[1], product_id, new, 'price:' .. product_id, price)
+    if old == 0 then redis.call('HINCRBY', KEYS[1], '__lines', 1) end
+end
+redis.call('HINCRBY', KEYS[1], '__count', new - old)
+redis.call('HINCRBY', KEYS[1], '__subtotal', (new - old) * kopecks)
+redis.call('HINCRBY', KEYS[1], '__v', 1)
+redis.call('ZADD', KEYS[2], 'NX', ARGV[6], ARGV[7])
+return {old, new}
+"""
+
+CLEAR_SCRIPT = """
+local version = tonumber(redis.call('HGET', KEYS[1], '__v') or '0')
+redis.call('DEL', KEYS[1])
+redis.call('HSET', KEYS[1], '__loaded__', 1, '__v', version + 1,
+           '__count', 0, '__lines', 0, '__subtotal', 0, '__touched', ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+redis.call('ZADD', KEYS[2], 'NX', ARGV[2], ARGV[3])
+redis.call('SADD', KEYS[3], ARGV[3])
+redis.call('EXPIRE', KEYS[3], ARGV[4])
+return 1
+"""
+
+# Populate from Postgres only if nobody created the cart in the meantime
+LOAD_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then return 0 end
+redis.call('HSET', KEYS[1], (table.unpack or unpack)(ARGV, 2))
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return 1
+"""
+
+change_script = redis_client.register_script(CHANGE_SCRIPT)
+clear_script = redis_client.register_script(CLEAR_SCRIPT)
+load_script = redis_client.register_script(LOAD_SCRIPT)
+
+
+def cart_key(user_id: int) -> str:
+    return f"cart:{user_id}"
+
+
+def activity_bucket(timestamp: float) -> int:
+    return int(timestamp // ACTIVITY_BUCKET_SECONDS)
+
+
+def activity_key(bucket: int) -> str:
+    return f"cart:active:{bucket}"
+
+
+def parse_cart(fields: Dict[str, str]) -> Tuple[List[CartItem], Dict[str, float]]:
+    items, prices = [], {}
+    for field, value in fields.items():
+        if field.startswith("__"):
+            continue
+        if field.startswith(PRICE_PREFIX):
+            prices[field[len(PRICE_PREFIX):]] = float(value)
+        else:
+            items.append(CartItem(product_id=field, quantity=int(value)))
+    return items, prices
+
+
+def _select_cart(user_id: int) -> List[tuple]:
+    with SessionLocal() as db:
+        return db.execute(
+            text("SELECT product_id, quantity, price_at_add FROM cart_items WHERE user_id = :user_id"),
+            {"user_id": user_id},
+        ).all()
+
+
+async def load_cart(redis: Redis, user_id: int) -> None:
+    """Cache miss: bring the persisted cart back into Redis"""
+    rows = await asyncio.to_thread(_select_cart, user_id)
+    count = subtotal = 0
+    mapping = []
+    for product_id, quantity, price in rows:
+        mapping += [product_id, quantity, PRICE_PREFIX + product_id, str(price)]
+        count += quantity
+        subtotal += int(round(price * 100)) * quantity
+    mapping += [LOADED_FIELD, 1, VERSION_FIELD, 0, COUNT_FIELD, count,
+                LINES_FIELD, len(rows), SUBTOTAL_FIELD, subtotal]
+    await load_script(keys=[cart_key(user_id)], args=[CART_TTL_SECONDS, *mapping], client=redis)
+
+
+async def _run_loaded(redis: Redis, user_id: int, script, now: float, *args):
+    keys = [cart_key(user_id), DIRTY_KEY, activity_key(activity_bucket(now))]
+    result = await script(keys=keys, args=args, client=redis)
+    if result is None:
+        await load_cart(redis, user_id)
+        result = await script(keys=keys, args=args, client=redis)
+    return result
+
+
+async def get_cart_with_prices(redis: Redis, user_id: int) -> Tuple[List[CartItem], Dict[str, float]]:
+    fields = await redis.hgetall(cart_key(user_id))
+    if not fields:
+        await load_cart(redis, user_id)
+        fields = await redis.hgetall(cart_key(user_id))
+    return parse_cart(fields)
+
+
+async def get_cart(redis: Redis, user_id: int) -> List[CartItem]:
+    items, _ = await get_cart_with_prices(redis, user_id)
+    return items
+
+
+async def enrich_cart(items: List[CartItem]) -> Cart:
+    products = await product_client.get_products(item.product_id for item in items)
+    lines, total = [], 0.0
+    for item in items:
+        product = products.get(item.product_id)
+        if product is None:
+            lines.append(CartLine(**item.dict(), available=False))
+            continue
+        line_total = round(product["price"] * item.quantity, 2)
+        total += line_total
+        lines.append(CartLine(**item.dict(), name=product["name"],
+                              price=product["price"], line_total=line_total))
+    return Cart(items=lines, total=round(total, 2),
+                items_count=sum(item.quantity for item in items))
+
+
+async def change_item(redis: Redis, user_id: int, product_id: str, mode: str,
+                      value: int, price: Optional[float] = None) -> Tuple[int, int]:
+    """mode "set" replaces the quantity, "incr" adds value (negative to decrement);
+    a resulting quantity of 0 removes the line"""
+    now = time.time()
+    old, new = await _run_loaded(redis, user_id, change_script, now, product_id, mode, value,
+                                 "" if price is None else price, CART_TTL_SECONDS,
+                                 now, user_id, ACTIVITY_BUCKET_TTL)
+    if old != new:
+        emit("cart_item_changed", {"user_id": user_id, "product_id": product_id,
+                                   "old_quantity": old, "quantity": new, "price": price})
+    return old, new
+
+
+async def get_summary(redis: Redis, user_id: int) -> CartSummary:
+    key = cart_key(user_id)
+    count, lines, subtotal = await redis.hmget(key, COUNT_FIELD, LINES_FIELD, SUBTOTAL_FIELD)
+    if count is None:
+        await load_cart(redis, user_id)
+        count, lines, subtotal = await redis.hmget(key, COUNT_FIELD, LINES_FIELD, SUBTOTAL_FIELD)
+    return CartSummary(items_count=int(count or 0), lines=int(lines or 0),
+                       subtotal=int(subtotal or 0) / 100)
+
+
+async def clear_cart(redis: Redis, user_id: int) -> None:
+    now = time.time()
+    await clear_script(keys=[cart_key(user_id), DIRTY_KEY, activity_key(activity_bucket(now))],
+                       args=[CART_TTL_SECONDS, now, user_id, ACTIVITY_BUCKET_TTL], client=redis)
+    emit("cart_cleared", {"user_id": user_id})
+
+
+async def get_product_price(product_id: str) -> Optional[float]:
+    product = (await product_client.get_products([product_id])).get(product_id)
+    return product["price"] if product else None
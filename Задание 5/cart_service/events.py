@@ -0,0 +1,48 @@
+import json
+import logging
+import os
+import time
+from typing import Callable, List
+
+from prometheus_client import Counter
+
+logger = logging.getLogger("cart.events")
+
+# Stream that downstream services (recommendations, orders) consume
+CART_EVENTS_STREAM = os.getenv("CART_EVENTS_STREAM", "events:cart")
+
+CART_EVENTS = Counter("cart_events_total", "Cart events emitted", ["type"])
+
+Sink = Callable[[dict], None]
+
+
+def log_sink(event: dict) -> None:
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(json.dumps(event, default=str))
+
+
+_sinks: List[Sink] = [log_sink]
+
+
+def add_sink(sink: Sink) -> None:
+    _sinks.append(sink)
+
+
+def publish_to_stream(redis):
+    """Routes every event to CART_EVENTS_STREAM; the caller starts and stops the producer."""
+    from common.streams import StreamProducer
+
+    producer = StreamProducer(redis)
+    add_sink(lambda event: producer.publish(CART_EVENTS_STREAM, event["type"], event))
+    return producer
+
+
+def emit(event_type: str, payload: dict) -> None:
+    """Hands an event to every sink; sinks must not block the event loop."""
+    event = {"type": event_type, "ts": time.time(), **payload}
+    CART_EVENTS.labels(event_type).inc()
+    for sink in _sinks:
+        try:
+            sink(event)
+        except Exception:
+            logger.exception("Event sink failed for %s", event_type)
@@ -0,0 +1,198 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from prometheus_client import Counter, Gauge, Histogram
+from redis.asyncio import Redis
+from sqlalchemy import text
+
+from crud import (ACTIVITY_BUCKET_SECONDS, ACTIVITY_BUCKET_TTL, CART_IDLE_TTL_SECONDS,
+                  COUNT_FIELD, DIRTY_KEY, SUBTOTAL_FIELD, TOUCHED_FIELD,
+                  activity_bucket, activity_key, cart_key, parse_cart)
+from database import SessionLocal
+from events import emit
+from write_behind import FLUSH_LOCK_KEY, FLUSH_LOCK_TTL_MS, RELEASE_SCRIPT
+
+logger = logging.getLogger(__name__)
+
+SWEEP_INTERVAL = float(os.getenv("CART_SWEEP_INTERVAL_SECONDS", "30"))
+SWEEP_BATCH_SIZE = int(os.getenv("CART_SWEEP_BATCH_SIZE", "200"))
+# Upper bound on buckets walked per pass, so a long outage is caught up gradually
+SWEEP_MAX_BUCKETS = int(os.getenv("CART_SWEEP_MAX_BUCKETS", "60"))
+SWEEP_LOCK_KEY = "cart:sweep:lock"
+SWEEP_LOCK_TTL_MS = int(os.getenv("CART_SWEEP_LOCK_TTL_MS", "60000"))
+# Last bucket that has been swept completely
+SWEEP_CURSOR_KEY = "cart:sweep:cursor"
+
+CART_SWEEP_DURATION = Histogram("cart_sweep_duration_seconds", "Duration of one sweep pass")
+CART_SWEEP_LAG = Gauge("cart_sweep_lag_buckets", "Expired activity buckets not swept yet")
+CART_SWEEP_ERRORS = Counter("cart_sweep_errors_total", "Failed sweep passes")
+
+# Drop carts that have been idle since before the cutoff. A cart changed after
+# it was indexed is also in a newer bucket and is left alone here. Returns
+# {user_id, flat HGETALL} per removed cart (empty when it had already expired).
+EXPIRE_SCRIPT = """
+local result = {}
+local cutoff = tonumber(ARGV[1])
+for i = 2, #KEYS do
+    local touched = tonumber(redis.call('HGET', KEYS[i], '__touched') or '0')
+    if touched <= cutoff then
+        result[#result + 1] = {ARGV[i], redis.call('HGETALL', KEYS[i])}
+        redis.call('DEL', KEYS[i])
+        redis.call('ZREM', KEYS[1], ARGV[i])
+    end
+end
+return result
+"""
+
+# Persisted lines of expired carts, unless the cart was written after the cutoff
+DELETE_EXPIRED_SQL = text("""
+DELETE FROM cart_items c
+WHERE c.user_id = ANY(CAST(:user_ids AS integer[]))
+  AND NOT EXISTS (
+      SELECT 1 FROM cart_items f
+      WHERE f.user_id = c.user_id
+        AND COALESCE(f.updated_at, f.created_at) > to_timestamp(:cutoff)
+  )
+RETURNING c.user_id, c.product_id, c.quantity, c.price_at_add
+""")
+
+
+def _delete_expired(user_ids: List[int], cutoff: float) -> List[tuple]:
+    with SessionLocal() as db:
+        with db.begin():
+            return db.execute(DELETE_EXPIRED_SQL, {"user_ids": user_ids, "cutoff": cutoff}).all()
+
+
+class RedisCartSweeper:
+    """Expires carts idle for longer than CART_IDLE_TTL_SECONDS.
+
+    Every mutation adds the user to the activity bucket of its minute
+    (crud.activity_key), so a pass only reads the buckets that fell behind the
+    cutoff since the last one and never scans the whole keyspace. Expired carts
+    are removed from Redis and Postgres and reported as cart_expired events.
+    """
+
+    def __init__(self, redis: Redis, idle_ttl: float = CART_IDLE_TTL_SECONDS,
+                 interval: float = SWEEP_INTERVAL, batch_size: int = SWEEP_BATCH_SIZE,
+                 max_buckets: int = SWEEP_MAX_BUCKETS):
+        self.redis = redis
+        self.idle_ttl = idle_ttl
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_buckets = max_buckets
+        self._expire = redis.register_script(EXPIRE_SCRIPT)
+        self._release = redis.register_script(RELEASE_SCRIPT)
+        self._task: Optional[asyncio.Task] = None
+
+    async def _remove(self, user_ids: List[str], cutoff: float):
+        # Holding the flush lock keeps the flusher from writing back a snapshot
+        # of a cart taken just before it was expired
+        token = uuid.uuid4().hex
+        while not await self.redis.set(FLUSH_LOCK_KEY, token, nx=True, px=FLUSH_LOCK_TTL_MS):
+            await asyncio.sleep(0.05)
+        try:
+            removed = await self._expire(keys=[DIRTY_KEY, *(cart_key(int(u)) for u in user_ids)],
+                                         args=[cutoff, *user_ids])
+            if not removed:
+                return [], []
+            rows = await asyncio.to_thread(_delete_expired, [int(u) for u, _ in removed], cutoff)
+            return removed, rows
+        finally:
+            await self._release(keys=[FLUSH_LOCK_KEY], args=[token])
+
+    async def _expire_batch(self, user_ids: List[str], cutoff: float) -> int:
+        removed, rows = await self._remove(user_ids, cutoff)
+        snapshots: Dict[int, dict] = {}
+        for user_id, flat in removed:
+            snapshots[int(user_id)] = dict(zip(flat[::2], flat[1::2]))
+        persisted = defaultdict(list)
+        for user_id, product_id, quantity, price in rows:
+            persisted[user_id].append({"product_id": product_id, "quantity": quantity,
+                                       "price": float(price)})
+
+        for user_id, fields in snapshots.items():
+            if fields:
+                items, prices = parse_cart(fields)
+                lines = [{"product_id": item.product_id, "quantity": item.quantity,
+                          "price": prices.get(item.product_id)} for item in items]
+                subtotal = int(fields.get(SUBTOTAL_FIELD, 0)) / 100
+                count = int(fields.get(COUNT_FIELD, 0))
+                last_activity = float(fields.get(TOUCHED_FIELD, 0)) or None
+            else:
+                # Gone from Redis already; what Postgres held is the last state
+                lines = persisted.get(user_id, [])
+                subtotal = round(sum(line["price"] * line["quantity"] for line in lines), 2)
+                count = sum(line["quantity"] for line in lines)
+                last_activity = None
+            if lines:
+                emit("cart_expired", {"user_id": user_id, "items": lines, "items_count": count,
+                                      "subtotal": subtotal, "last_activity": last_activity})
+        return len(snapshots)
+
+    async def _sweep_bucket(self, bucket: int, cutoff: float) -> int:
+        key = activity_key(bucket)
+        expired, cursor = 0, 0
+        while True:
+            cursor, members = await self.redis.sscan(key, cursor, count=self.batch_size)
+            if members:
+                expired += await self._expire_batch(list(members), cutoff)
+            if cursor == 0:
+                break
+        await self.redis.delete(key)
+        return expired
+
+    async def sweep_once(self, now: Optional[float] = None) -> int:
+        """One pass over the buckets that fell behind the cutoff; returns carts expired."""
+        token = uuid.uuid4().hex
+        if not await self.redis.set(SWEEP_LOCK_KEY, token, nx=True, px=SWEEP_LOCK_TTL_MS):
+            return 0
+        try:
+            started = time.perf_counter()
+            cutoff = (now or time.time()) - self.idle_ttl
+            # Buckets strictly before the one holding the cutoff are fully idle
+            last = activity_bucket(cutoff) - 1
+            cursor = await self.redis.get(SWEEP_CURSOR_KEY)
+            if cursor is None:
+                # Older buckets have expired on their own
+                first = last - ACTIVITY_BUCKET_TTL // ACTIVITY_BUCKET_SECONDS
+            else:
+                first = int(cursor) + 1
+            expired = 0
+            bucket = first
+            for bucket in range(first, min(last, first + self.max_buckets - 1) + 1):
+                expired += await self._sweep_bucket(bucket, cutoff)
+                await self.redis.set(SWEEP_CURSOR_KEY, bucket)
+            CART_SWEEP_LAG.set(max(0, last - bucket))
+            CART_SWEEP_DURATION.observe(time.perf_counter() - started)
+            return expired
+        finally:
+            await self._release(keys=[SWEEP_LOCK_KEY], args=[token])
+
+    async def run(self):
+        while True:
+            try:
+                await self.sweep_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                CART_SWEEP_ERRORS.inc()
+                logger.exception("Cart sweep failed")
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> asyncio.Task:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+        return self._task
+
+    async def stop(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
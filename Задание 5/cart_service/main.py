@@ -1,29 +1,39 @@
-from fastapi import FastAPI, HTTPException, status
-from fastapi.responses import RedirectResponse
-from pydantic import BaseModel
-from typing import List
+import asyncio
+from fastapi import FastAPI, HTTPException, status, Depends
+from fastapi.responses import RedirectResponse, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+import crud
+from auth import get_admin_user_id, get_current_user_id
+from database import cache_bus
+from product_client import product_client
+from repricing import reprice
+from schemas import Cart, CartDelta, CartItem, CartQuantity, CartSummary, RepriceRequest
+from storage import CART_BACKEND, get_store, store as cart_store
+from common.loopwatch import install_loop_diagnostics
+from common.metrics import PrometheusMiddleware
 
 
 app = FastAPI(
     title="Cart Service API",
     description="API для корзины покупок",
-    version="1.0.0"
+    version="1.1.0"
 )
+app.add_middleware(PrometheusMiddleware)
+install_loop_diagnostics(app)
 
 
-fake_cart = []
+@app.on_event("startup")
+async def startup_event():
+    await product_client.start()
+    await cache_bus.start()
+    await cart_store.start()
 
-class CartItem(BaseModel):
-    product_id: int
-    quantity: int
 
-    class Config:
-        schema_extra = {
-            "example": {
-                "product_id": 1,
-                "quantity": 2
-            }
-        }
+@app.on_event("shutdown")
+async def shutdown_event():
+    await cart_store.stop()
+    await cache_bus.stop()
+    await product_client.close()
 
 
 @app.get("/", include_in_schema=False)
@@ -32,38 +42,118 @@ async def root():
 
 
 @app.get("/cart", 
-         response_model=List[CartItem],
+         response_model=Cart,
          tags=["Cart"])
-def get_cart():
-    return fake_cart
+async def get_cart(user_id: int = Depends(get_current_user_id),
+                   store=Depends(get_store)):
+    return await crud.enrich_cart(await store.get_cart(user_id))
+
+
+async def _price_for(product_id: str) -> float:
+    price = await crud.get_product_price(product_id)
+    if price is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Товар не найден"
+        )
+    return price
 
 
 @app.post("/cart", 
           response_model=CartItem,
           status_code=status.HTTP_201_CREATED,
           tags=["Cart"])
-def add_to_cart(item: CartItem):
+async def add_to_cart(item: CartItem,
+                      user_id: int = Depends(get_current_user_id),
+                      store=Depends(get_store)):
     if item.quantity < 1:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Минимум 1"
         )
-    fake_cart.append(item)
-    return item
+    price = await _price_for(item.product_id)
+    _, quantity = await store.change_item(user_id, item.product_id, "incr", item.quantity, price)
+    return CartItem(product_id=item.product_id, quantity=quantity)
+
+
+@app.get("/cart/summary",
+         response_model=CartSummary,
+         tags=["Cart"])
+async def get_cart_summary(user_id: int = Depends(get_current_user_id),
+                           store=Depends(get_store)):
+    return await store.get_summary(user_id)
+
+
+@app.put("/cart/{product_id}",
+         response_model=CartItem,
+         tags=["Cart"])
+async def set_quantity(product_id: str, body: CartQuantity,
+                       user_id: int = Depends(get_current_user_id),
+                       store=Depends(get_store)):
+    price = await _price_for(product_id) if body.quantity > 0 else None
+    _, quantity = await store.change_item(user_id, product_id, "set", body.quantity, price)
+    return CartItem(product_id=product_id, quantity=quantity)
+
+
+@app.patch("/cart/{product_id}",
+           response_model=CartItem,
+           tags=["Cart"])
+async def change_quantity(product_id: str, body: CartDelta,
+                          user_id: int = Depends(get_current_user_id),
+                          store=Depends(get_store)):
+    price = await _price_for(product_id) if body.delta > 0 else None
+    _, quantity = await store.change_item(user_id, product_id, "incr", body.delta, price)
+    return CartItem(product_id=product_id, quantity=quantity)
+
+
+@app.delete("/cart/{product_id}", 
+            status_code=status.HTTP_204_NO_CONTENT,
+            tags=["Cart"])
+async def remove_from_cart(product_id: str,
+                           user_id: int = Depends(get_current_user_id),
+                           store=Depends(get_store)):
+    old, _ = await store.change_item(user_id, product_id, "set", 0)
+    if old == 0:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Товара нет в корзине"
+        )
+    return None
 
 
 @app.delete("/cart", 
             status_code=status.HTTP_204_NO_CONTENT,
             tags=["Cart"])
-def clear_cart():
-    fake_cart.clear()
+async def clear_cart(user_id: int = Depends(get_current_user_id),
+                     store=Depends(get_store)):
+    await store.clear_cart(user_id)
     return None
 
 
+@app.post("/admin/reprice", tags=["Admin"], dependencies=[Depends(get_admin_user_id)])
+async def reprice_carts(body: RepriceRequest):
+    if CART_BACKEND != "redis":
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Пересчет доступен только для хранилища Redis + PostgreSQL"
+        )
+    return await asyncio.to_thread(reprice, body.changes)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
 @app.get("/health", tags=["Health"])
-async def health_check():
+async def health_check(store=Depends(get_store)):
+    if not await store.healthy():
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Хранилище корзин недоступно"
+        )
     return {
         "status": "OK",
         "service": "cart_service",
-        "items_in_cart": len(fake_cart)
-    }
\ No newline at end of file
+        "backend": CART_BACKEND
+    }
@@ -0,0 +1,326 @@
+import asyncio
+import logging
+import mmap
+import os
+import struct
+import time
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from prometheus_client import Gauge
+
+from events import emit
+from schemas import CartItem, CartSummary
+
+logger = logging.getLogger(__name__)
+
+CART_SNAPSHOT_PATH = os.getenv("CART_SNAPSHOT_PATH", "/data/carts.snapshot")
+CART_SNAPSHOT_INTERVAL = float(os.getenv("CART_SNAPSHOT_INTERVAL_SECONDS", "60"))
+CART_IDLE_TTL = float(os.getenv("CART_IDLE_TTL_SECONDS",
+                                os.getenv("CART_TTL_SECONDS", str(7 * 24 * 3600))))
+CART_SWEEP_INTERVAL = float(os.getenv("CART_SWEEP_INTERVAL_SECONDS", "30"))
+# Hard cap on lines held in memory; least recently changed carts are evicted first
+CART_MEMORY_MAX_LINES = int(os.getenv("CART_MEMORY_MAX_LINES", "5000000"))
+# Carts expired per step before the sweeper yields to the event loop
+SWEEP_CHUNK = 1000
+
+# magic, format version, products, carts, lines, product table bytes
+SNAPSHOT_HEADER = struct.Struct("<4sIIIQQ")
+SNAPSHOT_MAGIC = b"CRT1"
+# 2 adds the last-change time of every cart after the line columns
+SNAPSHOT_VERSION = 2
+
+CART_MEMORY_LINES = Gauge("cart_memory_lines", "Cart lines held by the in-process store")
+CART_MEMORY_CARTS = Gauge("cart_memory_carts", "Carts held by the in-process store")
+
+
+class ProductIds:
+    """Interns product ids so cart lines store a 4-byte index instead of a string."""
+
+    __slots__ = ("ids", "index")
+
+    def __init__(self):
+        self.ids: List[str] = []
+        self.index: Dict[str, int] = {}
+
+    def intern(self, product_id: str) -> int:
+        idx = self.index.get(product_id)
+        if idx is None:
+            idx = len(self.ids)
+            self.ids.append(product_id)
+            self.index[product_id] = idx
+        return idx
+
+
+class CompactCart:
+    """One user's cart as three parallel typed arrays plus running aggregates."""
+
+    __slots__ = ("products", "quantities", "prices", "count", "subtotal", "touched")
+
+    def __init__(self):
+        self.products = array("i")
+        self.quantities = array("i")
+        self.prices = array("q")  # kopecks
+        self.count = 0
+        self.subtotal = 0
+        self.touched = 0.0
+
+    def find(self, product_idx: int) -> int:
+        try:
+            return self.products.index(product_idx)
+        except ValueError:
+            return -1
+
+    def change(self, product_idx: int, mode: str, value: int, price: Optional[int]) -> Tuple[int, int]:
+        pos = self.find(product_idx)
+        old = self.quantities[pos] if pos >= 0 else 0
+        new = max(0, value if mode == "set" else old + value)
+        if new == old:
+            return old, new
+        if pos < 0:
+            self.products.append(product_idx)
+            self.quantities.append(new)
+            self.prices.append(price)
+            line_price = price
+        else:
+            line_price = self.prices[pos]
+            if new == 0:
+                # Swap-remove keeps deletion O(1)
+                last = len(self.products) - 1
+                for column in (self.products, self.quantities, self.prices):
+                    column[pos] = column[last]
+                    column.pop()
+            else:
+                self.quantities[pos] = new
+        self.count += new - old
+        self.subtotal += (new - old) * line_price
+        return old, new
+
+
+class MemoryCartStore:
+    """In-process cart store for single-node installs without Redis.
+
+    Every mutation is synchronous (no await between read and write), so
+    coroutines on the event loop never observe a half-applied change.
+
+    Carts are kept in order of their last change, which doubles as the idle
+    index: the sweeper and the LRU eviction both only look at the oldest end.
+    """
+
+    def __init__(self, snapshot_path: str = CART_SNAPSHOT_PATH,
+                 snapshot_interval: float = CART_SNAPSHOT_INTERVAL,
+                 idle_ttl: float = CART_IDLE_TTL,
+                 sweep_interval: float = CART_SWEEP_INTERVAL,
+                 max_lines: int = CART_MEMORY_MAX_LINES):
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        self.idle_ttl = idle_ttl
+        self.sweep_interval = sweep_interval
+        self.max_lines = max_lines
+        self.product_ids = ProductIds()
+        self.carts: "OrderedDict[int, CompactCart]" = OrderedDict()
+        self.lines = 0
+        self._snapshot_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._sweep_task: Optional[asyncio.Task] = None
+
+    async def get_cart(self, user_id: int) -> List[CartItem]:
+        cart = self.carts.get(user_id)
+        if cart is None:
+            return []
+        ids = self.product_ids.ids
+        return [CartItem(product_id=ids[idx], quantity=quantity)
+                for idx, quantity in zip(cart.products, cart.quantities)]
+
+    async def change_item(self, user_id: int, product_id: str, mode: str, value: int,
+                          price: Optional[float] = None) -> Tuple[int, int]:
+        cart = self.carts.get(user_id)
+        if cart is None:
+            if value <= 0:
+                return 0, 0
+            cart = self.carts[user_id] = CompactCart()
+        kopecks = int(round(price * 100)) if price is not None else None
+        lines = len(cart.products)
+        old, new = cart.change(self.product_ids.intern(product_id), mode, value, kopecks)
+        self.lines += len(cart.products) - lines
+        if not cart.products:
+            del self.carts[user_id]
+        else:
+            cart.touched = time.time()
+            self.carts.move_to_end(user_id)
+            if self.lines > self.max_lines:
+                self._evict()
+        if old != new:
+            emit("cart_item_changed", {"user_id": user_id, "product_id": product_id,
+                                       "old_quantity": old, "quantity": new, "price": price})
+        return old, new
+
+    async def clear_cart(self, user_id: int) -> None:
+        cart = self.carts.pop(user_id, None)
+        if cart is not None:
+            self.lines -= len(cart.products)
+            emit("cart_cleared", {"user_id": user_id})
+
+    # Expiry
+
+    def _drop_oldest(self, event_type: str) -> None:
+        user_id, cart = self.carts.popitem(last=False)
+        self.lines -= len(cart.products)
+        ids = self.product_ids.ids
+        emit(event_type, {
+            "user_id": user_id,
+            "items": [{"product_id": ids[idx], "quantity": quantity, "price": price / 100}
+                      for idx, quantity, price in zip(cart.products, cart.quantities, cart.prices)],
+            "items_count": cart.count,
+            "subtotal": cart.subtotal / 100,
+            "last_activity": cart.touched,
+        })
+
+    def _evict(self) -> None:
+        # Never evicts the cart that was just changed: it is at the newest end
+        while self.lines > self.max_lines and len(self.carts) > 1:
+            self._drop_oldest("cart_evicted")
+
+    def sweep(self, now: Optional[float] = None, limit: int = SWEEP_CHUNK) -> int:
+        """Expires up to limit carts idle since before the cutoff, oldest first."""
+        cutoff = (now or time.time()) - self.idle_ttl
+        expired = 0
+        while self.carts and expired < limit:
+            if next(iter(self.carts.values())).touched > cutoff:
+                break
+            self._drop_oldest("cart_expired")
+            expired += 1
+        CART_MEMORY_LINES.set(self.lines)
+        CART_MEMORY_CARTS.set(len(self.carts))
+        return expired
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            while self.sweep() == SWEEP_CHUNK:
+                await asyncio.sleep(0)
+
+    async def get_summary(self, user_id: int) -> CartSummary:
+        cart = self.carts.get(user_id)
+        if cart is None:
+            return CartSummary(items_count=0, lines=0, subtotal=0)
+        return CartSummary(items_count=cart.count, lines=len(cart.products),
+                           subtotal=cart.subtotal / 100)
+
+    async def healthy(self) -> bool:
+        return True
+
+    # Snapshots
+
+    def _collect(self):
+        user_ids = array("q")
+        offsets = array("Q", [0])
+        products, quantities, prices = array("i"), array("i"), array("q")
+        touched = array("d")
+        for user_id, cart in list(self.carts.items()):
+            user_ids.append(user_id)
+            products.extend(cart.products)
+            quantities.extend(cart.quantities)
+            prices.extend(cart.prices)
+            offsets.append(len(products))
+            touched.append(cart.touched)
+        table = "\n".join(self.product_ids.ids).encode()
+        return table, user_ids, offsets, products, quantities, prices, touched
+
+    def _write(self, table, user_ids, offsets, products, quantities, prices, touched):
+        sections = [table, user_ids.tobytes(), offsets.tobytes(),
+                    products.tobytes(), quantities.tobytes(), prices.tobytes(),
+                    touched.tobytes()]
+        header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(self.product_ids.ids),
+                                      len(user_ids), len(products), len(table))
+        size = len(header) + sum(len(section) for section in sections)
+        tmp_path = self.snapshot_path + ".tmp"
+        os.makedirs(os.path.dirname(self.snapshot_path) or ".", exist_ok=True)
+        with open(tmp_path, "wb") as f:
+            f.truncate(size)
+        with open(tmp_path, "r+b") as f, mmap.mmap(f.fileno(), size) as mm:
+            pos = 0
+            for chunk in (header, *sections):
+                mm[pos:pos + len(chunk)] = chunk
+                pos += len(chunk)
+            mm.flush()
+        os.replace(tmp_path, self.snapshot_path)
+
+    async def snapshot(self) -> None:
+        async with self._snapshot_lock:
+            # Copy on the loop (consistent per cart), write in a thread
+            data = self._collect()
+            await asyncio.to_thread(self._write, *data)
+
+    def load(self) -> bool:
+        if not os.path.exists(self.snapshot_path):
+            return False
+        with open(self.snapshot_path, "rb") as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            magic, version, n_products, n_carts, n_lines, table_size = SNAPSHOT_HEADER.unpack_from(mm, 0)
+            if magic != SNAPSHOT_MAGIC or version not in (1, SNAPSHOT_VERSION):
+                logger.warning("Ignoring cart snapshot with unknown format")
+                return False
+            pos = SNAPSHOT_HEADER.size
+
+            def take(typecode: str, count: int) -> array:
+                nonlocal pos
+                column = array(typecode)
+                end = pos + count * column.itemsize
+                column.frombytes(mm[pos:end])
+                pos = end
+                return column
+
+            table = mm[pos:pos + table_size].decode()
+            pos += table_size
+            user_ids = take("q", n_carts)
+            offsets = take("Q", n_carts + 1)
+            products = take("i", n_lines)
+            quantities = take("i", n_lines)
+            prices = take("q", n_lines)
+            # Version 1 snapshots carry no activity times: treat the carts as fresh
+            touched = take("d", n_carts) if version >= 2 else array("d", [time.time()]) * n_carts
+
+        self.product_ids = ProductIds()
+        for product_id in (table.split("\n") if n_products else []):
+            self.product_ids.intern(product_id)
+        self.carts = OrderedDict()
+        for i, user_id in enumerate(user_ids):
+            start, end = offsets[i], offsets[i + 1]
+            cart = CompactCart()
+            cart.products = products[start:end]
+            cart.quantities = quantities[start:end]
+            cart.prices = prices[start:end]
+            cart.count = sum(cart.quantities)
+            cart.subtotal = sum(q * p for q, p in zip(cart.quantities, cart.prices))
+            cart.touched = touched[i]
+            self.carts[user_id] = cart
+        self.lines = n_lines
+        logger.info("Loaded %d carts (%d lines) from snapshot", n_carts, n_lines)
+        return True
+
+    async def _snapshot_loop(self):
+        while True:
+            await asyncio.sleep(self.snapshot_interval)
+            try:
+                await self.snapshot()
+            except Exception:
+                logger.exception("Cart snapshot failed")
+
+    async def start(self):
+        self.load()
+        if self.snapshot_interval > 0 and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._snapshot_loop())
+        if self.sweep_interval > 0 and (self._sweep_task is None or self._sweep_task.done()):
+            self._sweep_task = asyncio.create_task(self._sweep_loop())
+
+    async def stop(self):
+        for task in (self._sweep_task, self._task):
+            if task and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        await self.snapshot()
@@ -0,0 +1,71 @@
+import asyncio
+import os
+from typing import Dict, Iterable, Optional
+
+import httpx
+
+from common.cache import CacheBus, TwoTierCache
+from database import cache_redis, cache_bus
+
+PRODUCT_SERVICE_URL = os.getenv("PRODUCT_SERVICE_URL", "http://product_service:8001")
+PRODUCT_TIMEOUT = float(os.getenv("PRODUCT_TIMEOUT_SECONDS", "0.5"))
+# product_service publishes an invalidation on every update and delete, so the TTLs are only a backstop
+PRODUCT_CACHE_TTL = float(os.getenv("PRODUCT_CACHE_TTL_SECONDS", "300"))
+PRODUCT_CACHE_L1_TTL = float(os.getenv("PRODUCT_CACHE_L1_TTL_SECONDS", "60"))
+PRODUCT_CACHE_SIZE = int(os.getenv("PRODUCT_CACHE_SIZE", "10000"))
+PRODUCT_POOL_SIZE = int(os.getenv("PRODUCT_POOL_SIZE", "100"))
+
+
+class ProductClient:
+    """Pooled product_service client behind the shared two-tier product cache.
+
+    Cart workers share L2 in Redis and drop L1 entries on product_service's
+    invalidations. Concurrent misses for a product collapse into one request,
+    and unknown products are cached as None. Failed requests are not cached.
+    """
+
+    def __init__(self, base_url: str = PRODUCT_SERVICE_URL, timeout: float = PRODUCT_TIMEOUT,
+                 ttl: float = PRODUCT_CACHE_TTL, l1_ttl: float = PRODUCT_CACHE_L1_TTL,
+                 max_size: int = PRODUCT_CACHE_SIZE, pool_size: int = PRODUCT_POOL_SIZE,
+                 redis=cache_redis, bus: Optional[CacheBus] = cache_bus):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self._client: Optional[httpx.AsyncClient] = None
+        self.cache = TwoTierCache("product", redis, ttl=ttl, l1_ttl=l1_ttl, l1_size=max_size, bus=bus)
+
+    async def start(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=httpx.Timeout(self.timeout),
+                limits=httpx.Limits(max_connections=self.pool_size,
+                                    max_keepalive_connections=self.pool_size),
+            )
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _fetch(self, product_id: str) -> Optional[dict]:
+        response = await asyncio.wait_for(self._client.get(f"/products/{product_id}"), self.timeout)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.json()
+
+    async def _get(self, product_id: str) -> Optional[dict]:
+        try:
+            return await self.cache.get_or_load(product_id, lambda: self._fetch(product_id))
+        except (asyncio.TimeoutError, httpx.HTTPError):
+            return None
+
+    async def get_products(self, product_ids: Iterable[str]) -> Dict[str, Optional[dict]]:
+        await self.start()
+        ids = list(dict.fromkeys(product_ids))
+        products = await asyncio.gather(*(self._get(product_id) for product_id in ids))
+        return dict(zip(ids, products))
+
+
+product_client = ProductClient()
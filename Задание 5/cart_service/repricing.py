@@ -0,0 +1,199 @@
+"""Reprice cart lines after product price changes.
+
+    python repricing.py prices.json        # {"<product_id>": <new price>, ...}
+
+Reads affected cart_items in chunks through a server-side cursor, computes line
+and cart deltas with NumPy, updates Redis-resident carts and finally rewrites
+price_at_add in Postgres with one set-based UPDATE per batch of products.
+
+Redis is the source of truth for carts it holds: the write-behind flusher
+writes their prices back to cart_items. So every repriced Redis line bumps the
+cart version and marks it dirty, which makes the next flush carry the new
+price even if a flush started before the job. Lines added but not flushed yet
+are not in cart_items; their carts are all in cart:dirty, which is walked too.
+Without the Redis step (sync_redis=False) a later flush of a Redis-resident
+cart restores its old prices.
+"""
+import json
+import logging
+import os
+import sys
+import time
+from typing import Dict, Optional
+
+import numpy as np
+import redis
+from sqlalchemy import text
+
+from common.backends import redis_client
+from crud import DIRTY_KEY, PRICE_PREFIX, cart_key
+from database import REDIS_URL, engine
+
+logger = logging.getLogger(__name__)
+
+REPRICE_CHUNK_SIZE = int(os.getenv("REPRICE_CHUNK_SIZE", "500000"))
+REPRICE_PRODUCT_BATCH = int(os.getenv("REPRICE_PRODUCT_BATCH", "1000"))
+REPRICE_TOP_CARTS = 10
+REPRICE_REDIS_BATCH = 1000
+
+SELECT_LINES_SQL = text("""
+SELECT user_id, product_id, quantity, CAST(price_at_add * 100 AS bigint)
+FROM cart_items
+WHERE product_id = ANY(:product_ids)
+ORDER BY user_id
+""")
+
+UPDATE_PRICES_SQL = text("""
+UPDATE cart_items c
+SET price_at_add = v.price, updated_at = now()
+FROM unnest(CAST(:product_ids AS varchar[]), CAST(:prices AS numeric[])) AS v(product_id, price)
+WHERE c.product_id = v.product_id AND c.price_at_add <> v.price
+""")
+
+# Only touches carts (and lines) that are currently in Redis. A changed line
+# bumps __v and marks the cart dirty like any other mutation (see crud.py).
+REDIS_REPRICE_SCRIPT = """
+local old = redis.call('HGET', KEYS[1], 'price:' .. ARGV[1])
+if not old then return 0 end
+local old_kopecks = math.floor(tonumber(old) * 100 + 0.5)
+if old_kopecks == tonumber(ARGV[2]) then return 0 end
+local quantity = tonumber(redis.call('HGET', KEYS[1], ARGV[1]) or '0')
+redis.call('HSET', KEYS[1], 'price:' .. ARGV[1], ARGV[3])
+redis.call('HINCRBY', KEYS[1], '__subtotal', (tonumber(ARGV[2]) - old_kopecks) * quantity)
+redis.call('HINCRBY', KEYS[1], '__v', 1)
+redis.call('ZADD', KEYS[2], 'NX', ARGV[4], ARGV[5])
+return 1
+"""
+
+
+class RepriceJob:
+    def __init__(self, changes: Dict[str, float], chunk_size: int = REPRICE_CHUNK_SIZE,
+                 redis_client: Optional[redis.Redis] = None):
+        self.product_ids = list(changes)
+        self.index = {product_id: i for i, product_id in enumerate(self.product_ids)}
+        self.new_prices = np.array([round(changes[p] * 100) for p in self.product_ids], dtype=np.int64)
+        self.chunk_size = chunk_size
+        self.redis = redis_client
+        self._redis_script = redis_client.register_script(REDIS_REPRICE_SCRIPT) if redis_client else None
+
+        self.lines = 0
+        self.unflushed_lines = 0
+        self.product_delta = np.zeros(len(self.product_ids), dtype=np.int64)
+        self.product_lines = np.zeros(len(self.product_ids), dtype=np.int64)
+        self._cart_users = []
+        self._cart_deltas = []
+
+    def _process_chunk(self, rows):
+        n = len(rows)
+        user_ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=n)
+        codes = np.fromiter((self.index[row[1]] for row in rows), dtype=np.int64, count=n)
+        quantities = np.fromiter((row[2] for row in rows), dtype=np.int64, count=n)
+        old_prices = np.fromiter((row[3] for row in rows), dtype=np.int64, count=n)
+
+        new_prices = self.new_prices[codes]
+        line_delta = (new_prices - old_prices) * quantities
+
+        self.lines += n
+        self.product_delta += np.bincount(codes, weights=line_delta,
+                                          minlength=len(self.product_ids)).astype(np.int64)
+        self.product_lines += np.bincount(codes, minlength=len(self.product_ids))
+        # Rows come ordered by user, so a chunk reduces to a few carts
+        users, inverse = np.unique(user_ids, return_inverse=True)
+        self._cart_users.append(users)
+        self._cart_deltas.append(np.bincount(inverse, weights=line_delta).astype(np.int64))
+
+        if self._redis_script is not None:
+            changed = np.nonzero(new_prices != old_prices)[0]
+            now = time.time()
+            with self.redis.pipeline(transaction=False) as pipe:
+                for i in changed:
+                    self._reprice_redis_line(pipe, int(user_ids[i]), rows[i][1],
+                                             int(new_prices[i]), now)
+                pipe.execute()
+
+    def _reprice_redis_line(self, pipe, user_id: int, product_id: str, price: int, now: float):
+        self._redis_script(keys=[cart_key(user_id), DIRTY_KEY],
+                           args=[product_id, price, f"{price / 100:.2f}", now, user_id],
+                           client=pipe)
+
+    def _reprice_unflushed(self):
+        """Lines only in Redis: their carts have not been flushed since, so they are all dirty"""
+        members = [member for member, _ in self.redis.zscan_iter(DIRTY_KEY)]
+        for start in range(0, len(members), REPRICE_REDIS_BATCH):
+            batch = members[start:start + REPRICE_REDIS_BATCH]
+            with self.redis.pipeline(transaction=False) as pipe:
+                for member in batch:
+                    pipe.hgetall(cart_key(int(member)))
+                carts = pipe.execute()
+            now = time.time()
+            with self.redis.pipeline(transaction=False) as pipe:
+                for member, fields in zip(batch, carts):
+                    for field in fields:
+                        i = self.index.get(field)
+                        if i is not None and PRICE_PREFIX + field in fields:
+                            self._reprice_redis_line(pipe, int(member), field,
+                                                     int(self.new_prices[i]), now)
+                # Lines that were in cart_items are already repriced and return 0
+                self.unflushed_lines += sum(pipe.execute())
+
+    def _write_back(self, conn):
+        for start in range(0, len(self.product_ids), REPRICE_PRODUCT_BATCH):
+            batch = self.product_ids[start:start + REPRICE_PRODUCT_BATCH]
+            prices = [f"{p / 100:.2f}" for p in self.new_prices[start:start + REPRICE_PRODUCT_BATCH]]
+            conn.execute(UPDATE_PRICES_SQL, {"product_ids": batch, "prices": prices})
+
+    def run(self) -> dict:
+        started = time.perf_counter()
+        with engine.connect() as conn:
+            result = conn.execution_options(stream_results=True, yield_per=self.chunk_size) \
+                .execute(SELECT_LINES_SQL, {"product_ids": self.product_ids})
+            for rows in result.partitions(self.chunk_size):
+                self._process_chunk(rows)
+        if self._redis_script is not None:
+            self._reprice_unflushed()
+        computed = time.perf_counter() - started
+        with engine.begin() as conn:
+            self._write_back(conn)
+        return self.report(computed, time.perf_counter() - started)
+
+    def report(self, computed: float, elapsed: float) -> dict:
+        if self._cart_users:
+            users = np.concatenate(self._cart_users)
+            deltas = np.concatenate(self._cart_deltas)
+            carts, inverse = np.unique(users, return_inverse=True)
+            cart_delta = np.bincount(inverse, weights=deltas).astype(np.int64)
+        else:
+            carts = cart_delta = np.zeros(0, dtype=np.int64)
+        top = np.argsort(-np.abs(cart_delta))[:REPRICE_TOP_CARTS]
+        return {
+            "lines": int(self.lines),
+            "unflushed_lines": self.unflushed_lines,
+            "carts": int(len(carts)),
+            "carts_increased": int((cart_delta > 0).sum()),
+            "carts_decreased": int((cart_delta < 0).sum()),
+            "total_delta": int(cart_delta.sum()) / 100,
+            "products": {
+                product_id: {"lines": int(self.product_lines[i]),
+                             "new_price": int(self.new_prices[i]) / 100,
+                             "delta": int(self.product_delta[i]) / 100}
+                for i, product_id in enumerate(self.product_ids)
+            },
+            "top_carts": [{"user_id": int(carts[i]), "delta": int(cart_delta[i]) / 100} for i in top],
+            "compute_seconds": round(computed, 3),
+            "elapsed_seconds": round(elapsed, 3),
+        }
+
+
+def reprice(changes: Dict[str, float], sync_redis: bool = True) -> dict:
+    client = redis_client(REDIS_URL, decode_responses=True) if sync_redis else None
+    try:
+        return RepriceJob(changes, redis_client=client).run()
+    finally:
+        if client is not None:
+            client.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    with open(sys.argv[1]) as f:
+        print(json.dumps(reprice(json.load(f)), indent=2))
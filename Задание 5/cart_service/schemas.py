@@ -0,0 +1,46 @@
+from pydantic import BaseModel, Field
+from typing import Dict, List, Optional
+
+
+class CartItem(BaseModel):
+    product_id: str
+    quantity: int
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "product_id": "6463a1f0c2a4b5d6e7f80912",
+                "quantity": 2
+            }
+        }
+
+
+class CartLine(CartItem):
+    name: Optional[str] = None
+    price: Optional[float] = None
+    line_total: Optional[float] = None
+    available: bool = True
+
+
+class Cart(BaseModel):
+    items: List[CartLine]
+    total: float
+    items_count: int
+
+
+class CartQuantity(BaseModel):
+    quantity: int = Field(..., ge=0)
+
+
+class CartDelta(BaseModel):
+    delta: int
+
+
+class CartSummary(BaseModel):
+    items_count: int
+    lines: int
+    subtotal: float
+
+
+class RepriceRequest(BaseModel):
+    changes: Dict[str, float] = Field(..., example={"6463a1f0c2a4b5d6e7f80912": 1290.0})
@@ -0,0 +1,66 @@
+import os
+from typing import List, Optional, Tuple
+
+import crud
+import events
+from database import redis_client
+from schemas import CartItem, CartSummary
+
+# "redis" (Redis + write-behind to Postgres) or "memory" (single node, no Redis)
+CART_BACKEND = os.getenv("CART_BACKEND", "redis")
+
+
+class RedisCartStore:
+    def __init__(self, redis):
+        from expiry import RedisCartSweeper
+        from write_behind import WriteBehindFlusher
+
+        self.redis = redis
+        self.flusher = WriteBehindFlusher(redis)
+        self.sweeper = RedisCartSweeper(redis)
+        self.producer = events.publish_to_stream(redis)
+
+    async def get_cart(self, user_id: int) -> List[CartItem]:
+        return await crud.get_cart(self.redis, user_id)
+
+    async def change_item(self, user_id: int, product_id: str, mode: str, value: int,
+                          price: Optional[float] = None) -> Tuple[int, int]:
+        return await crud.change_item(self.redis, user_id, product_id, mode, value, price)
+
+    async def clear_cart(self, user_id: int) -> None:
+        await crud.clear_cart(self.redis, user_id)
+
+    async def get_summary(self, user_id: int) -> CartSummary:
+        return await crud.get_summary(self.redis, user_id)
+
+    async def healthy(self) -> bool:
+        try:
+            return await self.redis.ping()
+        except Exception:
+            return False
+
+    async def start(self):
+        self.producer.start()
+        self.flusher.start()
+        self.sweeper.start()
+
+    async def stop(self):
+        await self.sweeper.stop()
+        await self.flusher.stop()
+        await self.producer.stop()
+        await self.redis.close()
+
+
+def create_store():
+    if CART_BACKEND == "memory":
+        from memory_store import MemoryCartStore
+
+        return MemoryCartStore()
+    return RedisCartStore(redis_client)
+
+
+store = create_store()
+
+
+def get_store():
+    return store
@@ -0,0 +1,210 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from prometheus_client import Counter, Gauge, Histogram
+from redis.asyncio import Redis
+from sqlalchemy import text
+from sqlalchemy.exc import DataError, IntegrityError
+
+from crud import DIRTY_KEY, VERSION_FIELD, cart_key, parse_cart
+from database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = float(os.getenv("CART_FLUSH_INTERVAL_SECONDS", "1.0"))
+FLUSH_BATCH_SIZE = int(os.getenv("CART_FLUSH_BATCH_SIZE", "500"))
+FLUSH_LOCK_KEY = "cart:flush:lock"
+FLUSH_LOCK_TTL_MS = int(os.getenv("CART_FLUSH_LOCK_TTL_MS", "30000"))
+
+CART_FLUSH_LAG = Gauge("cart_flush_lag_seconds",
+                       "Age of the oldest cart change not yet persisted to Postgres")
+CART_FLUSH_PENDING = Gauge("cart_flush_pending_carts", "Carts waiting to be flushed")
+CART_FLUSH_DURATION = Histogram("cart_flush_duration_seconds", "Duration of one flush batch")
+CART_FLUSHED = Counter("cart_flushed_carts_total", "Carts persisted to Postgres")
+CART_FLUSH_ERRORS = Counter("cart_flush_errors_total", "Failed flush batches")
+CART_FLUSH_REJECTED = Counter("cart_flush_rejected_carts_total",
+                              "Carts Postgres refused to store (unknown user, invalid line)")
+
+# Errors that retrying the same cart cannot fix
+REJECTED_ERRORS = (IntegrityError, DataError)
+
+UPSERT_SQL = text("""
+INSERT INTO cart_items (user_id, product_id, quantity, price_at_add, updated_at)
+SELECT t.user_id, t.product_id, t.quantity, t.price_at_add, now()
+FROM unnest(CAST(:user_ids AS integer[]), CAST(:product_ids AS varchar[]),
+            CAST(:quantities AS integer[]), CAST(:prices AS numeric[]))
+     AS t(user_id, product_id, quantity, price_at_add)
+ON CONFLICT (user_id, product_id)
+DO UPDATE SET quantity = EXCLUDED.quantity, price_at_add = EXCLUDED.price_at_add,
+              updated_at = now()
+""")
+
+# Rows of flushed carts that are no longer in Redis were removed by the user
+DELETE_SQL = text("""
+DELETE FROM cart_items c
+WHERE c.user_id = ANY(CAST(:flushed_users AS integer[]))
+  AND NOT EXISTS (
+      SELECT 1
+      FROM unnest(CAST(:user_ids AS integer[]), CAST(:product_ids AS varchar[])) AS k(user_id, product_id)
+      WHERE k.user_id = c.user_id AND k.product_id = c.product_id
+  )
+""")
+
+# Drop a dirty marker only if the cart was not changed after its snapshot was
+# taken; otherwise it stays (with its original score) for the next batch.
+ACK_SCRIPT = """
+local acked = 0
+for i = 2, #KEYS do
+    local current = redis.call('HGET', KEYS[i], '__v') or ''
+    if current == ARGV[(i - 2) * 2 + 2] then
+        redis.call('ZREM', KEYS[1], ARGV[(i - 2) * 2 + 1])
+        acked = acked + 1
+    end
+end
+return acked
+"""
+
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end
+return 0
+"""
+
+
+def _write_batch(flushed_users, user_ids, product_ids, quantities, prices):
+    with SessionLocal() as db:
+        with db.begin():
+            if user_ids:
+                db.execute(UPSERT_SQL, {"user_ids": user_ids, "product_ids": product_ids,
+                                        "quantities": quantities, "prices": prices})
+            db.execute(DELETE_SQL, {"flushed_users": flushed_users,
+                                    "user_ids": user_ids, "product_ids": product_ids})
+
+
+def _columns(carts: Dict[int, List[Tuple[str, int, float]]]):
+    flushed_users, user_ids, product_ids, quantities, prices = list(carts), [], [], [], []
+    for user_id, lines in carts.items():
+        for product_id, quantity, price in lines:
+            user_ids.append(user_id)
+            product_ids.append(product_id)
+            quantities.append(quantity)
+            prices.append(price)
+    return flushed_users, user_ids, product_ids, quantities, prices
+
+
+def _write_carts(carts: Dict[int, List[Tuple[str, int, float]]]) -> List[int]:
+    """Writes the carts in one transaction; if Postgres rejects it, cart by cart.
+
+    Returns the carts that cannot be stored at all, e.g. of a user id that
+    no longer exists after init_db reseeded users. Other errors (Postgres
+    down) are raised and the whole batch is retried later.
+    """
+    try:
+        _write_batch(*_columns(carts))
+        return []
+    except REJECTED_ERRORS:
+        pass
+    rejected = []
+    for user_id, lines in carts.items():
+        try:
+            _write_batch(*_columns({user_id: lines}))
+        except REJECTED_ERRORS as e:
+            logger.warning("Postgres rejected cart of user %s: %s", user_id, e.orig)
+            rejected.append(user_id)
+    return rejected
+
+
+class WriteBehindFlusher:
+    """Persists carts marked dirty in Redis to Postgres cart_items in batches.
+
+    Crash safety: markers are removed only after the Postgres transaction has
+    committed, and upserts are idempotent, so a crash at any point at worst
+    re-flushes a batch. A Redis lock keeps workers from flushing concurrently.
+    A cart Postgres refuses (see _write_carts) loses its marker like a
+    flushed one, so it cannot hold back the carts queued behind it; its
+    next change marks it again.
+    """
+
+    def __init__(self, redis: Redis, interval: float = FLUSH_INTERVAL,
+                 batch_size: int = FLUSH_BATCH_SIZE):
+        self.redis = redis
+        self.interval = interval
+        self.batch_size = batch_size
+        self._ack = redis.register_script(ACK_SCRIPT)
+        self._release = redis.register_script(RELEASE_SCRIPT)
+        self._task: Optional[asyncio.Task] = None
+
+    async def flush_once(self) -> int:
+        token = uuid.uuid4().hex
+        if not await self.redis.set(FLUSH_LOCK_KEY, token, nx=True, px=FLUSH_LOCK_TTL_MS):
+            return 0
+        try:
+            entries = await self.redis.zrange(DIRTY_KEY, 0, self.batch_size - 1, withscores=True)
+            if not entries:
+                return 0
+            members = [member for member, _ in entries]
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for member in members:
+                    pipe.hgetall(cart_key(int(member)))
+                snapshots = await pipe.execute()
+
+            started = time.perf_counter()
+            carts = {}
+            ack_args = []
+            for member, fields in zip(members, snapshots):
+                ack_args += [member, fields.get(VERSION_FIELD, "")]
+                if not fields:
+                    # Expired before it was flushed; Postgres keeps the last state
+                    continue
+                items, item_prices = parse_cart(fields)
+                carts[int(member)] = [(item.product_id, item.quantity,
+                                       item_prices.get(item.product_id, 0)) for item in items]
+            rejected = await asyncio.to_thread(_write_carts, carts) if carts else []
+            acked = await self._ack(keys=[DIRTY_KEY, *(cart_key(int(m)) for m in members)],
+                                    args=ack_args)
+            CART_FLUSH_DURATION.observe(time.perf_counter() - started)
+            CART_FLUSHED.inc(len(carts) - len(rejected))
+            CART_FLUSH_REJECTED.inc(len(rejected))
+            return acked
+        finally:
+            await self._release(keys=[FLUSH_LOCK_KEY], args=[token])
+
+    async def update_lag(self):
+        oldest = await self.redis.zrange(DIRTY_KEY, 0, 0, withscores=True)
+        CART_FLUSH_LAG.set(time.time() - oldest[0][1] if oldest else 0)
+        CART_FLUSH_PENDING.set(await self.redis.zcard(DIRTY_KEY))
+
+    async def run(self):
+        while True:
+            flushed = 0
+            try:
+                flushed = await self.flush_once()
+                await self.update_lag()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                CART_FLUSH_ERRORS.inc()
+                logger.exception("Cart flush failed")
+            # A full batch means there is a backlog: keep going without sleeping
+            if flushed < self.batch_size:
+                await asyncio.sleep(self.interval)
+
+    def start(self) -> asyncio.Task:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+        return self._task
+
+    async def stop(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        try:
+            await self.flush_once()
+        except Exception:
+            logger.exception("Final cart flush failed")
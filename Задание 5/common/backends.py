@@ -0,0 +1,66 @@
+"""Datastore clients picked by URL scheme.
+
+Besides real servers two in-process stand-ins are understood, used by the
+hermetic launcher (run_hermetic.py):
+
+- fakeredis://[name][/db]  in-memory Redis; clients with the same name share data
+- mongomock://             in-memory MongoDB (mongomock-motor)
+
+Both are optional dependencies and only imported when asked for.
+"""
+from typing import Dict
+from urllib.parse import urlparse
+
+FAKE_REDIS_SCHEME = "fakeredis://"
+MONGOMOCK_SCHEME = "mongomock://"
+
+_fake_servers: Dict[str, object] = {}
+_mongomock_clients: Dict[str, object] = {}
+
+
+def _fake_server(url: str):
+    import fakeredis
+
+    name = urlparse(url).netloc
+    if name not in _fake_servers:
+        _fake_servers[name] = fakeredis.FakeServer()
+    return _fake_servers[name]
+
+
+def redis_pool(url: str, asyncio: bool = False, **kwargs):
+    """ConnectionPool for `url`, sync or redis.asyncio."""
+    if asyncio:
+        from redis.asyncio import ConnectionPool
+    else:
+        from redis import ConnectionPool
+    if not url.startswith(FAKE_REDIS_SCHEME):
+        return ConnectionPool.from_url(url, **kwargs)
+
+    if asyncio:
+        from fakeredis.aioredis import FakeConnection
+    else:
+        from fakeredis import FakeConnection
+    db = urlparse(url).path.strip("/")
+    return ConnectionPool(connection_class=FakeConnection, server=_fake_server(url),
+                          db=int(db or 0), **kwargs)
+
+
+def redis_client(url: str, asyncio: bool = False, **kwargs):
+    if asyncio:
+        from redis.asyncio import Redis
+    else:
+        from redis import Redis
+    return Redis(connection_pool=redis_pool(url, asyncio=asyncio, **kwargs))
+
+
+def mongo_client(url: str, **kwargs):
+    """Motor client; pool and monitoring options are ignored by the stand-in."""
+    if url.startswith(MONGOMOCK_SCHEME):
+        from mongomock_motor import AsyncMongoMockClient
+
+        if url not in _mongomock_clients:
+            _mongomock_clients[url] = AsyncMongoMockClient()
+        return _mongomock_clients[url]
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    return AsyncIOMotorClient(url, **kwargs)
@@ -0,0 +1,438 @@
+"""Two-tier cache: a bounded in-process L1 in front of Redis (L2).
+
+    bus = CacheBus(redis)                      # one per process, started with the app
+    users = TwoTierCache("user", redis, ttl=300, l1_ttl=30, bus=bus)
+    user = await users.get_or_load(username, load_user)
+    await users.invalidate(username)           # L2 and every worker's L1
+
+L1 entries expire after l1_ttl and are evicted least-recently-used beyond
+l1_size. L2 keys live in a KeySpace, cache:<namespace>:<generation>:<key>,
+so invalidate_all() (or bump_generations() from a script) drops a whole
+namespace by incrementing one counter. Invalidations delete the L2 entry and
+are published on a Redis pub/sub channel. Every CacheBus subscribed to it drops the keys from its L1s,
+so workers and nodes stay coherent without short L1 TTLs. Pub/sub does not
+deliver messages sent while a subscriber was disconnected, so a resubscribing
+bus clears all its L1s. A service may publish invalidations for a namespace
+that only other services cache (product_service for the cart's products).
+
+L2 entries are encoded with common.codec (msgpack, zstd for large values), so
+the Redis client must return bytes. With hash_keys=True long keys such as
+tokens are replaced by a fixed-size digest both in Redis and in L1 (and in
+invalidation messages). L1 values are shared between callers and must not be
+mutated.
+
+Hit rate per namespace:
+    sum by (namespace) (rate(cache_requests_total{result=~"l1_hit|l2_hit"}[5m]))
+      / sum by (namespace) (rate(cache_requests_total[5m]))
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict, defaultdict
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from prometheus_client import Counter, Gauge
+from redis.exceptions import RedisError
+
+from common import codec
+
+logger = logging.getLogger(__name__)
+
+CACHE_CHANNEL = os.getenv("CACHE_INVALIDATION_CHANNEL", "cache:invalidate")
+CACHE_L1_SIZE = int(os.getenv("CACHE_L1_SIZE", "10000"))
+
+CACHE_REQUESTS = Counter("cache_requests_total", "Two-tier cache lookups", ["namespace", "result"])
+CACHE_L1_ENTRIES = Gauge("cache_l1_entries", "Entries in the in-process cache", ["namespace"])
+CACHE_L1_EVICTIONS = Counter("cache_l1_evictions_total", "L1 entries evicted by size", ["namespace"])
+CACHE_INVALIDATIONS = Counter("cache_invalidations_total", "Keys dropped from L1",
+                              ["namespace", "origin"])
+CACHE_ERRORS = Counter("cache_errors_total", "Redis errors and undecodable entries in the two-tier cache",
+                       ["namespace"])
+
+_MISSING = object()
+
+
+class LRUCache:
+    """In-process LRU with a TTL"""
+
+    def __init__(self, size: int, ttl: float):
+        self.size = size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str, default=None):
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        expires, value = entry
+        if expires < time.monotonic():
+            del self._entries[key]
+            return default
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any) -> int:
+        """Stores the value and returns how many entries were evicted to make room"""
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        evicted = 0
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+            evicted += 1
+        return evicted
+
+    def delete(self, key: str) -> bool:
+        return self._entries.pop(key, None) is not None
+
+    def clear(self):
+        self._entries.clear()
+
+
+READ_SCRIPT = """
+local generation = redis.call('GET', KEYS[1]) or '0'
+return {generation, redis.call('GET', ARGV[1] .. ':' .. generation .. ':' .. ARGV[2])}
+"""
+
+WRITE_SCRIPT = """
+local generation = redis.call('GET', KEYS[1]) or '0'
+redis.call('SET', ARGV[1] .. ':' .. generation .. ':' .. ARGV[2], ARGV[3], 'PX', ARGV[4])
+return generation
+"""
+
+DELETE_SCRIPT = """
+local generation = redis.call('GET', KEYS[1]) or '0'
+local deleted = 0
+for i = 2, #ARGV do
+    deleted = deleted + redis.call('DEL', ARGV[1] .. ':' .. generation .. ':' .. ARGV[i])
+end
+return deleted
+"""
+
+
+def generation_key(prefix: str) -> str:
+    return f"{prefix}:gen"
+
+
+class KeySpace:
+    """Keys under a prefix with a generation counter: <prefix>:<generation>:<key>.
+
+    Bumping the counter (<prefix>:gen) invalidates the whole prefix in O(1):
+    readers move on to the new generation, and the old entries age out through
+    their TTL or maxmemory eviction. Each operation below is one round trip.
+    Entry keys are built inside the scripts, which is fine on a single Redis
+    but not on Redis Cluster.
+    """
+
+    def __init__(self, redis, prefix: str):
+        self.redis = redis
+        self.prefix = prefix
+        self.counter = generation_key(prefix)
+        self._read = redis.register_script(READ_SCRIPT)
+        self._write = redis.register_script(WRITE_SCRIPT)
+        self._delete = redis.register_script(DELETE_SCRIPT)
+
+    def key(self, generation, key: str) -> str:
+        if isinstance(generation, bytes):
+            generation = generation.decode()
+        return f"{self.prefix}:{generation}:{key}"
+
+    async def generation(self):
+        """Current generation, for callers building keys themselves (pipelined bulk writes)"""
+        return await self.redis.get(self.counter) or b"0"
+
+    async def read(self, key: str) -> Tuple[bytes, Optional[bytes]]:
+        """(current generation, value or None)"""
+        generation, value = await self._read(keys=[self.counter], args=[self.prefix, key])
+        return generation, value
+
+    async def write(self, key: str, value: bytes, px: int):
+        """Stores under the current generation"""
+        await self._write(keys=[self.counter], args=[self.prefix, key, value, px])
+
+    async def delete(self, *keys: str) -> int:
+        if not keys:
+            return 0
+        return await self._delete(keys=[self.counter], args=[self.prefix, *keys])
+
+    async def bump(self) -> int:
+        return await self.redis.incr(self.counter)
+
+
+def bump_generations(redis, prefixes: Iterable[str], channel: str = CACHE_CHANNEL) -> Dict[str, int]:
+    """Invalidates whole key prefixes with a synchronous client (scripts, deploy hooks).
+
+    For cache:<namespace> prefixes of TwoTierCache the running CacheBuses are
+    told to clear their L1s as well.
+    """
+    prefixes = list(prefixes)
+    pipe = redis.pipeline(transaction=False)
+    for prefix in prefixes:
+        pipe.incr(generation_key(prefix))
+        if prefix.startswith("cache:"):
+            pipe.publish(channel, _namespace_message("deploy", prefix[len("cache:"):], None))
+    results = iter(pipe.execute())
+    generations = {}
+    for prefix in prefixes:
+        generations[prefix] = next(results)
+        if prefix.startswith("cache:"):
+            next(results)
+    return generations
+
+
+def _namespace_message(origin: str, namespace: str, keys: Optional[List[str]]) -> str:
+    return json.dumps({"origin": origin, "namespace": namespace, "keys": keys})
+
+
+class TwoTierCache:
+    def __init__(self, namespace: str, redis, ttl: float, l1_ttl: Optional[float] = None,
+                 l1_size: int = CACHE_L1_SIZE, bus: Optional["CacheBus"] = None, hash_keys: bool = False,
+                 encode: Callable[[Any], Any] = lambda value: value,
+                 decode: Callable[[Any], Any] = lambda value: value):
+        self.namespace = namespace
+        self.redis = redis
+        self.keys = KeySpace(redis, f"cache:{namespace}")
+        self.ttl = ttl
+        self.encode = encode
+        self.decode = decode
+        self.hash_keys = hash_keys
+        self.l1 = LRUCache(l1_size, ttl if l1_ttl is None else l1_ttl)
+        self.bus = bus
+        # Bumped on every L1 invalidation, so a load that raced one doesn't store what it read
+        self._epoch = 0
+        self._inflight: Dict[str, asyncio.Future] = {}
+        CACHE_L1_ENTRIES.labels(namespace).set_function(lambda: len(self.l1))
+        if bus is not None:
+            bus.register(self)
+
+    def _local(self, key: str) -> str:
+        return codec.short_key(key) if self.hash_keys else key
+
+    def _set_l1(self, key: str, value: Any):
+        evicted = self.l1.set(key, value)
+        if evicted:
+            CACHE_L1_EVICTIONS.labels(self.namespace).inc(evicted)
+
+    async def _lookup(self, key: str) -> Tuple[Any, str, Optional[bytes]]:
+        """(value or _MISSING, result, L2 generation the key was looked up in)"""
+        value = self.l1.get(key, _MISSING)
+        if value is not _MISSING:
+            return value, "l1_hit", None
+        epoch = self._epoch
+        try:
+            generation, raw = await self.keys.read(key)
+        except RedisError:
+            CACHE_ERRORS.labels(self.namespace).inc()
+            generation, raw = None, None
+        if raw is None:
+            return _MISSING, "miss", generation
+        try:
+            value = self.decode(codec.loads(raw))
+        except codec.CodecError:
+            CACHE_ERRORS.labels(self.namespace).inc()
+            return _MISSING, "miss", generation
+        if epoch == self._epoch:
+            self._set_l1(key, value)
+        return value, "l2_hit", generation
+
+    async def get(self, key: str, default=None):
+        """Looks the key up in L1, then L2; a Redis error counts as a miss"""
+        value, result, _ = await self._lookup(self._local(key))
+        CACHE_REQUESTS.labels(self.namespace, result).inc()
+        return default if value is _MISSING else value
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        await self._store(self._local(key), value, ttl)
+
+    def stage(self, pipe, generation, key: str, value: Any, ttl: Optional[float] = None):
+        """Queues an L2-only write on a pipeline of this cache's client, for bulk warm-up.
+
+        SET NX: an entry already written by live traffic is at least as fresh
+        and is kept.
+        """
+        pipe.set(self.keys.key(generation, self._local(key)), codec.dumps(self.encode(value)),
+                 px=int((ttl or self.ttl) * 1000), nx=True)
+
+    async def _store(self, key: str, value: Any, ttl: Optional[float] = None, generation: Optional[bytes] = None):
+        self._set_l1(key, value)
+        data, px = codec.dumps(self.encode(value)), int((ttl or self.ttl) * 1000)
+        try:
+            if generation is None:
+                await self.keys.write(key, data, px)
+            else:
+                # The generation the miss was seen in: if it was bumped meanwhile, this lands in the old one
+                await self.redis.set(self.keys.key(generation, key), data, px=px)
+        except RedisError:
+            CACHE_ERRORS.labels(self.namespace).inc()
+
+    async def fetch(self, key: str, load: Callable[[], Awaitable[Any]]) -> Tuple[Any, str]:
+        """Returns (value, result), result being l1_hit, l2_hit, miss or wait.
+
+        On a miss the result of load() is stored in both tiers. Concurrent misses
+        for a key in one process share a single load.
+        """
+        key = self._local(key)
+        value, result, generation = await self._lookup(key)
+        if value is _MISSING:
+            inflight = self._inflight.get(key)
+            if inflight is not None:
+                value, result = await asyncio.shield(inflight), "wait"
+            else:
+                value = await self._load(key, load, generation)
+        CACHE_REQUESTS.labels(self.namespace, result).inc()
+        return value, result
+
+    async def _load(self, key: str, load: Callable[[], Awaitable[Any]], generation: Optional[bytes]) -> Any:
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        epoch = self._epoch
+        try:
+            value = await load()
+            if epoch == self._epoch:
+                await self._store(key, value, generation=generation)
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark it retrieved: there may be no other caller waiting on it
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    async def get_or_load(self, key: str, load: Callable[[], Awaitable[Any]]) -> Any:
+        value, _ = await self.fetch(key, load)
+        return value
+
+    def drop_local(self, keys: Optional[Iterable[str]], origin: str = "local"):
+        """Removes keys (all of them for None) from this worker's L1"""
+        self._epoch += 1
+        if keys is None:
+            CACHE_INVALIDATIONS.labels(self.namespace, origin).inc(len(self.l1))
+            self.l1.clear()
+            return
+        dropped = sum(self.l1.delete(key) for key in keys)
+        CACHE_INVALIDATIONS.labels(self.namespace, origin).inc(dropped)
+
+    async def invalidate(self, *keys: str):
+        if not keys:
+            return
+        keys = tuple(self._local(key) for key in keys)
+        if self.bus is not None:
+            await self.bus.invalidate(self.namespace, *keys)
+            return
+        self.drop_local(keys)
+        try:
+            await self.keys.delete(*keys)
+        except RedisError:
+            CACHE_ERRORS.labels(self.namespace).inc()
+
+    async def invalidate_all(self):
+        """Moves the namespace to a new generation; old entries age out"""
+        if self.bus is not None:
+            await self.bus.invalidate_namespace(self.namespace)
+            return
+        self.drop_local(None)
+        try:
+            await self.keys.bump()
+        except RedisError:
+            CACHE_ERRORS.labels(self.namespace).inc()
+
+
+class CacheBus:
+    """Fans invalidations out to the L1s of every process subscribed to the channel"""
+
+    def __init__(self, redis, channel: str = CACHE_CHANNEL, reconnect_delay: float = 1.0):
+        self.redis = redis
+        self.channel = channel
+        self.reconnect_delay = reconnect_delay
+        # Lets a bus skip its own messages: the local L1s were already updated
+        self.origin = uuid.uuid4().hex
+        self._caches: Dict[str, List[TwoTierCache]] = defaultdict(list)
+        self._keyspaces: Dict[str, KeySpace] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def register(self, cache: TwoTierCache):
+        self._caches[cache.namespace].append(cache)
+
+    def _keyspace(self, namespace: str) -> KeySpace:
+        if namespace not in self._keyspaces:
+            self._keyspaces[namespace] = KeySpace(self.redis, f"cache:{namespace}")
+        return self._keyspaces[namespace]
+
+    def _drop(self, namespace: str, keys: Optional[Iterable[str]], origin: str):
+        keys = None if keys is None else list(keys)
+        for cache in self._caches.get(namespace, ()):
+            cache.drop_local(keys, origin)
+
+    async def invalidate(self, namespace: str, *keys: str):
+        """Deletes the keys from L2 and from every L1 of the namespace, in all processes"""
+        if not keys:
+            return
+        self._drop(namespace, keys, "local")
+        try:
+            await self._keyspace(namespace).delete(*keys)
+            await self.redis.publish(self.channel, _namespace_message(self.origin, namespace, list(keys)))
+        except RedisError:
+            CACHE_ERRORS.labels(namespace).inc()
+            logger.warning("Could not publish invalidation of %s %s", namespace, keys)
+
+    async def invalidate_namespace(self, namespace: str):
+        """Bumps the namespace's generation and clears its L1s in all processes"""
+        self._drop(namespace, None, "local")
+        try:
+            await self._keyspace(namespace).bump()
+            await self.redis.publish(self.channel, _namespace_message(self.origin, namespace, None))
+        except RedisError:
+            CACHE_ERRORS.labels(namespace).inc()
+            logger.warning("Could not invalidate namespace %s", namespace)
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _handle(self, data):
+        try:
+            message = json.loads(data)
+        except ValueError:
+            logger.warning("Malformed invalidation message: %r", data)
+            return
+        if message.get("origin") != self.origin:
+            self._drop(message["namespace"], message.get("keys"), "remote")
+
+    async def run(self):
+        while True:
+            pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(self.channel)
+                # Whatever was published while we were away is lost
+                for namespace in self._caches:
+                    self._drop(namespace, None, "resubscribe")
+                while True:
+                    message = await pubsub.get_message(timeout=1.0)
+                    if message is not None and message["type"] == "message":
+                        self._handle(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except (RedisError, OSError) as e:
+                logger.warning("Cache invalidation subscription lost: %s", e)
+                await asyncio.sleep(self.reconnect_delay)
+            finally:
+                try:
+                    await pubsub.close()
+                except Exception:
+                    pass
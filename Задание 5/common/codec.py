@@ -0,0 +1,93 @@
+"""Binary encoding of cache entries: msgpack behind a two-byte header.
+
+    header = [format version, flags]; flags bit 0 = zstd-compressed body
+
+Datetimes travel as an extension type (microseconds since the epoch plus
+whether they were timezone-aware), so a decoded entry needs no ISO parsing.
+Enums are stored by value. Bodies over CACHE_COMPRESS_THRESHOLD bytes are
+compressed with zstd when the optional zstandard package is installed and
+compression actually helps.
+
+An entry in another format (JSON written before this codec, a future version,
+or zstd without zstandard installed) raises CodecError. Callers treat it as a
+miss, so it is replaced on the next write instead of failing the request.
+Redis clients reading these entries must not use decode_responses.
+"""
+import hashlib
+import os
+import struct
+from datetime import datetime, timedelta, timezone
+from enum import Enum
+
+import msgpack
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CODEC_VERSION = 1
+FLAG_ZSTD = 0x01
+CACHE_COMPRESS_THRESHOLD = int(os.getenv("CACHE_COMPRESS_THRESHOLD", "1024"))
+CACHE_ZSTD_LEVEL = int(os.getenv("CACHE_ZSTD_LEVEL", "3"))
+
+EXT_DATETIME = 1
+_DATETIME = struct.Struct(">q?")
+_EPOCH = datetime(1970, 1, 1)
+_EPOCH_UTC = _EPOCH.replace(tzinfo=timezone.utc)
+
+# zstd contexts are not thread-safe; caches only run on the event loop thread
+_compressor = zstandard.ZstdCompressor(level=CACHE_ZSTD_LEVEL) if zstandard else None
+_decompressor = zstandard.ZstdDecompressor() if zstandard else None
+
+
+class CodecError(ValueError):
+    pass
+
+
+def _default(value):
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            micros = (value - _EPOCH) // timedelta(microseconds=1)
+        else:
+            micros = (value - _EPOCH_UTC) // timedelta(microseconds=1)
+        return msgpack.ExtType(EXT_DATETIME, _DATETIME.pack(micros, value.tzinfo is not None))
+    if isinstance(value, Enum):
+        return value.value
+    raise TypeError(f"{type(value).__name__} is not serializable")
+
+
+def _ext_hook(code: int, data: bytes):
+    if code == EXT_DATETIME:
+        micros, aware = _DATETIME.unpack(data)
+        return (_EPOCH_UTC if aware else _EPOCH) + timedelta(microseconds=micros)
+    return msgpack.ExtType(code, data)
+
+
+def dumps(value) -> bytes:
+    body = msgpack.packb(value, default=_default, use_bin_type=True)
+    flags = 0
+    if _compressor is not None and len(body) > CACHE_COMPRESS_THRESHOLD:
+        compressed = _compressor.compress(body)
+        if len(compressed) < len(body):
+            body, flags = compressed, FLAG_ZSTD
+    return bytes((CODEC_VERSION, flags)) + body
+
+
+def loads(data: bytes):
+    if len(data) < 2 or data[0] != CODEC_VERSION:
+        raise CodecError("unknown cache entry format")
+    body = memoryview(data)[2:]
+    if data[1] & FLAG_ZSTD:
+        if _decompressor is None:
+            raise CodecError("zstd-compressed entry, but zstandard is not installed")
+        body = _decompressor.decompress(body)
+    try:
+        return msgpack.unpackb(body, ext_hook=_ext_hook, raw=False, strict_map_key=False)
+    except (ValueError, msgpack.UnpackException) as e:
+        raise CodecError(str(e)) from e
+
+
+def short_key(key: str) -> str:
+    """32-character key for long identifiers such as JWTs (128-bit BLAKE2b)"""
+    return hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
@@ -0,0 +1,188 @@
+import asyncio
+import contextvars
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Optional
+
+import httpx
+from prometheus_client import Counter, Histogram
+
+# Hedge once an attempt has been outstanding longer than this quantile of recent latencies
+HEDGE_QUANTILE = float(os.getenv("HEDGE_QUANTILE", "0.95"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY_SECONDS", "0.005"))
+HEDGE_MAX_ATTEMPTS = int(os.getenv("HEDGE_MAX_ATTEMPTS", "2"))
+# Extra attempts allowed per primary request, so hedging cannot multiply load
+HEDGE_BUDGET = float(os.getenv("HEDGE_BUDGET", "0.1"))
+LATENCY_WINDOW = int(os.getenv("HEDGE_LATENCY_WINDOW", "512"))
+
+# Remaining budget in milliseconds, so the callee can give up instead of doing wasted work
+DEADLINE_HEADER = "X-Request-Deadline-Ms"
+
+CLIENT_REQUESTS = Counter("http_client_requests_total", "Outgoing requests", ["target", "outcome"])
+CLIENT_DURATION = Histogram("http_client_duration_seconds", "Outgoing request latency incl. hedges",
+                            ["target"])
+CLIENT_HEDGES = Counter("http_client_hedges_total", "Extra attempts started by hedging", ["target"])
+CLIENT_HEDGE_WINS = Counter("http_client_hedge_wins_total", "Requests answered by a hedge", ["target"])
+
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceeded(asyncio.TimeoutError):
+    pass
+
+
+@contextmanager
+def deadline(seconds: float):
+    """Bounds every call made inside the block; nested blocks can only shorten it."""
+    at = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(at if current is None else min(current, at))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    at = _deadline.get()
+    return None if at is None else at - time.monotonic()
+
+
+class LatencyTracker:
+    """Recent attempt latencies; the quantile is recomputed every few samples."""
+
+    def __init__(self, window: int = LATENCY_WINDOW, quantile: float = HEDGE_QUANTILE):
+        self.samples: Deque[float] = deque(maxlen=window)
+        self.q = quantile
+        self._cached: Optional[float] = None
+        self._since = 0
+
+    def observe(self, seconds: float):
+        self.samples.append(seconds)
+        self._since += 1
+        if self._since >= 16:
+            self._cached = None
+
+    def quantile(self) -> Optional[float]:
+        if self._cached is None and len(self.samples) >= 20:
+            ordered = sorted(self.samples)
+            self._cached = ordered[min(len(ordered) - 1, int(len(ordered) * self.q))]
+            self._since = 0
+        return self._cached
+
+
+class HedgeBudget:
+    """Token bucket: each primary request earns `ratio` tokens, each hedge spends one."""
+
+    def __init__(self, ratio: float = HEDGE_BUDGET, cap: float = 10.0):
+        self.ratio = ratio
+        self.cap = cap
+        self.tokens = cap
+
+    def earn(self):
+        self.tokens = min(self.cap, self.tokens + self.ratio)
+
+    def spend(self) -> bool:
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class HedgedClient:
+    """httpx wrapper with per-call deadlines and hedged requests.
+
+    If the first attempt has not answered after `hedge_delay` (default: the
+    HEDGE_QUANTILE of recent latencies) or has failed, a second attempt is
+    started and whichever succeeds first wins; the loser is cancelled. Only
+    use it for idempotent calls (GET, or POST carrying an Idempotency-Key).
+    """
+
+    def __init__(self, client: httpx.AsyncClient, target: str, hedge_delay: Optional[float] = None,
+                 max_attempts: int = HEDGE_MAX_ATTEMPTS, budget: float = HEDGE_BUDGET):
+        self.client = client
+        self.target = target
+        self.hedge_delay = hedge_delay
+        self.max_attempts = max_attempts
+        self.latency = LatencyTracker()
+        self.budget = HedgeBudget(budget)
+
+    def _hedge_after(self) -> Optional[float]:
+        if self.hedge_delay is not None:
+            return self.hedge_delay
+        observed = self.latency.quantile()
+        return None if observed is None else max(HEDGE_MIN_DELAY, observed)
+
+    async def _attempt(self, method: str, url: str, end: float, kwargs: dict) -> httpx.Response:
+        started = time.monotonic()
+        headers = dict(kwargs.pop("headers", None) or {})
+        headers[DEADLINE_HEADER] = str(max(0, int((end - started) * 1000)))
+        response = await self.client.request(method, url, headers=headers, **kwargs)
+        self.latency.observe(time.monotonic() - started)
+        return response
+
+    async def request(self, method: str, url: str, *, timeout: Optional[float] = None,
+                      hedge: bool = True, **kwargs) -> httpx.Response:
+        started = now = time.monotonic()
+        budgets = [t for t in (timeout, remaining()) if t is not None]
+        end = now + (min(budgets) if budgets else 30.0)
+        if end <= now:
+            CLIENT_REQUESTS.labels(self.target, "deadline").inc()
+            raise DeadlineExceeded(f"{self.target}: no time left")
+
+        self.budget.earn()
+        hedge_after = self._hedge_after() if hedge else None
+        next_hedge = now + hedge_after if hedge_after is not None else None
+        tasks = [asyncio.ensure_future(self._attempt(method, url, end, dict(kwargs)))]
+        started_tasks = list(tasks)
+        last_response: Optional[httpx.Response] = None
+        last_error: Optional[BaseException] = None
+        try:
+            while True:
+                now = time.monotonic()
+                wake = end if next_hedge is None else min(end, next_hedge)
+                done, _ = await asyncio.wait(tasks, timeout=max(0.0, wake - now),
+                                             return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    tasks.remove(task)
+                    if task.exception() is not None:
+                        last_error = task.exception()
+                        continue
+                    response = task.result()
+                    if response.status_code < 500:
+                        if task is not started_tasks[0]:
+                            CLIENT_HEDGE_WINS.labels(self.target).inc()
+                        CLIENT_REQUESTS.labels(self.target, str(response.status_code)).inc()
+                        return response
+                    last_response = response
+
+                now = time.monotonic()
+                if now >= end:
+                    CLIENT_REQUESTS.labels(self.target, "deadline").inc()
+                    raise DeadlineExceeded(f"{self.target}: deadline exceeded")
+                can_hedge = hedge and len(started_tasks) < self.max_attempts
+                # A failed attempt is replaced at once, a slow one after hedge_after
+                if can_hedge and (not tasks or (next_hedge is not None and now >= next_hedge)):
+                    next_hedge = None
+                    if self.budget.spend():
+                        CLIENT_HEDGES.labels(self.target).inc()
+                        task = asyncio.ensure_future(self._attempt(method, url, end, dict(kwargs)))
+                        tasks.append(task)
+                        started_tasks.append(task)
+                        continue
+                if next_hedge is not None and now >= next_hedge:
+                    next_hedge = None
+                if not tasks:
+                    if last_response is not None:
+                        CLIENT_REQUESTS.labels(self.target, str(last_response.status_code)).inc()
+                        return last_response
+                    CLIENT_REQUESTS.labels(self.target, "error").inc()
+                    raise last_error
+        finally:
+            for task in tasks:
+                task.cancel()
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+            CLIENT_DURATION.labels(self.target).observe(time.monotonic() - started)
@@ -0,0 +1,239 @@
+"""Opt-in detector of blocking calls on the event loop.
+
+    LOOP_DIAGNOSTICS=1 uvicorn main:app ...
+    curl localhost:8000/admin/loop/blocking
+
+A task on the loop ticks every LOOP_WATCH_INTERVAL_MS and measures how late
+it wakes up. A watchdog thread checks the last tick. Once the loop has been
+stuck for LOOP_BLOCK_THRESHOLD_MS, it takes the loop thread's current stack
+from sys._current_frames(). That is the code holding the loop: a sync
+SQLAlchemy query, a sync Redis call, bcrypt, time.sleep. The stall's full
+duration is measured when the loop resumes.
+
+Stalls are aggregated by call site, the innermost frame outside the standard
+library and site-packages, i.e. the application line that made the blocking
+call. /admin/loop/blocking lists the sites by total blocked time, with an
+example stack; DELETE resets them. Off by default: the watchdog wakes up
+every interval and a capture walks the stack.
+"""
+import asyncio
+import logging
+import os
+import sys
+import sysconfig
+import threading
+import time
+import traceback
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import APIRouter
+from prometheus_client import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+LOOP_DIAGNOSTICS = os.getenv("LOOP_DIAGNOSTICS", "0").lower() in ("1", "true", "yes")
+LOOP_BLOCK_THRESHOLD = float(os.getenv("LOOP_BLOCK_THRESHOLD_MS", "100")) / 1000
+LOOP_WATCH_INTERVAL = float(os.getenv("LOOP_WATCH_INTERVAL_MS", "20")) / 1000
+LOOP_MAX_SITES = int(os.getenv("LOOP_DIAGNOSTICS_MAX_SITES", "200"))
+
+STALLS = Counter("event_loop_stalls_total", "Times the event loop was blocked past the threshold")
+STALL_DURATION = Histogram("event_loop_stall_seconds", "Duration of event loop stalls past the threshold",
+                           buckets=(.05, .1, .25, .5, 1, 2.5, 5, 10, 30))
+
+_SELF = os.path.realpath(__file__)
+_LIBRARY_PATHS = tuple(sorted({os.path.realpath(path) for name, path in sysconfig.get_paths().items()
+                               if name in ("stdlib", "platstdlib", "purelib", "platlib")}))
+
+
+def _is_library(filename: str) -> bool:
+    if filename.startswith("<"):
+        return True
+    path = os.path.realpath(filename)
+    return path == _SELF or path.startswith(_LIBRARY_PATHS)
+
+
+def _where(frame: traceback.FrameSummary) -> str:
+    filename = frame.filename
+    if _is_library(filename):
+        filename = os.path.join(*filename.split(os.sep)[-2:])
+    else:
+        filename = os.path.relpath(filename)
+    return f"{filename}:{frame.lineno} in {frame.name}"
+
+
+def _callback_stack(stack: List[traceback.FrameSummary]) -> List[traceback.FrameSummary]:
+    """Frames of the loop callback being run (the blocking coroutine), without the server and loop above it"""
+    for i in range(len(stack) - 1, -1, -1):
+        entry = stack[i]
+        if entry.name == "_run" and entry.filename.endswith(os.path.join("asyncio", "events.py")):
+            return stack[i + 1:]
+    return stack
+
+
+class _Site:
+    __slots__ = ("count", "total", "max", "last_seen", "blocking_in", "stack")
+
+    def __init__(self, blocking_in: str, stack: List[str]):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last_seen = 0.0
+        self.blocking_in = blocking_in
+        self.stack = stack
+
+
+class LoopWatchdog:
+    """Loop-side ticker plus a watchdog thread; reports are aggregated by call site."""
+
+    def __init__(self, threshold: float = LOOP_BLOCK_THRESHOLD, interval: float = LOOP_WATCH_INTERVAL,
+                 max_sites: int = LOOP_MAX_SITES):
+        self.threshold = threshold
+        self.interval = interval
+        self.max_sites = max_sites
+        self._sites: Dict[str, _Site] = {}
+        self._lock = threading.Lock()
+        self._tick = time.monotonic()
+        self._seq = 0
+        # (tick sequence the stall was seen in, site, blocking_in, stack) until the loop resumes
+        self._pending: Optional[Tuple[int, str, str, List[str]]] = None
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.stalls = 0
+        self.max_lag = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def start(self):
+        """Starts watching the running loop; call from the loop thread"""
+        if self._task is not None:
+            return
+        self._loop_thread = threading.get_ident()
+        self._tick = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._ticker())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        logger.info("Loop diagnostics on: stalls over %.0f ms are captured", self.threshold * 1000)
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._stop.set()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await asyncio.to_thread(self._thread.join)
+
+    async def _ticker(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = now - self._tick - self.interval
+            seq = self._seq
+            # tick before seq: the watchdog reads them in the opposite order
+            self._tick = now
+            self._seq = seq + 1
+            self.max_lag = max(self.max_lag, lag)
+            with self._lock:
+                pending, self._pending = self._pending, None
+            if pending is not None and pending[0] == seq:
+                self._record(*pending[1:], lag)
+
+    def _watch(self):
+        captured = -1
+        while not self._stop.wait(self.interval):
+            seq = self._seq
+            stalled = time.monotonic() - self._tick - self.interval
+            if stalled < self.threshold or seq == captured:
+                continue
+            captured = seq
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            stack = _callback_stack(traceback.extract_stack(frame))
+            del frame
+            site, blocking_in = self._call_site(stack)
+            with self._lock:
+                self._pending = (seq, site, blocking_in, [_where(entry) for entry in stack])
+
+    @staticmethod
+    def _call_site(stack: List[traceback.FrameSummary]) -> Tuple[str, str]:
+        """(innermost application frame, innermost frame overall)"""
+        innermost = _where(stack[-1]) if stack else "<unknown>"
+        for entry in reversed(stack):
+            if not _is_library(entry.filename):
+                return _where(entry), innermost
+        return innermost, innermost
+
+    def _record(self, site: str, blocking_in: str, stack: List[str], duration: float):
+        self.stalls += 1
+        STALLS.inc()
+        STALL_DURATION.observe(duration)
+        entry = self._sites.get(site)
+        if entry is None:
+            if len(self._sites) >= self.max_sites:
+                # Keep the table bounded: forget the site that blocked the least
+                del self._sites[min(self._sites, key=lambda key: self._sites[key].total)]
+            entry = self._sites[site] = _Site(blocking_in, stack)
+        entry.count += 1
+        entry.total += duration
+        entry.max = max(entry.max, duration)
+        entry.last_seen = time.time()
+        entry.blocking_in, entry.stack = blocking_in, stack
+        logger.warning("Event loop blocked for %.0f ms at %s (in %s)", duration * 1000, site, blocking_in)
+
+    def report(self) -> dict:
+        sites = sorted(self._sites.items(), key=lambda item: item[1].total, reverse=True)
+        return {
+            "enabled": self.running,
+            "threshold_ms": self.threshold * 1000,
+            "interval_ms": self.interval * 1000,
+            "stalls": self.stalls,
+            "max_lag_ms": round(self.max_lag * 1000, 1),
+            "sites": [{
+                "site": site,
+                "blocking_in": entry.blocking_in,
+                "count": entry.count,
+                "total_ms": round(entry.total * 1000, 1),
+                "max_ms": round(entry.max * 1000, 1),
+                "last_seen": entry.last_seen,
+                "stack": entry.stack,
+            } for site, entry in sites],
+        }
+
+    def reset(self):
+        self._sites.clear()
+        self.stalls = 0
+        self.max_lag = 0.0
+
+
+watchdog = LoopWatchdog()
+
+router = APIRouter(prefix="/admin/loop", tags=["Admin"])
+
+
+@router.get("/blocking")
+async def blocking_report():
+    return watchdog.report()
+
+
+@router.delete("/blocking")
+async def reset_blocking_report():
+    watchdog.reset()
+    return watchdog.report()
+
+
+def install_loop_diagnostics(app, enabled: bool = LOOP_DIAGNOSTICS):
+    """Adds the watchdog and /admin/loop/blocking to the app when LOOP_DIAGNOSTICS is on"""
+    if not enabled:
+        return
+    app.include_router(router)
+    app.add_event_handler("startup", watchdog.start)
+    app.add_event_handler("shutdown", watchdog.stop)
@@ -0,0 +1,209 @@
+"""HTTP server and runtime metrics shared by the services.
+
+    app.add_middleware(PrometheusMiddleware)   # added last, so it is the outermost
+
+Each request is recorded by method, route template and status. The route
+label is the template (/users/{username}), not the raw path, so the number of
+series stays bounded. Requests that matched no route get "<unmatched>".
+    http_requests_total, http_request_duration_seconds, http_response_size_bytes
+    http_requests_in_progress (by method: the route is only known once routed)
+The hot path does not go through prometheus_client's metric objects, which
+take a lock and check their labels on every update. The middleware counts into
+plain per-(method, route, status) slots on the event loop thread, and a
+collector turns them into the families above when /metrics is scraped. That
+costs about two microseconds per request (benchmarks/metrics_overhead.py).
+
+The middleware also reports how the process is doing:
+    event_loop_lag_seconds     how late a periodic sleep wakes up; started with
+                               the first request, stopped on lifespan shutdown
+    python_gc_pause_seconds    duration of each collection, by generation
+/metrics stays an ordinary route of every service and is not counted itself.
+"""
+import asyncio
+import gc
+import os
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from prometheus_client import REGISTRY, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, HistogramMetricFamily
+from prometheus_client.utils import floatToGoString
+from starlette.routing import Match
+
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL_SECONDS", "0.5"))
+
+UNMATCHED = "<unmatched>"
+METHODS = frozenset(("GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"))
+
+DURATION_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+LABELS = ("method", "route", "status")
+
+LOOP_LAG = Histogram("event_loop_lag_seconds", "Delay of a periodic event loop wake-up",
+                     buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5))
+GC_PAUSE = Histogram("python_gc_pause_seconds", "Duration of a garbage collection", ["generation"],
+                     buckets=(.0001, .0005, .001, .0025, .005, .01, .025, .05, .1, .25))
+
+_gc_pauses = [GC_PAUSE.labels(str(generation)) for generation in range(3)]
+_gc_started = 0.0
+
+
+def _gc_callback(phase: str, info: dict):
+    global _gc_started
+    if phase == "start":
+        _gc_started = time.perf_counter()
+    else:
+        _gc_pauses[info["generation"]].observe(time.perf_counter() - _gc_started)
+
+
+def install_gc_metrics():
+    """Times garbage collections; idempotent"""
+    if _gc_callback not in gc.callbacks:
+        gc.callbacks.append(_gc_callback)
+
+
+class _RouteStats:
+    """Counters of one (method, route, status); buckets are per interval, made cumulative on collect"""
+    __slots__ = ("count", "duration_sum", "durations", "size_sum", "sizes")
+
+    def __init__(self):
+        self.count = 0
+        self.duration_sum = 0.0
+        self.durations = [0] * (len(DURATION_BUCKETS) + 1)
+        self.size_sum = 0
+        self.sizes = [0] * (len(SIZE_BUCKETS) + 1)
+
+
+# Written only from the event loop thread; a scrape reads them between requests
+_stats: Dict[Tuple[str, str, str], _RouteStats] = {}
+_in_progress: Dict[str, int] = defaultdict(int)
+
+
+def _buckets(bounds, counts) -> List[Tuple[str, int]]:
+    buckets, total = [], 0
+    for bound, count in zip((*bounds, float("inf")), counts):
+        total += count
+        buckets.append((floatToGoString(bound), total))
+    return buckets
+
+
+class HTTPCollector:
+    def describe(self):
+        return []
+
+    def collect(self):
+        requests = CounterMetricFamily("http_requests", "HTTP requests served", labels=LABELS)
+        durations = HistogramMetricFamily("http_request_duration_seconds",
+                                          "Time from request to the last response byte", labels=LABELS)
+        sizes = HistogramMetricFamily("http_response_size_bytes", "Response body size", labels=LABELS)
+        for key, stats in list(_stats.items()):
+            requests.add_metric(key, stats.count)
+            durations.add_metric(key, _buckets(DURATION_BUCKETS, stats.durations), stats.duration_sum)
+            sizes.add_metric(key, _buckets(SIZE_BUCKETS, stats.sizes), stats.size_sum)
+        in_progress = GaugeMetricFamily("http_requests_in_progress", "Requests being served", labels=["method"])
+        for method, count in list(_in_progress.items()):
+            in_progress.add_metric([method], count)
+        return [requests, durations, sizes, in_progress]
+
+
+REGISTRY.register(HTTPCollector())
+
+
+async def _probe_loop_lag(interval: float):
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        LOOP_LAG.observe(max(0.0, loop.time() - started - interval))
+
+
+class PrometheusMiddleware:
+    """Pure ASGI middleware: no per-request Request objects or extra tasks."""
+
+    def __init__(self, app, exclude: Iterable[str] = ("/metrics",), lag_interval: float = LOOP_LAG_INTERVAL):
+        self.app = app
+        self.exclude = frozenset(exclude)
+        self.lag_interval = lag_interval
+        self._routes: Dict[object, List] = {}
+        self._route_count = -1
+        self._lag_task: Optional[asyncio.Task] = None
+        install_gc_metrics()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exclude:
+            if scope["type"] == "lifespan":
+                receive = self._lifespan_receive(receive)
+            await self.app(scope, receive, send)
+            return
+        if self._lag_task is None and self.lag_interval > 0:
+            self._lag_task = asyncio.create_task(_probe_loop_lag(self.lag_interval))
+
+        method = scope["method"] if scope["method"] in METHODS else "other"
+        status = 500
+        size = 0
+
+        async def send_wrapper(message):
+            nonlocal status, size
+            if message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            elif message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        _in_progress[method] += 1
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            _in_progress[method] -= 1
+            key = (method, self._route(scope), str(status))
+            stats = _stats.get(key)
+            if stats is None:
+                stats = _stats[key] = _RouteStats()
+            stats.count += 1
+            stats.duration_sum += elapsed
+            stats.durations[bisect_left(DURATION_BUCKETS, elapsed)] += 1
+            stats.size_sum += size
+            stats.sizes[bisect_left(SIZE_BUCKETS, size)] += 1
+
+    def _route(self, scope) -> str:
+        """Template of the route the router matched; it leaves the endpoint in the (shared) scope"""
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return UNMATCHED
+        routes = self._routes.get(endpoint)
+        if routes is None:
+            app_routes = scope["app"].routes
+            if len(app_routes) == self._route_count:
+                return UNMATCHED
+            self._index(app_routes)
+            routes = self._routes.get(endpoint)
+            if routes is None:
+                return UNMATCHED
+        if len(routes) > 1:
+            # One handler behind several paths (/health and /healthcheck)
+            for route in routes:
+                if route.matches(scope)[0] == Match.FULL:
+                    return route.path
+        return routes[0].path
+
+    def _index(self, app_routes):
+        routes = defaultdict(list)
+        for route in app_routes:
+            # Mounts put their sub-application into the scope instead of an endpoint
+            routes[getattr(route, "endpoint", None) or getattr(route, "app", None)].append(route)
+        self._routes = dict(routes)
+        self._route_count = len(app_routes)
+
+    def _lifespan_receive(self, receive):
+        async def wrapped():
+            message = await receive()
+            if message["type"] == "lifespan.shutdown" and self._lag_task is not None:
+                self._lag_task.cancel()
+                self._lag_task = None
+            return message
+
+        return wrapped
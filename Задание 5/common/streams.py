@@ -0,0 +1,263 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional
+
+from prometheus_client import Counter, Gauge
+from redis.asyncio import Redis
+from redis.exceptions import ResponseError
+
+logger = logging.getLogger(__name__)
+
+# Streams are trimmed approximately (MAXLEN ~), which is O(1) per append
+STREAM_MAXLEN = int(os.getenv("STREAM_MAXLEN", "1000000"))
+PRODUCER_BATCH_SIZE = int(os.getenv("STREAM_PRODUCER_BATCH_SIZE", "500"))
+PRODUCER_LINGER = float(os.getenv("STREAM_PRODUCER_LINGER_SECONDS", "0.05"))
+# Events buffered while Redis is unreachable; the oldest are dropped beyond this
+PRODUCER_BUFFER_SIZE = int(os.getenv("STREAM_PRODUCER_BUFFER_SIZE", "100000"))
+
+CONSUMER_BATCH_SIZE = int(os.getenv("STREAM_CONSUMER_BATCH_SIZE", "500"))
+CONSUMER_BLOCK_MS = int(os.getenv("STREAM_CONSUMER_BLOCK_MS", "1000"))
+# Pending entries idle for this long belong to a dead consumer and are reclaimed
+CONSUMER_CLAIM_IDLE_MS = int(os.getenv("STREAM_CONSUMER_CLAIM_IDLE_MS", "60000"))
+CONSUMER_MAX_DELIVERIES = int(os.getenv("STREAM_CONSUMER_MAX_DELIVERIES", "5"))
+
+STREAM_PUBLISHED = Counter("stream_events_published_total", "Events appended to a stream", ["stream"])
+STREAM_DROPPED = Counter("stream_events_dropped_total", "Events dropped by a full producer buffer",
+                         ["stream"])
+STREAM_PUBLISH_ERRORS = Counter("stream_publish_errors_total", "Failed append batches")
+STREAM_PRODUCER_BUFFERED = Gauge("stream_producer_buffered_events", "Events waiting to be appended")
+STREAM_CONSUMED = Counter("stream_events_consumed_total", "Events acknowledged by a consumer group",
+                          ["stream", "group"])
+STREAM_RECLAIMED = Counter("stream_events_reclaimed_total", "Pending events taken over from idle consumers",
+                           ["stream", "group"])
+STREAM_DEAD_LETTERS = Counter("stream_events_dead_lettered_total",
+                              "Events moved to the dead-letter stream", ["stream", "group"])
+STREAM_HANDLER_ERRORS = Counter("stream_handler_errors_total", "Failed handler batches", ["stream", "group"])
+
+
+def _str(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class StreamEvent(NamedTuple):
+    id: str
+    type: str
+    data: dict
+
+
+def encode(event_type: str, data: dict) -> Dict[str, str]:
+    return {"type": event_type, "data": json.dumps(data, default=str, separators=(",", ":"))}
+
+
+def decode(entry_id, fields) -> StreamEvent:
+    fields = {_str(k): _str(v) for k, v in fields.items()}
+    return StreamEvent(_str(entry_id), fields.get("type", ""), json.loads(fields.get("data") or "{}"))
+
+
+class StreamProducer:
+    """Buffers events and appends them to Redis Streams in pipelined batches.
+
+    publish() never awaits, so it can be called from code that must not yield
+    to the event loop; a background task drains the buffer every `linger`
+    seconds or as soon as a full batch is waiting.
+    """
+
+    def __init__(self, redis: Redis, maxlen: int = STREAM_MAXLEN,
+                 batch_size: int = PRODUCER_BATCH_SIZE, linger: float = PRODUCER_LINGER,
+                 buffer_size: int = PRODUCER_BUFFER_SIZE):
+        self.redis = redis
+        self.maxlen = maxlen
+        self.batch_size = batch_size
+        self.linger = linger
+        self._buffer = deque(maxlen=buffer_size)
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def publish(self, stream: str, event_type: str, data: dict) -> None:
+        if len(self._buffer) == self._buffer.maxlen:
+            STREAM_DROPPED.labels(self._buffer[0][0]).inc()
+        self._buffer.append((stream, encode(event_type, data)))
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    async def flush(self) -> int:
+        appended = 0
+        while self._buffer:
+            batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+            try:
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    for stream, fields in batch:
+                        pipe.xadd(stream, fields, maxlen=self.maxlen, approximate=True)
+                    await pipe.execute()
+            except Exception:
+                # Put the batch back in order and retry on the next tick
+                self._buffer.extendleft(reversed(batch))
+                raise
+            for stream, _ in batch:
+                STREAM_PUBLISHED.labels(stream).inc()
+            appended += len(batch)
+        return appended
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.linger)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                STREAM_PUBLISH_ERRORS.inc()
+                logger.exception("Stream append failed")
+                await asyncio.sleep(1)
+            STREAM_PRODUCER_BUFFERED.set(len(self._buffer))
+
+    def start(self) -> asyncio.Task:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+        return self._task
+
+    async def stop(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("Final stream flush failed, %d events lost", len(self._buffer))
+
+
+Handler = Callable[[List[StreamEvent]], Awaitable[None]]
+
+
+class StreamConsumer:
+    """Reads a stream as one member of a consumer group and hands events to
+    `handler` in batches.
+
+    A batch is acknowledged only after the handler returns, so delivery is
+    at-least-once and handlers must be idempotent. Entries left pending by a
+    crashed consumer are reclaimed with XAUTOCLAIM once they have been idle
+    for `claim_idle_ms`; entries that keep failing are moved to
+    `<stream>:dead` after `max_deliveries` attempts.
+    """
+
+    def __init__(self, redis: Redis, stream: str, group: str, consumer: str, handler: Handler,
+                 batch_size: int = CONSUMER_BATCH_SIZE, block_ms: int = CONSUMER_BLOCK_MS,
+                 claim_idle_ms: int = CONSUMER_CLAIM_IDLE_MS,
+                 max_deliveries: int = CONSUMER_MAX_DELIVERIES, start_id: str = "0"):
+        self.redis = redis
+        self.stream = stream
+        self.group = group
+        self.consumer = consumer
+        self.handler = handler
+        self.batch_size = batch_size
+        self.block_ms = block_ms
+        self.claim_idle_ms = claim_idle_ms
+        self.max_deliveries = max_deliveries
+        self.start_id = start_id
+        self.dead_letter_stream = f"{stream}:dead"
+        self._claim_cursor = "0-0"
+        self._last_claim = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    async def ensure_group(self):
+        try:
+            await self.redis.xgroup_create(self.stream, self.group, id=self.start_id, mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def _handle(self, entries) -> int:
+        if not entries:
+            return 0
+        events = [decode(entry_id, fields) for entry_id, fields in entries if fields]
+        if events:
+            try:
+                await self.handler(events)
+            except Exception:
+                STREAM_HANDLER_ERRORS.labels(self.stream, self.group).inc()
+                logger.exception("Handler failed on %d events from %s", len(events), self.stream)
+                return 0
+        # Entries trimmed away while pending come back without fields; ack them too
+        await self.redis.xack(self.stream, self.group, *(entry_id for entry_id, _ in entries))
+        STREAM_CONSUMED.labels(self.stream, self.group).inc(len(entries))
+        return len(entries)
+
+    async def _dead_letter(self):
+        pending = await self.redis.xpending_range(
+            self.stream, self.group, min="-", max="+", count=self.batch_size,
+            idle=self.claim_idle_ms)
+        poisoned = [_str(p["message_id"]) for p in pending
+                    if p.get("times_delivered", 0) >= self.max_deliveries]
+        for entry_id in poisoned:
+            entries = await self.redis.xrange(self.stream, entry_id, entry_id)
+            if entries:
+                await self.redis.xadd(self.dead_letter_stream,
+                                      {**entries[0][1], "group": self.group, "origin_id": entry_id},
+                                      maxlen=self.batch_size * 100, approximate=True)
+            await self.redis.xack(self.stream, self.group, entry_id)
+            STREAM_DEAD_LETTERS.labels(self.stream, self.group).inc()
+
+    async def reclaim(self) -> int:
+        """Takes over one batch of entries left pending by idle consumers."""
+        await self._dead_letter()
+        result = await self.redis.xautoclaim(
+            self.stream, self.group, self.consumer, self.claim_idle_ms,
+            start_id=self._claim_cursor, count=self.batch_size)
+        self._claim_cursor = _str(result[0])
+        entries = result[1]
+        if entries:
+            STREAM_RECLAIMED.labels(self.stream, self.group).inc(len(entries))
+        return await self._handle(entries)
+
+    async def read_once(self) -> int:
+        response = await self.redis.xreadgroup(self.group, self.consumer, {self.stream: ">"},
+                                               count=self.batch_size, block=self.block_ms)
+        handled = 0
+        for _, entries in response or []:
+            handled += await self._handle(entries)
+        return handled
+
+    async def run(self):
+        await self.ensure_group()
+        # Own pending entries first: they were delivered before a restart
+        while True:
+            response = await self.redis.xreadgroup(self.group, self.consumer, {self.stream: "0"},
+                                                   count=self.batch_size)
+            entries = response[0][1] if response else []
+            if not entries or not await self._handle(entries):
+                break
+        while True:
+            try:
+                if time.monotonic() - self._last_claim > self.claim_idle_ms / 1000:
+                    self._last_claim = time.monotonic()
+                    await self.reclaim()
+                await self.read_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Reading %s failed", self.stream)
+                await asyncio.sleep(1)
+
+    def start(self) -> asyncio.Task:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+        return self._task
+
+    async def stop(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
@@ -0,0 +1,247 @@
+import asyncio
+import functools
+import logging
+import random
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple
+
+from prometheus_client import Counter, Histogram
+from redis.exceptions import RedisError
+
+from common import codec
+from common.cache import KeySpace
+
+logger = logging.getLogger(__name__)
+
+SWR_REQUESTS = Counter("swr_cache_requests_total", "SWR cache lookups", ["namespace", "result"])
+SWR_REFRESHES = Counter("swr_cache_refreshes_total", "SWR recomputations", ["namespace", "outcome"])
+SWR_REFRESH_DURATION = Histogram("swr_cache_refresh_duration_seconds", "Time to recompute a value",
+                                 ["namespace"])
+
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end
+return 0
+"""
+
+_MISSING = object()
+
+
+class SWRCache:
+    """Stale-while-revalidate cache in Redis with single-flight refresh.
+
+    Every entry carries a soft and a hard expiry. Before the soft expiry it is
+    served as is. Between the two it is still served, and one caller across
+    all workers (whoever takes the Redis lock) recomputes it in the
+    background. After the hard expiry Redis has dropped it. The caller that
+    gets the lock recomputes, and the others wait for its result for up to
+    `wait` seconds instead of piling onto the backend. Both TTLs are jittered
+    so keys written together do not expire together. If Redis fails, values
+    are computed directly. Entries are encoded with common.codec, so the Redis
+    client must return bytes. Keys live in the swr:<namespace> KeySpace, so
+    invalidate_all() drops the namespace by bumping its generation.
+    """
+
+    def __init__(self, namespace: str, soft_ttl: float, hard_ttl: float, redis, jitter: float = 0.1,
+                 lock_ttl: float = 10.0, wait: Optional[float] = None,
+                 encode: Callable[[Any], Any] = lambda value: value,
+                 decode: Callable[[Any], Any] = lambda value: value):
+        self.namespace = namespace
+        self.soft_ttl = soft_ttl
+        self.hard_ttl = hard_ttl
+        self.jitter = jitter
+        self.lock_ttl = lock_ttl
+        self.wait = lock_ttl if wait is None else wait
+        self.encode = encode
+        self.decode = decode
+        self._redis = redis
+        self._client = None
+        self._keys: Optional[KeySpace] = None
+        self._release = None
+        # In-process single flight on top of the Redis lock
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._refreshing: Set[asyncio.Task] = set()
+
+    @property
+    def redis(self):
+        if self._client is None:
+            self._client = self._redis() if callable(self._redis) else self._redis
+            self._release = self._client.register_script(RELEASE_SCRIPT)
+        return self._client
+
+    @property
+    def keys(self) -> KeySpace:
+        if self._keys is None:
+            self._keys = KeySpace(self.redis, f"swr:{self.namespace}")
+        return self._keys
+
+    def _jittered(self, ttl: float) -> float:
+        return ttl * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    # entry_key is the full Redis key in the generation the entry was read in;
+    # if the namespace is bumped meanwhile, the refreshed value lands in the old one
+
+    def _entry(self, value: Any) -> Tuple[bytes, int]:
+        """(encoded entry, hard TTL in ms)"""
+        soft = self._jittered(self.soft_ttl)
+        hard = max(soft, self._jittered(self.hard_ttl))
+        return codec.dumps({"v": self.encode(value), "soft": time.time() + soft}), int(hard * 1000)
+
+    async def _store(self, entry_key: str, value: Any):
+        entry, px = self._entry(value)
+        await self.redis.set(entry_key, entry, px=px)
+
+    def stage(self, pipe, generation, key: str, value: Any):
+        """Queues a write on a pipeline of this cache's client, for bulk warm-up; existing entries are kept"""
+        entry, px = self._entry(value)
+        pipe.set(self.keys.key(generation, key), entry, px=px, nx=True)
+
+    async def _lock(self, entry_key: str) -> Optional[str]:
+        token = uuid.uuid4().hex
+        if await self.redis.set(entry_key + ":lock", token, nx=True, px=int(self.lock_ttl * 1000)):
+            return token
+        return None
+
+    async def _unlock(self, entry_key: str, token: str):
+        try:
+            await self._release(keys=[entry_key + ":lock"], args=[token])
+        except RedisError:
+            pass
+
+    async def _recompute(self, entry_key: str, compute: Callable[[], Awaitable[Any]], token: str) -> Any:
+        started = time.perf_counter()
+        try:
+            value = await compute()
+            await self._store(entry_key, value)
+            SWR_REFRESHES.labels(self.namespace, "ok").inc()
+            return value
+        except Exception:
+            SWR_REFRESHES.labels(self.namespace, "error").inc()
+            raise
+        finally:
+            SWR_REFRESH_DURATION.labels(self.namespace).observe(time.perf_counter() - started)
+            await self._unlock(entry_key, token)
+
+    async def _background_refresh(self, entry_key: str, compute: Callable[[], Awaitable[Any]], token: str):
+        try:
+            await self._recompute(entry_key, compute, token)
+        except Exception:
+            logger.exception("SWR refresh of %s failed, stale value stays", entry_key)
+
+    async def _read(self, key: str) -> Tuple[Any, Optional[float], str]:
+        """(value or _MISSING, soft expiry, entry key in the current generation)"""
+        generation, raw = await self.keys.read(key)
+        entry_key = self.keys.key(generation, key)
+        if raw is None:
+            return _MISSING, None, entry_key
+        try:
+            entry = codec.loads(raw)
+        except codec.CodecError:
+            # Written in another format: recompute and overwrite it
+            return _MISSING, None, entry_key
+        return self.decode(entry["v"]), entry["soft"], entry_key
+
+    async def _fill(self, key: str, entry_key: str, compute: Callable[[], Awaitable[Any]]) -> Tuple[Any, str]:
+        token = await self._lock(entry_key)
+        if token:
+            return await self._recompute(entry_key, compute, token), "miss"
+        # Another worker is computing it: wait for its result rather than duplicating the work
+        deadline = time.monotonic() + self.wait
+        delay = 0.005
+        while time.monotonic() < deadline:
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.1)
+            value, _, _ = await self._read(key)
+            if value is not _MISSING:
+                return value, "wait"
+        return await compute(), "wait_timeout"
+
+    async def fetch(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Tuple[Any, str]:
+        """Returns (value, result); result is hit, stale, miss, wait, wait_timeout or error."""
+        try:
+            value, soft, entry_key = await self._read(key)
+        except RedisError:
+            SWR_REQUESTS.labels(self.namespace, "error").inc()
+            return await compute(), "error"
+        if value is not _MISSING:
+            if soft > time.time():
+                result = "hit"
+            else:
+                result = "stale"
+                token = await self._lock(entry_key)
+                if token:
+                    task = asyncio.create_task(self._background_refresh(entry_key, compute, token))
+                    self._refreshing.add(task)
+                    task.add_done_callback(self._refreshing.discard)
+            SWR_REQUESTS.labels(self.namespace, result).inc()
+            return value, result
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            SWR_REQUESTS.labels(self.namespace, "wait").inc()
+            return await asyncio.shield(inflight), "wait"
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            try:
+                value, result = await self._fill(key, entry_key, compute)
+            except RedisError:
+                value, result = await compute(), "error"
+            future.set_result(value)
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark it retrieved: there may be no other caller waiting on it
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+        SWR_REQUESTS.labels(self.namespace, result).inc()
+        return value, result
+
+    async def get(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        value, _ = await self.fetch(key, compute)
+        return value
+
+    async def invalidate(self, key: str):
+        try:
+            await self.keys.delete(key)
+        except RedisError:
+            logger.warning("Could not invalidate %s:%s", self.namespace, key)
+
+    async def invalidate_all(self):
+        try:
+            await self.keys.bump()
+        except RedisError:
+            logger.warning("Could not invalidate namespace %s", self.namespace)
+
+
+def _default_key(*args, **kwargs) -> str:
+    return ":".join([*(str(a) for a in args), *(f"{k}={v}" for k, v in sorted(kwargs.items()))])
+
+
+def swr_cached(namespace: str, soft_ttl: float, hard_ttl: float, redis, key: Optional[Callable[..., str]] = None,
+               **options):
+    """Caches an async function (or FastAPI handler) with SWRCache.
+
+    The cache key is built from the call arguments by `key`, by default all of
+    them joined with ":". A handler that takes Request, Session and similar
+    objects needs an explicit `key`. The wrapper keeps the signature, so
+    FastAPI still resolves the handler's parameters, and it gets `invalidate(*args)`
+    and `cache` attributes.
+    """
+    def decorator(func):
+        cache = SWRCache(namespace, soft_ttl, hard_ttl, redis, **options)
+        make_key = key or _default_key
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            return await cache.get(make_key(*args, **kwargs), lambda: func(*args, **kwargs))
+
+        async def invalidate(*args, **kwargs):
+            await cache.invalidate(make_key(*args, **kwargs))
+
+        wrapper.invalidate = invalidate
+        wrapper.cache = cache
+        return wrapper
+
+    return decorator
@@ -0,0 +1,85 @@
+import os
+from typing import Dict, Optional
+
+import httpx
+
+from common.http import HedgedClient
+
+CART_SERVICE_URL = os.getenv("CART_SERVICE_URL", "http://cart_service:8002")
+PAYMENT_SERVICE_URL = os.getenv("PAYMENT_SERVICE_URL", "http://payment_stub:8010")
+DELIVERY_SERVICE_URL = os.getenv("DELIVERY_SERVICE_URL", "http://delivery_stub:8011")
+# Hard upper bound on one downstream call, hedges included; a request-wide
+# deadline (common.http.deadline) can only shorten it
+CALL_DEADLINE = float(os.getenv("DOWNSTREAM_DEADLINE_SECONDS", "2.0"))
+POOL_SIZE = int(os.getenv("DOWNSTREAM_POOL_SIZE", "100"))
+# 0 turns hedging off, e.g. to measure the unhedged tail
+HEDGE_ENABLED = os.getenv("DOWNSTREAM_HEDGING", "1") != "0"
+
+# Outbox topic -> (base url, path); refund and delivery_cancel undo the first two
+TOPICS = {
+    "payment": (PAYMENT_SERVICE_URL, "/payments"),
+    "delivery": (DELIVERY_SERVICE_URL, "/deliveries"),
+    "refund": (PAYMENT_SERVICE_URL, "/refunds"),
+    "delivery_cancel": (DELIVERY_SERVICE_URL, "/cancellations"),
+}
+
+
+class Downstream:
+    """Pooled clients for the cart service and the payment/delivery systems.
+
+    Every target gets its own HedgedClient (and so its own latency window and
+    hedge budget) over one shared connection pool. Calls are bounded by
+    `deadline` and by whatever deadline the caller set for the whole request.
+    """
+
+    def __init__(self, deadline: float = CALL_DEADLINE, pool_size: int = POOL_SIZE,
+                 hedging: bool = HEDGE_ENABLED):
+        self.deadline = deadline
+        self.pool_size = pool_size
+        self.hedging = hedging
+        self._client: Optional[httpx.AsyncClient] = None
+        self._targets: Dict[str, HedgedClient] = {}
+
+    async def start(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.deadline),
+                limits=httpx.Limits(max_connections=self.pool_size,
+                                    max_keepalive_connections=self.pool_size),
+            )
+            self._targets = {target: HedgedClient(self._client, target)
+                             for target in ("cart", *TOPICS)}
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._targets = {}
+
+    async def _call(self, target: str, method: str, url: str, hedge: bool = True,
+                    **kwargs) -> httpx.Response:
+        return await self._targets[target].request(method, url, timeout=self.deadline,
+                                                   hedge=hedge and self.hedging, **kwargs)
+
+    async def get_cart(self, authorization: str) -> dict:
+        response = await self._call("cart", "GET", f"{CART_SERVICE_URL}/cart",
+                                    headers={"Authorization": authorization})
+        response.raise_for_status()
+        return response.json()
+
+    async def clear_cart(self, authorization: str) -> None:
+        # Not hedged: a second DELETE racing a later add would drop that line
+        response = await self._call("cart", "DELETE", f"{CART_SERVICE_URL}/cart", hedge=False,
+                                    headers={"Authorization": authorization})
+        response.raise_for_status()
+
+    async def send(self, topic: str, payload: dict, idempotency_key: str) -> dict:
+        # Safe to hedge: the receiver deduplicates on the Idempotency-Key
+        base_url, path = TOPICS[topic]
+        response = await self._call(topic, "POST", base_url + path, json=payload,
+                                    headers={"Idempotency-Key": idempotency_key})
+        response.raise_for_status()
+        return response.json()
+
+
+downstream = Downstream()
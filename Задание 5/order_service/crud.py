@@ -0,0 +1,153 @@
+import json
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import text
+from database import SessionLocal
+
+
+class InsufficientStock(Exception):
+    def __init__(self, product_ids: List[str]):
+        super().__init__(", ".join(product_ids))
+        self.product_ids = product_ids
+
+
+# A concurrent duplicate blocks on the unique key until the first transaction
+# ends, then gets no row back and reads the order that won
+INSERT_ORDER_SQL = text("""
+INSERT INTO orders (user_id, idempotency_key, total)
+VALUES (:user_id, :idempotency_key, :total)
+ON CONFLICT (user_id, idempotency_key) DO NOTHING
+RETURNING id
+""")
+
+# Row locks are always taken in product_id order, so two orders sharing
+# products cannot deadlock
+LOCK_STOCK_SQL = text("""
+SELECT product_id, available FROM inventory
+WHERE product_id = ANY(CAST(:product_ids AS varchar[]))
+ORDER BY product_id
+FOR UPDATE
+""")
+
+RESERVE_STOCK_SQL = text("""
+UPDATE inventory i
+SET available = i.available - v.quantity, updated_at = now()
+FROM unnest(CAST(:product_ids AS varchar[]), CAST(:quantities AS integer[])) AS v(product_id, quantity)
+WHERE i.product_id = v.product_id
+""")
+
+INSERT_ITEMS_SQL = text("""
+INSERT INTO order_items (order_id, product_id, quantity, price)
+SELECT :order_id, v.product_id, v.quantity, v.price
+FROM unnest(CAST(:product_ids AS varchar[]), CAST(:quantities AS integer[]),
+            CAST(:prices AS numeric[])) AS v(product_id, quantity, price)
+""")
+
+INSERT_OUTBOX_SQL = text("""
+INSERT INTO outbox (order_id, topic, payload)
+SELECT :order_id, v.topic, CAST(v.payload AS jsonb)
+FROM unnest(CAST(:topics AS varchar[]), CAST(:payloads AS text[])) AS v(topic, payload)
+""")
+
+SELECT_ORDER_SQL = """
+SELECT id, user_id, status, payment_status, delivery_status, total, created_at
+FROM orders WHERE {where}
+"""
+
+SELECT_ITEMS_SQL = text("""
+SELECT order_id, product_id, quantity, price FROM order_items
+WHERE order_id = ANY(CAST(:order_ids AS bigint[]))
+ORDER BY order_id, product_id
+""")
+
+SET_STOCK_SQL = text("""
+INSERT INTO inventory (product_id, available) VALUES (:product_id, :available)
+ON CONFLICT (product_id) DO UPDATE SET available = EXCLUDED.available, updated_at = now()
+""")
+
+
+def _orders(db, where: str, params: dict) -> List[dict]:
+    rows = db.execute(text(SELECT_ORDER_SQL.format(where=where)), params).mappings().all()
+    orders = [dict(row, total=float(row["total"]), items=[]) for row in rows]
+    if orders:
+        by_id = {order["id"]: order for order in orders}
+        for order_id, product_id, quantity, price in db.execute(
+                SELECT_ITEMS_SQL, {"order_ids": list(by_id)}):
+            by_id[order_id]["items"].append(
+                {"product_id": product_id, "quantity": quantity, "price": float(price)})
+    return orders
+
+
+def get_order(user_id: int, order_id: int) -> Optional[dict]:
+    with SessionLocal() as db:
+        orders = _orders(db, "id = :order_id AND user_id = :user_id",
+                         {"order_id": order_id, "user_id": user_id})
+        return orders[0] if orders else None
+
+
+def get_order_by_key(user_id: int, idempotency_key: str) -> Optional[dict]:
+    with SessionLocal() as db:
+        orders = _orders(db, "user_id = :user_id AND idempotency_key = :idempotency_key",
+                         {"user_id": user_id, "idempotency_key": idempotency_key})
+        return orders[0] if orders else None
+
+
+def get_orders(user_id: int, limit: int = 50) -> List[dict]:
+    with SessionLocal() as db:
+        return _orders(db, "user_id = :user_id ORDER BY id DESC LIMIT :limit",
+                       {"user_id": user_id, "limit": limit})
+
+
+def place_order(user_id: int, idempotency_key: str,
+                lines: List[Tuple[str, int, float]]) -> Tuple[dict, bool]:
+    """Reserves stock and writes the order, its items and the outbox rows for
+    payment and delivery in one transaction. Returns (order, created); an
+    existing order with the same idempotency key is returned unchanged."""
+    quantities: Dict[str, int] = {}
+    prices: Dict[str, Decimal] = {}
+    for product_id, quantity, price in lines:
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+        prices[product_id] = Decimal(str(price)).quantize(Decimal("0.01"))
+    product_ids = sorted(quantities)
+    total = sum(prices[p] * quantities[p] for p in product_ids)
+
+    with SessionLocal() as db:
+        with db.begin():
+            row = db.execute(INSERT_ORDER_SQL, {"user_id": user_id, "idempotency_key": idempotency_key,
+                                                "total": total}).first()
+            if row is None:
+                existing = _orders(db, "user_id = :user_id AND idempotency_key = :idempotency_key",
+                                   {"user_id": user_id, "idempotency_key": idempotency_key})
+                return existing[0], False
+            order_id = row[0]
+
+            stock = dict(db.execute(LOCK_STOCK_SQL, {"product_ids": product_ids}).all())
+            short = [p for p in product_ids if stock.get(p, 0) < quantities[p]]
+            if short:
+                # Raising rolls back the order row as well
+                raise InsufficientStock(short)
+            db.execute(RESERVE_STOCK_SQL, {"product_ids": product_ids,
+                                           "quantities": [quantities[p] for p in product_ids]})
+            db.execute(INSERT_ITEMS_SQL, {"order_id": order_id, "product_ids": product_ids,
+                                          "quantities": [quantities[p] for p in product_ids],
+                                          "prices": [prices[p] for p in product_ids]})
+            items = [{"product_id": p, "quantity": quantities[p], "price": float(prices[p])}
+                     for p in product_ids]
+            payment = {"order_id": order_id, "user_id": user_id, "amount": float(total)}
+            delivery = {"order_id": order_id, "user_id": user_id, "items": items}
+            db.execute(INSERT_OUTBOX_SQL, {"order_id": order_id, "topics": ["payment", "delivery"],
+                                           "payloads": [json.dumps(payment), json.dumps(delivery)]})
+            order = _orders(db, "id = :order_id", {"order_id": order_id})[0]
+    return order, True
+
+
+def set_stock(product_id: str, available: int) -> None:
+    with SessionLocal() as db:
+        with db.begin():
+            db.execute(SET_STOCK_SQL, {"product_id": product_id, "available": available})
+
+
+def get_stock(product_id: str) -> Optional[int]:
+    with SessionLocal() as db:
+        return db.execute(text("SELECT available FROM inventory WHERE product_id = :product_id"),
+                          {"product_id": product_id}).scalar()
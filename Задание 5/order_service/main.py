@@ -0,0 +1,208 @@
+import asyncio
+import logging
+import os
+import time
+from typing import List
+from fastapi import FastAPI, HTTPException, Header, Depends, Query, Request, Response, status
+from fastapi.responses import RedirectResponse
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest
+import httpx
+from common.http import deadline
+from common.loopwatch import install_loop_diagnostics
+from common.metrics import PrometheusMiddleware
+import crud
+from auth import get_current_user_id
+from clients import downstream
+from database import init_db
+from outbox import relay
+from schemas import Order, StockLevel
+
+logger = logging.getLogger(__name__)
+
+# Budget for the downstream calls that place the order of one POST /orders
+ORDER_DEADLINE = float(os.getenv("ORDER_DEADLINE_SECONDS", "3.0"))
+# Clearing the cart of a placed order has a budget of its own
+CART_CLEAR_DEADLINE = float(os.getenv("CART_CLEAR_DEADLINE_SECONDS", "3.0"))
+CART_CLEAR_ATTEMPTS = int(os.getenv("CART_CLEAR_ATTEMPTS", "3"))
+CART_CLEAR_BACKOFF = float(os.getenv("CART_CLEAR_BACKOFF_SECONDS", "0.05"))
+
+ORDERS_PLACED = Counter("orders_placed_total", "Order placement attempts", ["result"])
+ORDER_PLACE_DURATION = Histogram("order_place_duration_seconds", "Order placement latency")
+CART_CLEAR_FAILURES = Counter("order_cart_clear_failures_total", "Orders whose cart could not be cleared")
+
+app = FastAPI(
+    title="Order Service API",
+    description="API для оформления заказов",
+    version="1.0.0"
+)
+app.add_middleware(PrometheusMiddleware)
+install_loop_diagnostics(app)
+
+
+@app.on_event("startup")
+async def startup_event():
+    await asyncio.to_thread(init_db)
+    await downstream.start()
+    relay.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await relay.stop()
+    await downstream.close()
+
+
+@app.get("/", include_in_schema=False)
+async def root():
+    return RedirectResponse(url="/docs")
+
+
+@app.post("/orders",
+          response_model=Order,
+          status_code=status.HTTP_201_CREATED,
+          tags=["Orders"])
+async def place_order(request: Request,
+                      response: Response,
+                      idempotency_key: str = Header(..., min_length=8, max_length=64),
+                      user_id: int = Depends(get_current_user_id)):
+    """Оформление заказа из текущей корзины.
+
+    Повтор запроса с тем же Idempotency-Key возвращает уже созданный заказ (200).
+    """
+    started = time.perf_counter()
+    with deadline(ORDER_DEADLINE):
+        order, created = await _place_order(request, response, idempotency_key, user_id)
+    if created:
+        # The order is committed, so the clear must not be starved by a slow placement
+        with deadline(CART_CLEAR_DEADLINE):
+            await _clear_cart(request.headers["authorization"], user_id, order["id"])
+        ORDERS_PLACED.labels("created").inc()
+        ORDER_PLACE_DURATION.observe(time.perf_counter() - started)
+    return order
+
+
+async def _existing_order(response: Response, idempotency_key: str, user_id: int):
+    order = await asyncio.to_thread(crud.get_order_by_key, user_id, idempotency_key)
+    if order:
+        ORDERS_PLACED.labels("replayed").inc()
+        response.status_code = status.HTTP_200_OK
+    return order
+
+
+async def _clear_cart(authorization: str, user_id: int, order_id: int) -> None:
+    for attempt in range(1, CART_CLEAR_ATTEMPTS + 1):
+        try:
+            await downstream.clear_cart(authorization)
+            return
+        except (httpx.HTTPError, asyncio.TimeoutError) as e:
+            error = e
+        if attempt < CART_CLEAR_ATTEMPTS:
+            await asyncio.sleep(CART_CLEAR_BACKOFF * 2 ** (attempt - 1))
+    # The order stands; the cart keeps its lines and a new order from it needs a new key
+    CART_CLEAR_FAILURES.inc()
+    logger.warning("Could not clear cart of user %s after order %s: %r", user_id, order_id, error)
+
+
+async def _place_order(request: Request, response: Response, idempotency_key: str, user_id: int):
+    # A retry after success must not read the (already cleared) cart again
+    existing = await _existing_order(response, idempotency_key, user_id)
+    if existing:
+        return existing, False
+
+    authorization = request.headers["authorization"]
+    try:
+        cart = await downstream.get_cart(authorization)
+    except (httpx.HTTPError, asyncio.TimeoutError):
+        # A duplicate may have placed the order while the cart did not answer
+        existing = await _existing_order(response, idempotency_key, user_id)
+        if existing:
+            return existing, False
+        ORDERS_PLACED.labels("cart_unavailable").inc()
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Сервис корзины недоступен"
+        )
+    unavailable = [line["product_id"] for line in cart["items"] if not line.get("available", True)]
+    if not cart["items"] or unavailable:
+        # A duplicate request may have placed the order and cleared the cart since the check above
+        existing = await _existing_order(response, idempotency_key, user_id)
+        if existing:
+            return existing, False
+    if not cart["items"]:
+        ORDERS_PLACED.labels("empty_cart").inc()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Корзина пуста"
+        )
+    if unavailable:
+        ORDERS_PLACED.labels("unavailable").inc()
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Товары недоступны: {', '.join(unavailable)}"
+        )
+
+    lines = [(line["product_id"], line["quantity"], line["price"]) for line in cart["items"]]
+    try:
+        order, created = await asyncio.to_thread(crud.place_order, user_id, idempotency_key, lines)
+    except crud.InsufficientStock as e:
+        ORDERS_PLACED.labels("out_of_stock").inc()
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Недостаточно товара на складе: {', '.join(e.product_ids)}"
+        )
+    if not created:
+        ORDERS_PLACED.labels("replayed").inc()
+        response.status_code = status.HTTP_200_OK
+    return order, created
+
+
+@app.get("/orders",
+         response_model=List[Order],
+         tags=["Orders"])
+async def list_orders(limit: int = Query(50, ge=1, le=500),
+                      user_id: int = Depends(get_current_user_id)):
+    return await asyncio.to_thread(crud.get_orders, user_id, limit)
+
+
+@app.get("/orders/{order_id}",
+         response_model=Order,
+         tags=["Orders"])
+async def get_order(order_id: int, user_id: int = Depends(get_current_user_id)):
+    order = await asyncio.to_thread(crud.get_order, user_id, order_id)
+    if order is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Заказ не найден"
+        )
+    return order
+
+
+@app.put("/admin/inventory/{product_id}",
+         response_model=StockLevel,
+         tags=["Admin"])
+async def set_stock(product_id: str, body: StockLevel):
+    await asyncio.to_thread(crud.set_stock, product_id, body.available)
+    return body
+
+
+@app.get("/admin/inventory/{product_id}",
+         response_model=StockLevel,
+         tags=["Admin"])
+async def get_stock(product_id: str):
+    available = await asyncio.to_thread(crud.get_stock, product_id)
+    if available is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Товар не найден на складе"
+        )
+    return StockLevel(available=available)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get("/health", tags=["Health"])
+async def health_check():
+    return {"status": "OK", "service": "order_service"}
@@ -0,0 +1,259 @@
+import asyncio
+import logging
+import os
+from typing import List, Optional, Tuple
+
+from prometheus_client import Counter, Gauge
+from sqlalchemy import text
+
+from clients import Downstream, downstream as default_downstream
+from database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+RELAY_INTERVAL = float(os.getenv("OUTBOX_RELAY_INTERVAL_SECONDS", "0.5"))
+RELAY_BATCH_SIZE = int(os.getenv("OUTBOX_RELAY_BATCH_SIZE", "200"))
+# Claimed rows are invisible to other relays for this long
+RELAY_LEASE_SECONDS = int(os.getenv("OUTBOX_RELAY_LEASE_SECONDS", "30"))
+RELAY_MAX_ATTEMPTS = int(os.getenv("OUTBOX_RELAY_MAX_ATTEMPTS", "8"))
+RELAY_BACKOFF_SECONDS = float(os.getenv("OUTBOX_RELAY_BACKOFF_SECONDS", "1.0"))
+
+OUTBOX_SENT = Counter("order_outbox_sent_total", "Outbox messages delivered", ["topic"])
+OUTBOX_FAILURES = Counter("order_outbox_failures_total", "Failed outbox deliveries", ["topic"])
+OUTBOX_DEAD = Counter("order_outbox_dead_total", "Outbox messages given up on", ["topic"])
+OUTBOX_PENDING = Gauge("order_outbox_pending", "Outbox messages waiting for delivery")
+
+# SKIP LOCKED lets any number of relays claim disjoint batches; the lease
+# (next_attempt_at in the future) hands rows back if a relay dies mid-send
+CLAIM_SQL = text("""
+UPDATE outbox o
+SET attempts = o.attempts + 1,
+    next_attempt_at = now() + make_interval(secs => :lease)
+FROM (
+    SELECT id FROM outbox
+    WHERE status = 'pending' AND next_attempt_at <= now()
+    ORDER BY next_attempt_at, id
+    LIMIT :limit
+    FOR UPDATE SKIP LOCKED
+) due
+WHERE o.id = due.id
+RETURNING o.id, o.order_id, o.topic, o.payload, o.attempts
+""")
+
+MARK_SENT_SQL = text("""
+UPDATE outbox SET status = 'sent', sent_at = now(), last_error = NULL
+WHERE id = ANY(CAST(:ids AS bigint[]))
+""")
+
+RETRY_SQL = text("""
+UPDATE outbox o
+SET next_attempt_at = now() + make_interval(secs => v.delay), last_error = v.error
+FROM unnest(CAST(:ids AS bigint[]), CAST(:delays AS float8[]), CAST(:errors AS text[]))
+     AS v(id, delay, error)
+WHERE o.id = v.id
+""")
+
+MARK_DEAD_SQL = text("""
+UPDATE outbox o SET status = 'failed', last_error = v.error
+FROM unnest(CAST(:ids AS bigint[]), CAST(:errors AS text[])) AS v(id, error)
+WHERE o.id = v.id
+""")
+
+PAYMENT_DONE_SQL = text("""
+UPDATE orders SET payment_status = :status, updated_at = now()
+WHERE id = ANY(CAST(:order_ids AS bigint[]))
+""")
+
+DELIVERY_DONE_SQL = text("""
+UPDATE orders SET delivery_status = :status, updated_at = now()
+WHERE id = ANY(CAST(:order_ids AS bigint[]))
+""")
+
+CONFIRM_SQL = text("""
+UPDATE orders SET status = 'confirmed', updated_at = now()
+WHERE id = ANY(CAST(:order_ids AS bigint[]))
+  AND status = 'pending' AND payment_status = 'paid' AND delivery_status = 'scheduled'
+""")
+
+# An order that can no longer be paid or delivered gives its stock back, once
+FAIL_ORDERS_SQL = text("""
+UPDATE orders SET status = 'failed', updated_at = now()
+WHERE id = ANY(CAST(:order_ids AS bigint[])) AND status <> 'failed'
+RETURNING id
+""")
+
+RELEASE_STOCK_SQL = text("""
+UPDATE inventory i
+SET available = i.available + r.quantity, updated_at = now()
+FROM (
+    SELECT product_id, SUM(quantity) AS quantity FROM order_items
+    WHERE order_id = ANY(CAST(:order_ids AS bigint[]))
+    GROUP BY product_id
+) r
+WHERE i.product_id = r.product_id
+""")
+
+# Payment and delivery of an order are sent concurrently, so when one is given
+# up on the other may be pending, in flight or done. Pending ones are cancelled
+# and done ones undone by a compensating message; one that was in flight is
+# marked sent by its own batch afterwards and compensated there.
+CANCEL_SIBLINGS_SQL = text("""
+UPDATE outbox SET status = 'cancelled', last_error = 'order failed'
+WHERE order_id = ANY(CAST(:order_ids AS bigint[]))
+  AND topic IN ('payment', 'delivery') AND status = 'pending'
+""")
+
+COMPENSATE_SQL = text("""
+INSERT INTO outbox (order_id, topic, payload)
+SELECT o.order_id, c.topic, o.payload
+FROM outbox o
+JOIN orders ON orders.id = o.order_id AND orders.status = 'failed'
+CROSS JOIN LATERAL (
+    SELECT CASE o.topic WHEN 'payment' THEN 'refund' ELSE 'delivery_cancel' END AS topic
+) c
+WHERE o.order_id = ANY(CAST(:order_ids AS bigint[]))
+  AND o.topic IN ('payment', 'delivery') AND o.status = 'sent'
+  AND NOT EXISTS (SELECT 1 FROM outbox d WHERE d.order_id = o.order_id AND d.topic = c.topic)
+""")
+
+PENDING_SQL = text("SELECT count(*) FROM outbox WHERE status = 'pending'")
+
+# topic -> (order column update, status once sent, status once given up on)
+TOPIC_STATUS = {
+    "payment": (PAYMENT_DONE_SQL, "paid", "failed"),
+    "delivery": (DELIVERY_DONE_SQL, "scheduled", "failed"),
+    "refund": (PAYMENT_DONE_SQL, "refunded", "refund_failed"),
+    "delivery_cancel": (DELIVERY_DONE_SQL, "cancelled", "cancel_failed"),
+}
+# Giving up on one of these fails the order
+ORDER_TOPICS = ("payment", "delivery")
+
+
+def _claim(limit: int, lease: int) -> List[tuple]:
+    with SessionLocal() as db:
+        with db.begin():
+            return db.execute(CLAIM_SQL, {"limit": limit, "lease": lease}).all()
+
+
+def _record(sent: List[tuple], retry: List[Tuple[int, float, str]],
+            dead: List[Tuple[int, str, str, int]]) -> None:
+    with SessionLocal() as db:
+        with db.begin():
+            if sent:
+                sent_orders = [order_id for _, order_id, _ in sent]
+                db.execute(MARK_SENT_SQL, {"ids": [row_id for row_id, _, _ in sent]})
+                for topic, (sql, status, _) in TOPIC_STATUS.items():
+                    order_ids = [order_id for _, order_id, t in sent if t == topic]
+                    if order_ids:
+                        db.execute(sql, {"order_ids": order_ids, "status": status})
+                db.execute(CONFIRM_SQL, {"order_ids": sent_orders})
+                # Sent while a sibling was being given up on
+                db.execute(COMPENSATE_SQL, {"order_ids": sent_orders})
+            if retry:
+                db.execute(RETRY_SQL, {"ids": [r[0] for r in retry], "delays": [r[1] for r in retry],
+                                       "errors": [r[2] for r in retry]})
+            if dead:
+                db.execute(MARK_DEAD_SQL, {"ids": [d[0] for d in dead], "errors": [d[1] for d in dead]})
+                # outbox rows before orders rows, in the same order as the sent branch takes its locks
+                doomed = [order_id for _, _, t, order_id in dead if t in ORDER_TOPICS]
+                if doomed:
+                    db.execute(CANCEL_SIBLINGS_SQL, {"order_ids": doomed})
+                for topic, (sql, _, status) in TOPIC_STATUS.items():
+                    order_ids = [order_id for _, _, t, order_id in dead if t == topic]
+                    if order_ids:
+                        db.execute(sql, {"order_ids": order_ids, "status": status})
+                if doomed:
+                    failed = [row[0] for row in db.execute(FAIL_ORDERS_SQL, {"order_ids": doomed})]
+                    if failed:
+                        db.execute(RELEASE_STOCK_SQL, {"order_ids": failed})
+                        db.execute(COMPENSATE_SQL, {"order_ids": failed})
+
+
+def _pending() -> int:
+    with SessionLocal() as db:
+        return db.execute(PENDING_SQL).scalar()
+
+
+class OutboxRelay:
+    """Delivers outbox rows to the payment and delivery systems.
+
+    Rows are claimed in batches and every row of a batch is sent concurrently,
+    so the payment and delivery calls of one order overlap and each call is
+    bounded by the client deadline. Outcomes are written back in one
+    transaction per batch. Delivery is at-least-once: the Idempotency-Key
+    header lets the receiver drop repeats. Giving up on the payment or the
+    delivery fails the order, releases its stock and cancels or compensates
+    the other one (refund, delivery_cancel).
+    """
+
+    def __init__(self, client: Optional[Downstream] = None, interval: float = RELAY_INTERVAL,
+                 batch_size: int = RELAY_BATCH_SIZE, lease: int = RELAY_LEASE_SECONDS,
+                 max_attempts: int = RELAY_MAX_ATTEMPTS, backoff: float = RELAY_BACKOFF_SECONDS):
+        self.client = client or default_downstream
+        self.interval = interval
+        self.batch_size = batch_size
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self._task: Optional[asyncio.Task] = None
+
+    async def _send(self, row) -> Optional[str]:
+        row_id, order_id, topic, payload, _ = row
+        try:
+            await self.client.send(topic, payload, f"order-{order_id}-{topic}")
+            return None
+        except asyncio.TimeoutError:
+            return "deadline exceeded"
+        except Exception as e:
+            return f"{type(e).__name__}: {e}"[:500]
+
+    async def relay_once(self) -> int:
+        rows = await asyncio.to_thread(_claim, self.batch_size, self.lease)
+        if not rows:
+            return 0
+        errors = await asyncio.gather(*(self._send(row) for row in rows))
+        sent, retry, dead = [], [], []
+        for row, error in zip(rows, errors):
+            row_id, order_id, topic, _, attempts = row
+            if error is None:
+                sent.append((row_id, order_id, topic))
+                OUTBOX_SENT.labels(topic).inc()
+            elif attempts >= self.max_attempts:
+                dead.append((row_id, error, topic, order_id))
+                OUTBOX_DEAD.labels(topic).inc()
+                logger.error("Giving up on outbox %s (%s, order %s): %s", row_id, topic, order_id, error)
+            else:
+                retry.append((row_id, min(self.backoff * 2 ** (attempts - 1), 300.0), error))
+                OUTBOX_FAILURES.labels(topic).inc()
+        await asyncio.to_thread(_record, sent, retry, dead)
+        return len(rows)
+
+    async def run(self):
+        while True:
+            relayed = 0
+            try:
+                relayed = await self.relay_once()
+                OUTBOX_PENDING.set(await asyncio.to_thread(_pending))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Outbox relay failed")
+            # A full batch means there is a backlog: keep going without sleeping
+            if relayed < self.batch_size:
+                await asyncio.sleep(self.interval)
+
+    def start(self) -> asyncio.Task:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+        return self._task
+
+    async def stop(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+
+relay = OutboxRelay()
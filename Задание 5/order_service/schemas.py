@@ -0,0 +1,24 @@
+from datetime import datetime
+from pydantic import BaseModel, Field
+from typing import List, Optional
+
+
+class OrderItem(BaseModel):
+    product_id: str
+    quantity: int
+    price: float
+
+
+class Order(BaseModel):
+    id: int
+    user_id: int
+    status: str
+    payment_status: str
+    delivery_status: str
+    total: float
+    items: List[OrderItem]
+    created_at: Optional[datetime] = None
+
+
+class StockLevel(BaseModel):
+    available: int = Field(..., ge=0)
@@ -1,35 +1,98 @@
+from datetime import datetime
+import hashlib
+import os
+from common.cache import TwoTierCache
+from common.swr import swr_cached
 from database import db
+from migrations import as_canonical
+from events import publish, product_payload, cache_redis, cache_bus
 from schemas import ProductIn
 from bson import ObjectId
+from pymongo.errors import OperationFailure
 
 collection = db["products"]
 
+# Covered by the _id_1_version_1 index, so conditional reads never touch documents
+VERSION_PROJECTION = {"_id": 1, "version": 1}
+VERSION_INDEX = "_id_1_version_1"
+
+# Writes invalidate the entry, so the soft TTL only bounds staleness after a missed invalidation
+PRODUCT_CACHE_SOFT_TTL = float(os.getenv("PRODUCT_CACHE_SOFT_TTL_SECONDS", "30"))
+PRODUCT_CACHE_HARD_TTL = float(os.getenv("PRODUCT_CACHE_HARD_TTL_SECONDS", "300"))
+CATALOG_CACHE_TTL = float(os.getenv("CATALOG_CACHE_TTL_SECONDS", "300"))
+
+# The whole list with its digest under one key; every write invalidates it
+catalog_cache = TwoTierCache("product_catalog", cache_redis, ttl=CATALOG_CACHE_TTL, bus=cache_bus)
+
 def serialize(product) -> dict:
+    # Legacy documents are served in the canonical shape while the migrator runs
+    product = as_canonical(product)
     product["_id"] = str(product["_id"])
     return product
 
 async def create_product(data: ProductIn):
-    result = await collection.insert_one(data.dict())
-    return serialize(await collection.find_one({"_id": result.inserted_id}))
+    document = {**data.dict(), "version": 1, "updated_at": datetime.utcnow()}
+    result = await collection.insert_one(document)
+    product = serialize(await collection.find_one({"_id": result.inserted_id}))
+    await catalog_cache.invalidate("all")
+    publish("product_created", product_payload(product))
+    return product
 
-async def get_product(product_id: str):
+async def _load_product(product_id: str):
     if not ObjectId.is_valid(product_id):
         return None
     product = await collection.find_one({"_id": ObjectId(product_id)})
     return serialize(product) if product else None
 
-async def get_all_products():
-    cursor = collection.find()
-    return [serialize(doc) async for doc in cursor]
+get_product = swr_cached("product", soft_ttl=PRODUCT_CACHE_SOFT_TTL, hard_ttl=PRODUCT_CACHE_HARD_TTL,
+                         redis=cache_redis)(_load_product)
+
+async def get_product_version(product_id: str):
+    if not ObjectId.is_valid(product_id):
+        return None
+    query = {"_id": ObjectId(product_id)}
+    try:
+        doc = await collection.find(query, VERSION_PROJECTION).hint(VERSION_INDEX).limit(1).to_list(1)
+    except OperationFailure:
+        # The index is not built yet or was dropped: same answer, just not covered
+        doc = await collection.find(query, VERSION_PROJECTION).limit(1).to_list(1)
+    return doc[0].get("version", 0) if doc else None
+
+async def _load_catalog() -> dict:
+    products = [serialize(doc) async for doc in collection.find()]
+    digest = hashlib.sha1()
+    for product in products:
+        digest.update(b"%s:%d;" % (product["_id"].encode(), product.get("version", 0)))
+    return {"digest": digest.hexdigest(), "products": products}
+
+async def get_catalog() -> dict:
+    """All products and a digest of their versions, served from the two-tier cache"""
+    return await catalog_cache.get_or_load("all", _load_catalog)
+
+async def _invalidate(product_id: str):
+    await get_product.invalidate(product_id)
+    await catalog_cache.invalidate("all")
+    # Drops the product from cart_service's cache
+    await cache_bus.invalidate("product", product_id)
 
 async def update_product(product_id: str, data: ProductIn):
     if not ObjectId.is_valid(product_id):
         return None
-    await collection.update_one({"_id": ObjectId(product_id)}, {"$set": data.dict()})
-    return await get_product(product_id)
+    await collection.update_one(
+        {"_id": ObjectId(product_id)},
+        {"$set": {**data.dict(), "updated_at": datetime.utcnow()}, "$inc": {"version": 1}},
+    )
+    await _invalidate(product_id)
+    product = await _load_product(product_id)
+    if product:
+        publish("product_updated", product_payload(product))
+    return product
 
 async def delete_product(product_id: str):
     if not ObjectId.is_valid(product_id):
         return False
     result = await collection.delete_one({"_id": ObjectId(product_id)})
+    await _invalidate(product_id)
+    if result.deleted_count == 1:
+        publish("product_deleted", {"product_id": product_id})
     return result.deleted_count == 1
@@ -1,14 +1,90 @@
-from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, IndexModel
+import logging
 import os
+from monitoring import event_listeners
 from test_data import test_products
+from common.backends import mongo_client
+
+logger = logging.getLogger(__name__)
 
 MONGO_URL = os.getenv("MONGO_URL", "mongodb://mongo:27017")
-client = AsyncIOMotorClient(MONGO_URL)
+# Off by default: the profiler is a server-wide setting with its own write cost,
+# so it is switched on only where /admin/slow-queries is wanted
+MONGO_PROFILE_LEVEL = int(os.getenv("MONGO_PROFILE_LEVEL", "0"))
+MONGO_SLOW_MS = int(os.getenv("MONGO_SLOW_MS", "100"))
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "60000"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "5000"))
+client = mongo_client(
+    MONGO_URL,
+    maxPoolSize=MONGO_MAX_POOL_SIZE,
+    minPoolSize=MONGO_MIN_POOL_SIZE,
+    maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+    waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+    event_listeners=event_listeners,
+)
 db = client["product_db"]
 
+# Desired indexes per collection; applied idempotently on every startup
+INDEX_MANIFEST = {
+    "products": [
+        IndexModel([("name", ASCENDING)], name="name_1"),
+        IndexModel([("_id", ASCENDING), ("version", ASCENDING)], name="_id_1_version_1"),
+    ],
+}
+
+index_drift = {}
+
+def _index_key(spec) -> list:
+    items = spec.items() if isinstance(spec, dict) else spec
+    return [(field, int(direction) if isinstance(direction, (int, float)) else direction)
+            for field, direction in items]
+
+async def ensure_indexes() -> dict:
+    drift = {}
+    for collection_name, models in INDEX_MANIFEST.items():
+        collection = db[collection_name]
+        existing = await collection.index_information()
+        missing, changed = [], []
+        for model in models:
+            doc = model.document
+            current = existing.get(doc["name"])
+            if current is None:
+                missing.append(model)
+            elif _index_key(current["key"]) != _index_key(doc["key"]) or \
+                    bool(current.get("unique")) != bool(doc.get("unique")):
+                changed.append(doc["name"])
+        wanted = {model.document["name"] for model in models} | {"_id_"}
+        unmanaged = sorted(set(existing) - wanted)
+        if missing:
+            await collection.create_indexes(missing)
+            logger.info("Created indexes on %s: %s", collection_name,
+                        [model.document["name"] for model in missing])
+        if changed or unmanaged:
+            logger.warning("Index drift on %s: changed=%s unmanaged=%s",
+                           collection_name, changed, unmanaged)
+        drift[collection_name] = {
+            "created": [model.document["name"] for model in missing],
+            "changed": changed,
+            "unmanaged": unmanaged,
+        }
+    index_drift.clear()
+    index_drift.update(drift)
+    return drift
+
+async def enable_profiler():
+    if not MONGO_PROFILE_LEVEL:
+        return
+    try:
+        await db.command("profile", MONGO_PROFILE_LEVEL, slowms=MONGO_SLOW_MS)
+    except Exception as e:
+        logger.warning(f"Could not configure Mongo profiler: {e}")
+
 async def init_db():
     collection = db["products"]
-    count = await collection.count_documents({})
+    count = await collection.estimated_document_count()
     if count == 0:
         await collection.insert_many(test_products)
-        await collection.create_index("name")
+    await ensure_indexes()
+    await enable_profiler()
@@ -0,0 +1,25 @@
+import os
+from common.backends import redis_client as make_redis_client
+from common.cache import CacheBus
+from common.streams import StreamProducer
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+PRODUCT_EVENTS_STREAM = os.getenv("PRODUCT_EVENTS_STREAM", "events:product")
+
+redis_client = make_redis_client(REDIS_URL, asyncio=True, decode_responses=True)
+producer = StreamProducer(redis_client)
+# Cache entries are binary (common.codec), so this client returns bytes
+cache_redis = make_redis_client(REDIS_URL, asyncio=True)
+# Invalidations for this service's caches and the "product" cache of cart_service
+cache_bus = CacheBus(cache_redis)
+
+def publish(event_type: str, data: dict):
+    producer.publish(PRODUCT_EVENTS_STREAM, event_type, data)
+
+def product_payload(product: dict) -> dict:
+    return {
+        "product_id": product["_id"],
+        "name": product.get("name"),
+        "price": product.get("price"),
+        "version": product.get("version", 0),
+    }
@@ -0,0 +1,67 @@
+from collections import defaultdict
+
+from database import db, INDEX_MANIFEST, index_drift
+
+PROFILE_SAMPLE_SIZE = 1000
+
+
+def _shape(value):
+    """Replace literal values with their type so equal query shapes group together."""
+    if isinstance(value, dict):
+        return {key: _shape(item) for key, item in sorted(value.items())}
+    if isinstance(value, list):
+        return [_shape(item) for item in value[:1]]
+    return type(value).__name__
+
+
+async def index_stats() -> dict:
+    stats = {}
+    for collection_name in INDEX_MANIFEST:
+        cursor = db[collection_name].aggregate([{"$indexStats": {}}])
+        stats[collection_name] = [
+            {
+                "name": doc["name"],
+                "key": doc["key"],
+                "ops": doc["accesses"]["ops"],
+                "since": doc["accesses"]["since"],
+            }
+            async for doc in cursor
+        ]
+    return {"indexes": stats, "drift": index_drift}
+
+
+async def slow_query_summary(limit: int = 20) -> list:
+    groups = defaultdict(lambda: {"count": 0, "total_ms": 0, "max_ms": 0,
+                                  "docs_examined": 0, "keys_examined": 0, "returned": 0})
+    cursor = db["system.profile"].find(
+        {"ns": {"$not": {"$regex": r"\.system\."}}},
+        {"ns": 1, "op": 1, "command": 1, "millis": 1, "planSummary": 1,
+         "docsExamined": 1, "keysExamined": 1, "nreturned": 1},
+    ).sort("ts", -1).limit(PROFILE_SAMPLE_SIZE)
+    async for doc in cursor:
+        command = doc.get("command", {})
+        query = command.get("filter", command.get("q", command.get("query", {})))
+        shape = repr(_shape(query))
+        plan = doc.get("planSummary", "")
+        group = groups[(doc.get("ns"), doc.get("op"), shape, plan)]
+        millis = doc.get("millis", 0)
+        group["count"] += 1
+        group["total_ms"] += millis
+        group["max_ms"] = max(group["max_ms"], millis)
+        group["docs_examined"] += doc.get("docsExamined", 0)
+        group["keys_examined"] += doc.get("keysExamined", 0)
+        group["returned"] += doc.get("nreturned", 0)
+    summary = [
+        {
+            "ns": ns,
+            "op": op,
+            "shape": shape,
+            "plan": plan,
+            "unindexed": plan.startswith("COLLSCAN"),
+            **group,
+            "avg_ms": group["total_ms"] / group["count"],
+        }
+        for (ns, op, shape, plan), group in groups.items()
+    ]
+    summary.sort(key=lambda item: item["total_ms"], reverse=True)
+    return summary[:limit]
@@ -1,21 +1,39 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.responses import RedirectResponse
-from motor.motor_asyncio import AsyncIOMotorClient
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from schemas import Product, ProductIn
 from crud import (
     create_product,
     get_product,
-    get_all_products,
+    get_product_version,
+    get_catalog,
     update_product,
     delete_product
 )
-from database import init_db, db
+from database import init_db, db, ensure_indexes
+from indexes import index_stats, slow_query_summary
+from migrations import legacy_migrator
+from events import producer, cache_bus
+from common.etag import make_etag, etag_matches, http_date, not_modified_since
+from common.loopwatch import install_loop_diagnostics
+from common.metrics import PrometheusMiddleware
 
 app = FastAPI(title="Product Service (MongoDB)")
+app.add_middleware(PrometheusMiddleware)
+install_loop_diagnostics(app)
 
 @app.on_event("startup")
 async def startup_db():
     await init_db()
+    producer.start()
+    await cache_bus.start()
+    legacy_migrator.start()
+
+@app.on_event("shutdown")
+async def shutdown_db():
+    await legacy_migrator.stop()
+    await cache_bus.stop()
+    await producer.stop()
 
 @app.get("/")
 async def root():
@@ -27,14 +45,34 @@ async def create(product_in: ProductIn):
     return await create_product(product_in)
 
 @app.get("/products/", response_model=list[Product])
-async def list_products():
-    return await get_all_products()
+async def list_products(request: Request, response: Response):
+    catalog = await get_catalog()
+    etag = make_etag("products", catalog["digest"])
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return catalog["products"]
 
 @app.get("/products/{product_id}", response_model=Product)
-async def read(product_id: str):
+async def read(product_id: str, request: Request, response: Response):
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        version = await get_product_version(product_id)
+        if version is None:
+            raise HTTPException(status_code=404, detail="Product not found")
+        etag = make_etag(product_id, version)
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers={"ETag": etag})
     product = await get_product(product_id)
     if product is None:
         raise HTTPException(status_code=404, detail="Product not found")
+    etag = make_etag(product_id, product.get("version", 0))
+    headers = {"ETag": etag}
+    if product.get("updated_at"):
+        headers["Last-Modified"] = http_date(product["updated_at"])
+        if not if_none_match and not_modified_since(request.headers.get("if-modified-since"), product["updated_at"]):
+            return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
     return product
 
 @app.put("/products/{product_id}", response_model=Product)
@@ -49,4 +87,29 @@ async def delete(product_id: str):
     success = await delete_product(product_id)
     if not success:
         raise HTTPException(status_code=404, detail="Product not found")
-    return {"message": "Deleted"}
\ No newline at end of file
+    return {"message": "Deleted"}
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/admin/migrations/legacy-products")
+async def legacy_migration_progress():
+    return legacy_migrator.progress()
+
+@app.post("/admin/migrations/legacy-products", status_code=202)
+async def legacy_migration_start():
+    legacy_migrator.start()
+    return legacy_migrator.progress()
+
+@app.get("/admin/indexes")
+async def indexes():
+    return await index_stats()
+
+@app.post("/admin/indexes/sync")
+async def sync_indexes():
+    return await ensure_indexes()
+
+@app.get("/admin/slow-queries")
+async def slow_queries(limit: int = 20):
+    return await slow_query_summary(limit)
\ No newline at end of file
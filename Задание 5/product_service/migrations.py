@@ -0,0 +1,178 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Optional
+
+from pymongo import UpdateOne
+
+from database import db
+
+logger = logging.getLogger(__name__)
+
+MIGRATION_BATCH_SIZE = int(os.getenv("MIGRATION_BATCH_SIZE", "500"))
+MIGRATION_OPS_PER_SEC = float(os.getenv("MIGRATION_OPS_PER_SEC", "2000"))
+
+# Legacy (seeded) field name -> canonical ProductIn field
+LEGACY_FIELDS = {
+    "Название": "name",
+    "название": "name",
+    "Описание": "description",
+    "описание": "description",
+    "Цена": "price",
+    "цена": "price",
+}
+
+LEGACY_FILTER = {"$or": [{field: {"$exists": True}} for field in LEGACY_FIELDS]}
+
+
+def normalize(doc: dict) -> Optional[dict]:
+    """Build the update for one legacy document, or None if it is already canonical."""
+    to_set, to_unset = {}, {}
+    for legacy, canonical in LEGACY_FIELDS.items():
+        if legacy not in doc:
+            continue
+        to_unset[legacy] = ""
+        # An already present canonical value wins over the legacy one
+        if canonical not in doc and canonical not in to_set:
+            to_set[canonical] = doc[legacy]
+    if not to_unset:
+        return None
+    if "price" in to_set:
+        to_set["price"] = float(to_set["price"])
+    if "description" not in doc:
+        to_set.setdefault("description", "")
+    to_set["updated_at"] = datetime.utcnow()
+    return {"$set": to_set, "$unset": to_unset, "$inc": {"version": 1}}
+
+
+def as_canonical(doc: dict) -> dict:
+    """Read-side view of a document the migrator has not reached yet.
+
+    Version and updated_at stay as stored, so validators change only when
+    the migration actually rewrites the document.
+    """
+    update = normalize(doc)
+    if update is None:
+        return doc
+    view = {field: value for field, value in doc.items() if field not in update["$unset"]}
+    view.update((field, value) for field, value in update["$set"].items() if field != "updated_at")
+    return view
+
+
+class LegacyProductMigrator:
+    """Rewrites legacy product documents in _id order, resuming from a checkpoint."""
+
+    def __init__(self, collection, checkpoints, name: str = "legacy_products",
+                 batch_size: int = MIGRATION_BATCH_SIZE,
+                 ops_per_sec: float = MIGRATION_OPS_PER_SEC):
+        self.collection = collection
+        self.checkpoints = checkpoints
+        self.name = name
+        self.batch_size = batch_size
+        self.ops_per_sec = ops_per_sec
+        self.state = {
+            "status": "idle",
+            "last_id": None,
+            "scanned": 0,
+            "updated": 0,
+            "batches": 0,
+            "started_at": None,
+            "finished_at": None,
+            "error": None,
+        }
+        self._task: Optional[asyncio.Task] = None
+
+    async def _load_checkpoint(self):
+        checkpoint = await self.checkpoints.find_one({"_id": self.name})
+        if checkpoint:
+            for key in ("last_id", "scanned", "updated", "batches"):
+                self.state[key] = checkpoint.get(key, self.state[key])
+        return checkpoint
+
+    async def _save_checkpoint(self, done: bool = False):
+        await self.checkpoints.update_one(
+            {"_id": self.name},
+            {"$set": {
+                "last_id": self.state["last_id"],
+                "scanned": self.state["scanned"],
+                "updated": self.state["updated"],
+                "batches": self.state["batches"],
+                "done": done,
+                "updated_at": datetime.utcnow(),
+            }},
+            upsert=True,
+        )
+
+    async def _next_batch(self) -> list:
+        query = dict(LEGACY_FILTER)
+        if self.state["last_id"] is not None:
+            query["_id"] = {"$gt": self.state["last_id"]}
+        cursor = self.collection.find(query).sort("_id", 1).limit(self.batch_size)
+        return await cursor.to_list(length=self.batch_size)
+
+    async def run(self):
+        checkpoint = await self._load_checkpoint()
+        if checkpoint and checkpoint.get("done"):
+            # New legacy documents may have appeared since the last run
+            self.state["last_id"] = None
+        self.state.update(status="running", started_at=datetime.utcnow(),
+                          finished_at=None, error=None)
+        try:
+            while True:
+                started = time.monotonic()
+                docs = await self._next_batch()
+                if not docs:
+                    break
+                requests = []
+                for doc in docs:
+                    update = normalize(doc)
+                    if update:
+                        requests.append(UpdateOne({"_id": doc["_id"]}, update))
+                if requests:
+                    result = await self.collection.bulk_write(requests, ordered=False)
+                    self.state["updated"] += result.modified_count
+                self.state["scanned"] += len(docs)
+                self.state["batches"] += 1
+                self.state["last_id"] = docs[-1]["_id"]
+                await self._save_checkpoint()
+                await self._throttle(len(docs), time.monotonic() - started)
+            await self._save_checkpoint(done=True)
+            self.state.update(status="done", finished_at=datetime.utcnow())
+        except asyncio.CancelledError:
+            self.state["status"] = "stopped"
+            raise
+        except Exception as e:
+            logger.exception("Legacy product migration failed")
+            self.state.update(status="failed", error=str(e))
+
+    async def _throttle(self, ops: int, elapsed: float):
+        if self.ops_per_sec <= 0:
+            return
+        budget = ops / self.ops_per_sec
+        if budget > elapsed:
+            await asyncio.sleep(budget - elapsed)
+
+    def start(self) -> asyncio.Task:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+        return self._task
+
+    async def stop(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def progress(self) -> dict:
+        state = dict(self.state)
+        state["last_id"] = str(state["last_id"]) if state["last_id"] is not None else None
+        state["batch_size"] = self.batch_size
+        state["ops_per_sec"] = self.ops_per_sec
+        return state
+
+
+legacy_migrator = LegacyProductMigrator(db["products"], db["migrations"])
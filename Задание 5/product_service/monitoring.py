@@ -0,0 +1,118 @@
+import threading
+import time
+
+from prometheus_client import Counter, Gauge, Histogram
+from pymongo import monitoring
+
+LATENCY_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5)
+
+MONGO_COMMAND_LATENCY = Histogram(
+    "mongo_command_duration_seconds",
+    "Latency of MongoDB commands",
+    ["command", "collection"],
+    buckets=LATENCY_BUCKETS,
+)
+MONGO_COMMAND_ERRORS = Counter(
+    "mongo_command_errors_total",
+    "Failed MongoDB commands",
+    ["command", "collection"],
+)
+MONGO_POOL_CHECKOUT_WAIT = Histogram(
+    "mongo_pool_checkout_wait_seconds",
+    "Time spent waiting for a connection from the pool",
+    buckets=LATENCY_BUCKETS,
+)
+MONGO_POOL_CHECKOUT_FAILURES = Counter(
+    "mongo_pool_checkout_failures_total",
+    "Failed connection checkouts",
+    ["reason"],
+)
+MONGO_POOL_CONNECTIONS = Gauge(
+    "mongo_pool_connections",
+    "Open connections in the pool",
+)
+MONGO_POOL_CHECKED_OUT = Gauge(
+    "mongo_pool_checked_out_connections",
+    "Connections currently checked out of the pool",
+)
+
+# Commands that carry no collection name as their first argument
+_NO_COLLECTION = {"isMaster", "ismaster", "hello", "ping", "buildInfo", "endSessions",
+                  "saslStart", "saslContinue", "profile"}
+
+
+class CommandLatencyListener(monitoring.CommandListener):
+    def __init__(self):
+        self._collections = {}
+
+    def started(self, event):
+        if event.command_name == "getMore":
+            collection = event.command.get("collection", "")
+        elif event.command_name in _NO_COLLECTION:
+            collection = ""
+        else:
+            collection = event.command.get(event.command_name, "")
+        if not isinstance(collection, str):
+            collection = ""
+        self._collections[(event.connection_id, event.request_id)] = collection
+
+    def _collection(self, event) -> str:
+        return self._collections.pop((event.connection_id, event.request_id), "")
+
+    def succeeded(self, event):
+        MONGO_COMMAND_LATENCY.labels(event.command_name, self._collection(event)).observe(
+            event.duration_micros / 1e6)
+
+    def failed(self, event):
+        collection = self._collection(event)
+        MONGO_COMMAND_LATENCY.labels(event.command_name, collection).observe(
+            event.duration_micros / 1e6)
+        MONGO_COMMAND_ERRORS.labels(event.command_name, collection).inc()
+
+
+class PoolListener(monitoring.ConnectionPoolListener):
+    """Tracks checkout waits; pymongo checks out on the calling (executor) thread."""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        MONGO_POOL_CONNECTIONS.inc()
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        MONGO_POOL_CONNECTIONS.dec()
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def connection_check_out_failed(self, event):
+        self._local.started = None
+        MONGO_POOL_CHECKOUT_FAILURES.labels(str(event.reason)).inc()
+
+    def connection_checked_out(self, event):
+        started = getattr(self._local, "started", None)
+        if started is not None:
+            MONGO_POOL_CHECKOUT_WAIT.observe(time.perf_counter() - started)
+            self._local.started = None
+        MONGO_POOL_CHECKED_OUT.inc()
+
+    def connection_checked_in(self, event):
+        MONGO_POOL_CHECKED_OUT.dec()
+
+
+event_listeners = [CommandLatencyListener(), PoolListener()]
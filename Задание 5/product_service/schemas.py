@@ -1,5 +1,6 @@
 from pydantic import BaseModel, Field
 from typing import Optional
+from datetime import datetime
 from bson import ObjectId
 
 class ProductIn(BaseModel):
@@ -9,3 +10,5 @@ class ProductIn(BaseModel):
 
 class Product(ProductIn):
     id: str = Field(..., alias="_id")
+    version: int = 0
+    updated_at: Optional[datetime] = None
@@ -0,0 +1,178 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+from typing import List
+from fastapi import FastAPI, HTTPException, Query, status
+from fastapi.responses import RedirectResponse, Response
+from prometheus_client import CONTENT_TYPE_LATEST, Gauge, Histogram, generate_latest
+from common.loopwatch import install_loop_diagnostics
+from common.metrics import PrometheusMiddleware
+from common.streams import StreamConsumer, StreamEvent
+from database import iter_cart_items, redis_client
+from model import CoOccurrenceModel
+from schemas import Recommendation, Recommendations
+
+logger = logging.getLogger(__name__)
+
+CART_EVENTS_STREAM = os.getenv("CART_EVENTS_STREAM", "events:cart")
+PRODUCT_EVENTS_STREAM = os.getenv("PRODUCT_EVENTS_STREAM", "events:product")
+# Every replica keeps the whole model in memory and needs every event, so
+# replicas must not share a group: give each one its own name when scaling out
+CONSUMER_GROUP = os.getenv("RECOMMENDATION_GROUP", "recommendations")
+CONSUMER_NAME = os.getenv("HOSTNAME", socket.gethostname())
+REFRESH_INTERVAL = float(os.getenv("RECOMMENDATION_REFRESH_SECONDS", "5"))
+BUILD_RETRY_SECONDS = float(os.getenv("RECOMMENDATION_BUILD_RETRY_SECONDS", "10"))
+
+MODEL_BUILD_DURATION = Histogram("recommendation_build_duration_seconds", "Full model build time")
+MODEL_REFRESH_DURATION = Histogram("recommendation_refresh_duration_seconds", "Incremental refresh time")
+MODEL_PRODUCTS = Gauge("recommendation_model_products", "Products known to the model")
+MODEL_PAIRS = Gauge("recommendation_model_pairs", "Non-zero entries of the co-occurrence matrix")
+
+app = FastAPI(
+    title="Recommendation Service API",
+    description="Рекомендации товаров по совместному появлению в корзинах",
+    version="1.0.0"
+)
+app.add_middleware(PrometheusMiddleware)
+install_loop_diagnostics(app)
+
+model = CoOccurrenceModel()
+ready = False
+
+
+async def handle_cart_events(events: List[StreamEvent]):
+    for event in events:
+        data = event.data
+        if event.type == "cart_item_changed":
+            if data["old_quantity"] == 0 and data["quantity"] > 0:
+                model.add(int(data["user_id"]), data["product_id"])
+            elif data["quantity"] == 0:
+                model.remove(int(data["user_id"]), data["product_id"])
+        elif event.type in ("cart_cleared", "cart_expired", "cart_evicted"):
+            model.drop_basket(int(data["user_id"]))
+
+
+async def handle_product_events(events: List[StreamEvent]):
+    for event in events:
+        if event.type == "product_deleted":
+            model.mark_deleted(event.data["product_id"])
+
+
+consumers = [
+    # "$": a new group is created just before the cart_items snapshot is read,
+    # so it holds every change the snapshot may have missed
+    StreamConsumer(redis_client, CART_EVENTS_STREAM, CONSUMER_GROUP, CONSUMER_NAME,
+                   handle_cart_events, start_id="$"),
+    StreamConsumer(redis_client, PRODUCT_EVENTS_STREAM, CONSUMER_GROUP, CONSUMER_NAME,
+                   handle_product_events, start_id="$"),
+]
+_tasks: List[asyncio.Task] = []
+
+
+def _update_gauges():
+    MODEL_PRODUCTS.set(len(model.product_ids))
+    MODEL_PAIRS.set(model.matrix.nnz)
+
+
+async def build_model():
+    global ready
+    started = time.perf_counter()
+    await asyncio.to_thread(model.build, iter_cart_items())
+    MODEL_BUILD_DURATION.observe(time.perf_counter() - started)
+    _update_gauges()
+    ready = True
+    logger.info("Recommendation model built: %s", model.stats())
+
+
+async def refresh_loop():
+    while True:
+        await asyncio.sleep(REFRESH_INTERVAL)
+        if not model.pending():
+            continue
+        try:
+            started = time.perf_counter()
+            await asyncio.to_thread(model.refresh, *model.take_delta())
+            MODEL_REFRESH_DURATION.observe(time.perf_counter() - started)
+            _update_gauges()
+        except Exception:
+            logger.exception("Recommendation refresh failed")
+
+
+async def run():
+    # Events are applied only once the snapshot is in place; lines that are in
+    # both the snapshot and the backlog are ignored by model.add()
+    for consumer in consumers:
+        await consumer.ensure_group()
+    while True:
+        try:
+            await build_model()
+            break
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Recommendation model build failed, retrying in %.0fs", BUILD_RETRY_SECONDS)
+            await asyncio.sleep(BUILD_RETRY_SECONDS)
+    for consumer in consumers:
+        consumer.start()
+    await refresh_loop()
+
+
+@app.on_event("startup")
+async def startup_event():
+    _tasks.append(asyncio.create_task(run()))
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    for task in _tasks:
+        task.cancel()
+    for consumer in consumers:
+        await consumer.stop()
+    await redis_client.close()
+
+
+@app.get("/", include_in_schema=False)
+async def root():
+    return RedirectResponse(url="/docs")
+
+
+@app.get("/recommendations/{product_id}",
+         response_model=Recommendations,
+         tags=["Recommendations"])
+async def get_recommendations(product_id: str, limit: int = Query(10, ge=1, le=100)):
+    if not ready:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Модель рекомендаций ещё строится"
+        )
+    items = model.recommend(product_id, limit)
+    if items is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Товар не найден"
+        )
+    return Recommendations(product_id=product_id,
+                           items=[Recommendation(product_id=p, score=s) for p, s in items])
+
+
+@app.get("/admin/model", tags=["Admin"])
+async def model_stats():
+    return {"ready": ready, **model.stats()}
+
+
+@app.post("/admin/model/rebuild", status_code=status.HTTP_202_ACCEPTED, tags=["Admin"])
+async def rebuild_model():
+    _tasks.append(asyncio.create_task(build_model()))
+    return {"status": "rebuilding"}
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get("/health")
+async def health_check():
+    return {"status": "OK" if ready else "starting", "service": "recommendation_service"}
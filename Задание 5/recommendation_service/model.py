@@ -0,0 +1,211 @@
+import os
+import threading
+from array import array
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+from scipy import sparse
+
+TOP_K = int(os.getenv("RECOMMENDATION_TOP_K", "20"))
+# Pairs seen together fewer times than this are treated as noise
+MIN_CO_OCCURRENCE = int(os.getenv("RECOMMENDATION_MIN_CO_OCCURRENCE", "1"))
+
+
+class CoOccurrenceModel:
+    """Item-to-item recommendations from products that share a cart.
+
+    C = Bᵀ·B over the binary cart × product matrix B: C[i, j] counts carts
+    holding both i and j and the diagonal C[i, i] counts carts holding i.
+    Neighbours are ranked by cosine similarity C[i, j] / sqrt(C[i, i] · C[j, j])
+    and the best TOP_K per product are kept in two dense arrays, so a lookup is
+    one row read.
+
+    Cart events only append pairs to a delta buffer; refresh() folds it into C
+    and re-ranks just the products that gained pairs. A rank is therefore
+    slightly stale when only the popularity of a neighbour changed, until the
+    next rebuild. A rebuild discards the buffer and any delta taken before it,
+    since the snapshot it reads already holds those pairs.
+    """
+
+    def __init__(self, top_k: int = TOP_K, min_co_occurrence: int = MIN_CO_OCCURRENCE):
+        self.top_k = top_k
+        self.min_co_occurrence = min_co_occurrence
+        self.product_ids: List[str] = []
+        self.index: Dict[str, int] = {}
+        self.deleted: Set[int] = set()
+        # Current contents of each cart, to know which pairs a new line forms
+        self.baskets: Dict[int, array] = {}
+        self.matrix = sparse.csr_matrix((0, 0), dtype=np.int32)
+        self.neighbours = np.full((0, top_k), -1, dtype=np.int32)
+        self.scores = np.zeros((0, top_k), dtype=np.float32)
+        self._delta_rows = array("i")
+        self._delta_cols = array("i")
+        # Bumped by every rebuild; a delta taken before it is not applied
+        self._generation = 0
+        self._refresh_lock = threading.Lock()
+        # A rebuild interns from a worker thread while events arrive on the loop
+        self._intern_lock = threading.Lock()
+
+    def intern(self, product_id: str) -> int:
+        idx = self.index.get(product_id)
+        if idx is None:
+            with self._intern_lock:
+                idx = self.index.get(product_id)
+                if idx is None:
+                    idx = len(self.product_ids)
+                    self.product_ids.append(product_id)
+                    self.index[product_id] = idx
+        return idx
+
+    # Full build
+
+    def build(self, rows: Iterable[Tuple[int, str]]) -> None:
+        """Rebuilds from (user_id, product_id) rows such as cart_items."""
+        with self._refresh_lock:
+            self._generation += 1
+            self._delta_rows, self._delta_cols = array("i"), array("i")
+        users, products, baskets = array("q"), array("i"), {}
+        for user_id, product_id in rows:
+            idx = self.intern(product_id)
+            users.append(user_id)
+            products.append(idx)
+            baskets.setdefault(user_id, array("i")).append(idx)
+        self.build_from_arrays(np.frombuffer(users, dtype=np.int64),
+                               np.frombuffer(products, dtype=np.int32))
+        self.baskets = baskets
+
+    def build_from_arrays(self, users: np.ndarray, products: np.ndarray) -> None:
+        n = len(self.product_ids)
+        _, carts = np.unique(users, return_inverse=True)
+        basket_matrix = sparse.csr_matrix(
+            (np.ones(len(products), dtype=np.int32), (carts, products)),
+            shape=(int(carts.max()) + 1 if len(carts) else 0, n))
+        # Duplicate lines of one cart count once
+        basket_matrix.data[:] = 1
+        with self._refresh_lock:
+            self.matrix = (basket_matrix.T @ basket_matrix).tocsr()
+            self.neighbours = np.full((n, self.top_k), -1, dtype=np.int32)
+            self.scores = np.zeros((n, self.top_k), dtype=np.float32)
+            self._rank(np.arange(n, dtype=np.int32))
+
+    # Incremental updates (called on the event loop)
+
+    def add(self, user_id: int, product_id: str) -> None:
+        idx = self.intern(product_id)
+        basket = self.baskets.setdefault(user_id, array("i"))
+        if idx in basket:
+            return
+        self._delta_rows.append(idx)
+        self._delta_cols.append(idx)
+        for other in basket:
+            self._delta_rows.extend((idx, other))
+            self._delta_cols.extend((other, idx))
+        basket.append(idx)
+
+    def remove(self, user_id: int, product_id: str) -> None:
+        # Co-occurrence is history: a removed line keeps the pairs it formed
+        idx = self.index.get(product_id)
+        basket = self.baskets.get(user_id)
+        if idx is None or basket is None or idx not in basket:
+            return
+        basket.remove(idx)
+        if not basket:
+            del self.baskets[user_id]
+
+    def drop_basket(self, user_id: int) -> None:
+        self.baskets.pop(user_id, None)
+
+    def mark_deleted(self, product_id: str) -> None:
+        idx = self.index.get(product_id)
+        if idx is not None:
+            self.deleted.add(idx)
+
+    def pending(self) -> int:
+        return len(self._delta_rows)
+
+    def take_delta(self) -> Tuple[np.ndarray, np.ndarray, int, int]:
+        rows = np.frombuffer(self._delta_rows, dtype=np.int32).copy()
+        cols = np.frombuffer(self._delta_cols, dtype=np.int32).copy()
+        self._delta_rows, self._delta_cols = array("i"), array("i")
+        return rows, cols, len(self.product_ids), self._generation
+
+    def refresh(self, rows: np.ndarray, cols: np.ndarray, n: int,
+                generation: Optional[int] = None) -> int:
+        """Folds a delta from take_delta() into the matrix; safe to run in a thread."""
+        with self._refresh_lock:
+            if generation is not None and generation != self._generation:
+                return 0
+            matrix = self.matrix
+            if matrix.shape[0] < n:
+                matrix = matrix.copy()
+                matrix.resize((n, n))
+            if len(rows):
+                delta = sparse.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, cols)),
+                                          shape=(n, n))
+                matrix = matrix + delta
+            neighbours, scores = self.neighbours, self.scores
+            if neighbours.shape[0] < n:
+                neighbours = np.vstack([neighbours, np.full((n - neighbours.shape[0], self.top_k), -1,
+                                                            dtype=np.int32)])
+                scores = np.vstack([scores, np.zeros((n - scores.shape[0], self.top_k),
+                                                     dtype=np.float32)])
+            else:
+                neighbours, scores = neighbours.copy(), scores.copy()
+            dirty = np.unique(rows)
+            self._rank(dirty, matrix, neighbours, scores)
+            # Readers only ever see a complete generation
+            self.matrix, self.neighbours, self.scores = matrix, neighbours, scores
+            return len(dirty)
+
+    def _rank(self, products: np.ndarray, matrix=None, neighbours=None, scores=None) -> None:
+        matrix = self.matrix if matrix is None else matrix
+        neighbours = self.neighbours if neighbours is None else neighbours
+        scores = self.scores if scores is None else scores
+        if not len(products):
+            return
+        neighbours[products] = -1
+        scores[products] = 0
+        counts = matrix.diagonal().astype(np.float64)
+        sub = matrix[products]
+        row = np.repeat(np.arange(len(products), dtype=np.int64), np.diff(sub.indptr))
+        cols, together = sub.indices, sub.data
+        source = products[row]
+        keep = (cols != source) & (together >= self.min_co_occurrence)
+        row, cols, source, together = row[keep], cols[keep], source[keep], together[keep]
+        similarity = together / np.sqrt(counts[source] * counts[cols])
+        # Best first within each product, then the first top_k of every run
+        order = np.lexsort((-similarity, row))
+        row, cols, similarity = row[order], cols[order], similarity[order]
+        starts = np.searchsorted(row, np.arange(len(products)))
+        rank = np.arange(len(row)) - starts[row]
+        keep = rank < self.top_k
+        target = products[row[keep]]
+        neighbours[target, rank[keep]] = cols[keep]
+        scores[target, rank[keep]] = similarity[keep]
+
+    # Reads
+
+    def recommend(self, product_id: str, limit: int = 10) -> Optional[List[Tuple[str, float]]]:
+        idx = self.index.get(product_id)
+        if idx is None or idx >= len(self.neighbours):
+            return None
+        neighbours, scores = self.neighbours[idx], self.scores[idx]
+        result = []
+        for j in range(self.top_k):
+            other = int(neighbours[j])
+            if other < 0 or len(result) >= limit:
+                break
+            if other not in self.deleted:
+                result.append((self.product_ids[other], float(scores[j])))
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "products": len(self.product_ids),
+            "carts": len(self.baskets),
+            "pairs": int(self.matrix.nnz),
+            "pending_pairs": self.pending(),
+            "index_bytes": int(self.neighbours.nbytes + self.scores.nbytes),
+            "matrix_bytes": int(self.matrix.data.nbytes + self.matrix.indices.nbytes
+                                + self.matrix.indptr.nbytes),
+        }
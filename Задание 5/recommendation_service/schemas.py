@@ -0,0 +1,12 @@
+from pydantic import BaseModel
+from typing import List
+
+
+class Recommendation(BaseModel):
+    product_id: str
+    score: float
+
+
+class Recommendations(BaseModel):
+    product_id: str
+    items: List[Recommendation]
@@ -0,0 +1,145 @@
+"""Runs user_service, product_service and cart_service in one process on one event loop.
+
+    python run_hermetic.py                          # SQLite + in-memory Mongo and Redis
+    python run_hermetic.py --sql pgserver           # embedded Postgres (pip install pgserver)
+    python run_hermetic.py --profile hermetic.prof  # cProfile the whole run, dump on exit
+    py-spy record -o flame.svg -- python run_hermetic.py
+
+No docker-compose, init_db.py or wait-for-it.sh: every backend can be an
+in-process stand-in, selected through the same URLs the services read from
+the environment (see common/backends.py). Services keep their usual ports,
+so benchmarks/loadtest.py --no-start and the other benchmarks work unchanged.
+
+Each service is a flat set of modules (main, database, crud, ...) with
+clashing names, so they are imported one after another and their modules are
+moved under "<service>." in sys.modules before the next one is imported.
+
+SQLite only covers the ORM queries of user_service. The cart's Redis backend
+writes behind to Postgres with Postgres-only SQL, so with SQLite the cart runs
+on its memory backend unless --cart-backend redis is given together with a
+Postgres URL.
+"""
+import argparse
+import asyncio
+import cProfile
+import importlib
+import logging
+import os
+import signal
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+SERVICES = {
+    "user": ("user_service", 8000),
+    "product": ("product_service", 8001),
+    "cart": ("cart_service", 8002),
+}
+
+logger = logging.getLogger("hermetic")
+
+
+def database_url(sql: str, workdir: str) -> str:
+    if sql == "sqlite":
+        return f"sqlite:///{os.path.join(workdir, 'hermetic.db')}"
+    if sql == "pgserver":
+        try:
+            import pgserver
+        except ImportError:
+            raise SystemExit("--sql pgserver needs the optional pgserver package: pip install pgserver")
+        return pgserver.get_server(os.path.join(workdir, "pgdata")).get_uri()
+    return sql
+
+
+def configure(args, workdir: str) -> None:
+    sql_url = database_url(args.sql, workdir)
+    cart_backend = args.cart_backend or ("memory" if sql_url.startswith("sqlite") else "redis")
+    os.environ.update({
+        "DATABASE_URL": sql_url,
+        "REDIS_URL": args.redis,
+        "MONGO_URL": args.mongo,
+        "CART_BACKEND": cart_backend,
+        "PRODUCT_SERVICE_URL": f"http://127.0.0.1:{SERVICES['product'][1]}",
+        "CART_SNAPSHOT_PATH": os.path.join(workdir, "carts.snapshot"),
+    })
+    logger.info("DATABASE_URL=%s REDIS_URL=%s MONGO_URL=%s CART_BACKEND=%s",
+                sql_url, args.redis, args.mongo, cart_backend)
+
+
+def load_service(name: str, directory: str):
+    """Imports <directory>/main.py and returns its app, keeping its modules apart from other services'."""
+    path = os.path.join(ROOT, directory)
+    local = {file[:-3] for file in os.listdir(path) if file.endswith(".py")}
+    for module in local & set(sys.modules):
+        del sys.modules[module]
+    sys.path.insert(0, path)
+    try:
+        app = importlib.import_module("main").app
+    finally:
+        sys.path.remove(path)
+        for module in local & set(sys.modules):
+            sys.modules[f"{name}.{module}"] = sys.modules.pop(module)
+    return app
+
+
+async def serve(apps: dict, host: str, log_level: str) -> None:
+    import uvicorn
+
+    servers = []
+    for name, app in apps.items():
+        config = uvicorn.Config(app, host=host, port=SERVICES[name][1], log_level=log_level, lifespan="on")
+        server = uvicorn.Server(config)
+        # One set of signal handlers for all servers instead of each replacing the last
+        server.install_signal_handlers = lambda: None
+        servers.append(server)
+
+    def shutdown():
+        for server in servers:
+            server.should_exit = True
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, shutdown)
+    logger.info("Serving %s", ", ".join(f"{name} on :{SERVICES[name][1]}" for name in apps))
+    await asyncio.gather(*(server.serve() for server in servers))
+
+
+def main(args) -> None:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    workdir = args.workdir or tempfile.mkdtemp(prefix="hermetic-")
+    configure(args, workdir)
+    sys.path.insert(0, ROOT)
+    apps = {name: load_service(name, SERVICES[name][0]) for name in args.services.split(",")}
+
+    if args.uvloop:
+        import uvloop
+
+        uvloop.install()
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler:
+        profiler.enable()
+    try:
+        asyncio.run(serve(apps, args.host, args.log_level))
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+            logger.info("Profile written to %s (python -m pstats %s)", args.profile, args.profile)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--services", default="user,product,cart",
+                        help="comma-separated subset of " + ",".join(SERVICES))
+    parser.add_argument("--sql", default="sqlite", help="sqlite, pgserver or a SQLAlchemy URL")
+    parser.add_argument("--redis", default="fakeredis://hermetic", help="fakeredis://... or a redis:// URL")
+    parser.add_argument("--mongo", default="mongomock://", help="mongomock:// or a mongodb:// URL")
+    parser.add_argument("--cart-backend", choices=["memory", "redis"],
+                        help="default: memory with SQLite, redis otherwise")
+    parser.add_argument("--workdir", help="where SQLite/pgserver keep their files (default: a temp dir)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--log-level", default="warning")
+    parser.add_argument("--uvloop", action="store_true")
+    parser.add_argument("--profile", metavar="FILE", help="write cProfile stats of the whole run to FILE")
+    main(parser.parse_args())
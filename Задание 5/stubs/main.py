@@ -0,0 +1,167 @@
+"""Stand-in for the external Payment and Delivery systems.
+
+One app serves POST /payments and /refunds as well as POST /deliveries and
+/cancellations; compose runs it twice (STUB_NAME=payment / delivery). Latency, failures and the rate limit are read
+from the environment and can be changed at runtime via PUT /admin/config.
+"""
+import asyncio
+import math
+import os
+import random
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional
+from fastapi import Body, FastAPI, Header, Response, status
+from fastapi.responses import JSONResponse
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest
+from pydantic import BaseModel, Field
+
+STUB_NAME = os.getenv("STUB_NAME", "payment")
+
+REQUESTS = Counter("stub_requests_total", "Requests served by the stub", ["stub", "outcome"])
+LATENCY = Histogram("stub_injected_latency_seconds", "Latency injected per request", ["stub"])
+DUPLICATES = Counter("stub_duplicate_requests_total", "Requests repeating an Idempotency-Key", ["stub"])
+
+
+class StubConfig(BaseModel):
+    # fixed | uniform | normal | lognormal | exponential
+    distribution: str = Field(os.getenv("STUB_LATENCY_DIST", "lognormal"))
+    median_ms: float = Field(float(os.getenv("STUB_LATENCY_MS", "50")), ge=0)
+    # Relative spread: ± for uniform, sigma for normal (as a fraction of the median) and lognormal
+    spread: float = Field(float(os.getenv("STUB_LATENCY_SPREAD", "0.5")), ge=0)
+    # Occasional very slow responses (GC pauses, cold caches) on top of the distribution
+    tail_probability: float = Field(float(os.getenv("STUB_TAIL_PROBABILITY", "0.01")), ge=0, le=1)
+    tail_ms: float = Field(float(os.getenv("STUB_TAIL_MS", "1000")), ge=0)
+    error_rate: float = Field(float(os.getenv("STUB_ERROR_RATE", "0.0")), ge=0, le=1)
+    # Requests per second and burst size; 0 disables the limit
+    rate_limit: float = Field(float(os.getenv("STUB_RATE_LIMIT", "0")), ge=0)
+    burst: int = Field(int(os.getenv("STUB_BURST", "50")), ge=1)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def take(self) -> Optional[float]:
+        """None if allowed, else seconds until a token is available."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return None
+        return (1 - self.tokens) / self.rate
+
+
+def sample_latency(config: StubConfig) -> float:
+    if random.random() < config.tail_probability:
+        return config.tail_ms / 1000
+    median = config.median_ms / 1000
+    if config.distribution == "fixed":
+        value = median
+    elif config.distribution == "uniform":
+        value = random.uniform(median * (1 - config.spread), median * (1 + config.spread))
+    elif config.distribution == "normal":
+        value = random.gauss(median, median * config.spread)
+    elif config.distribution == "exponential":
+        value = random.expovariate(math.log(2) / median) if median else 0
+    else:
+        value = median * math.exp(random.gauss(0, config.spread))
+    return max(0.0, value)
+
+
+app = FastAPI(title=f"{STUB_NAME.capitalize()} System stub")
+
+config = StubConfig()
+bucket = TokenBucket(config.rate_limit, config.burst)
+# Idempotency-Key -> response body; bounded, oldest forgotten first
+seen: "OrderedDict[str, dict]" = OrderedDict()
+SEEN_LIMIT = 100_000
+
+
+async def handle(kind: str, body: dict, idempotency_key: Optional[str], deadline_ms: Optional[str]):
+    if config.rate_limit > 0:
+        wait = bucket.take()
+        if wait is not None:
+            REQUESTS.labels(STUB_NAME, "rate_limited").inc()
+            return JSONResponse({"detail": "Rate limit exceeded"}, status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                                headers={"Retry-After": str(math.ceil(wait))})
+
+    latency = sample_latency(config)
+    LATENCY.labels(STUB_NAME).observe(latency)
+    budget = int(deadline_ms) / 1000 if deadline_ms else None
+    if budget is not None and latency > budget:
+        # The caller will have given up by then: spend only its budget
+        await asyncio.sleep(budget)
+        REQUESTS.labels(STUB_NAME, "deadline").inc()
+        return JSONResponse({"detail": "Deadline exceeded"}, status_code=status.HTTP_504_GATEWAY_TIMEOUT)
+    await asyncio.sleep(latency)
+
+    if random.random() < config.error_rate:
+        REQUESTS.labels(STUB_NAME, "error").inc()
+        return JSONResponse({"detail": "Injected failure"}, status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    if idempotency_key and idempotency_key in seen:
+        DUPLICATES.labels(STUB_NAME).inc()
+        REQUESTS.labels(STUB_NAME, "duplicate").inc()
+        return JSONResponse(seen[idempotency_key], status_code=status.HTTP_200_OK)
+
+    result = {"id": uuid.uuid4().hex, "kind": kind, "status": "accepted",
+              "order_id": body.get("order_id"), "latency_ms": round(latency * 1000, 2)}
+    if idempotency_key:
+        seen[idempotency_key] = result
+        if len(seen) > SEEN_LIMIT:
+            seen.popitem(last=False)
+    REQUESTS.labels(STUB_NAME, "ok").inc()
+    return JSONResponse(result, status_code=status.HTTP_201_CREATED)
+
+
+@app.post("/payments")
+async def create_payment(body: dict = Body(...), idempotency_key: Optional[str] = Header(None),
+                         x_request_deadline_ms: Optional[str] = Header(None)):
+    return await handle("payment", body, idempotency_key, x_request_deadline_ms)
+
+
+@app.post("/deliveries")
+async def create_delivery(body: dict = Body(...), idempotency_key: Optional[str] = Header(None),
+                          x_request_deadline_ms: Optional[str] = Header(None)):
+    return await handle("delivery", body, idempotency_key, x_request_deadline_ms)
+
+
+@app.post("/refunds")
+async def create_refund(body: dict = Body(...), idempotency_key: Optional[str] = Header(None),
+                        x_request_deadline_ms: Optional[str] = Header(None)):
+    return await handle("refund", body, idempotency_key, x_request_deadline_ms)
+
+
+@app.post("/cancellations")
+async def create_cancellation(body: dict = Body(...), idempotency_key: Optional[str] = Header(None),
+                              x_request_deadline_ms: Optional[str] = Header(None)):
+    return await handle("delivery_cancel", body, idempotency_key, x_request_deadline_ms)
+
+
+@app.get("/admin/config", response_model=StubConfig)
+async def get_config():
+    return config
+
+
+@app.put("/admin/config", response_model=StubConfig)
+async def set_config(new: StubConfig):
+    global config, bucket
+    config = new
+    bucket = TokenBucket(config.rate_limit, config.burst)
+    return config
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get("/health")
+async def health_check():
+    return {"status": "OK", "service": f"{STUB_NAME}_stub"}
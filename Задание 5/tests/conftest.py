@@ -0,0 +1,120 @@
+"""cart_service against in-memory Redis (fakeredis) and an embedded Postgres (pgserver).
+
+cart_service is a flat set of modules (crud, database, write_behind, ...) that
+read their backends from the environment at import time, so the environment
+is set up here before the tests import them. Redis clients are created per
+event loop on one shared fakeredis server.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+pgserver = pytest.importorskip("pgserver")
+fakeredis = pytest.importorskip("fakeredis")
+from fakeredis import aioredis  # noqa: E402
+
+_pgdata = tempfile.mkdtemp(prefix="cart-tests-pg-")
+_postgres = pgserver.get_server(_pgdata, cleanup_mode="delete")
+
+os.environ.update({
+    "DATABASE_URL": _postgres.get_uri(),
+    # Never connected to: every test client talks to the fakeredis server below
+    "REDIS_URL": "redis://localhost:6379/0",
+})
+sys.path[:0] = [os.path.join(ROOT, "cart_service"), ROOT]
+
+# Same cart_items as user_service/init_db.py; users only for the foreign key
+SCHEMA_SQL = """
+DROP TABLE IF EXISTS cart_items;
+DROP TABLE IF EXISTS users;
+CREATE TABLE users (id INTEGER PRIMARY KEY);
+CREATE TABLE cart_items (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    product_id VARCHAR(24) NOT NULL,
+    quantity INTEGER NOT NULL DEFAULT 1 CHECK (quantity > 0),
+    price_at_add NUMERIC(10, 2) NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE,
+    CONSTRAINT unique_user_product UNIQUE (user_id, product_id)
+);
+INSERT INTO users (id) SELECT generate_series(1, 10);
+"""
+
+
+class CartHarness:
+    """Drives cart_service's Redis carts and reads both sides back."""
+
+    def __init__(self, server, engine):
+        self.server = server
+        self.engine = engine
+
+    def sync_redis(self):
+        return fakeredis.FakeRedis(server=self.server, decode_responses=True)
+
+    def run(self, action):
+        """Runs action(redis) on a fresh event loop with its own client."""
+        async def main():
+            redis = aioredis.FakeRedis(server=self.server, decode_responses=True)
+            try:
+                return await action(redis)
+            finally:
+                await redis.close()
+        return asyncio.run(main())
+
+    def change(self, user_id, product_id, quantity, price=100.0):
+        """Sets a line to quantity (0 removes it)"""
+        import crud
+
+        return self.run(lambda redis: crud.change_item(redis, user_id, product_id, "set", quantity, price))
+
+    def flush(self):
+        from write_behind import WriteBehindFlusher
+
+        return self.run(lambda redis: WriteBehindFlusher(redis).flush_once())
+
+    def redis_carts(self):
+        import crud
+
+        async def read(redis):
+            rows = {}
+            for key in await redis.keys("cart:[0-9]*"):
+                user_id = int(key.split(":")[1])
+                items, prices = crud.parse_cart(await redis.hgetall(key))
+                for item in items:
+                    rows[(user_id, item.product_id)] = (item.quantity, prices[item.product_id])
+            return rows
+        return self.run(read)
+
+    def postgres_carts(self):
+        from sqlalchemy import text
+
+        with self.engine.connect() as conn:
+            rows = conn.execute(text("SELECT user_id, product_id, quantity, price_at_add FROM cart_items")).all()
+        return {(user_id, product_id): (quantity, float(price))
+                for user_id, product_id, quantity, price in rows}
+
+    def dirty(self):
+        import crud
+
+        return set(self.run(lambda redis: redis.zrange(crud.DIRTY_KEY, 0, -1)))
+
+
+@pytest.fixture
+def postgres():
+    from sqlalchemy import text
+    from database import engine
+
+    with engine.begin() as conn:
+        conn.execute(text(SCHEMA_SQL))
+    return engine
+
+
+@pytest.fixture
+def harness(postgres):
+    return CartHarness(fakeredis.FakeServer(), postgres)
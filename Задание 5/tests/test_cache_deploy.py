@@ -0,0 +1,37 @@
+"""The deploy hook (user_service/cache_deploy.py) drops cart state of reseeded tables."""
+import importlib.util
+import os
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def cache_deploy():
+    path = os.path.join(ROOT, "user_service", "cache_deploy.py")
+    spec = importlib.util.spec_from_file_location("cache_deploy", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_rewritten_users_drop_cart_state(harness, cache_deploy):
+    client = harness.sync_redis()
+    try:
+        first = cache_deploy.run_deploy_hook(harness.engine, client)
+        harness.change(4, "a" * 24, 2, 10.5)
+
+        # Nothing changed: carts survive a restart
+        assert cache_deploy.run_deploy_hook(harness.engine, client) == {}
+        assert client.exists("cart:4")
+
+        client.set("cache:untouched", 1)
+        generations = cache_deploy.run_deploy_hook(harness.engine, client, ["users"])
+        assert generations["cache:auth_user"] == first["cache:auth_user"] + 1
+        assert client.keys("cart:*") == []
+        assert client.get("cache:untouched") == "1"
+    finally:
+        client.close()
+    assert harness.dirty() == set()
+    assert harness.flush() == 0
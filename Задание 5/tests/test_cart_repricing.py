@@ -0,0 +1,55 @@
+"""Repricing (cart_service/repricing.py) against carts the write-behind flusher has not caught up with."""
+import pytest
+
+pytest.importorskip("numpy")
+
+import write_behind  # noqa: E402
+from repricing import RepriceJob  # noqa: E402
+
+PRODUCT = "a" * 24
+
+
+def _reprice(harness, changes):
+    client = harness.sync_redis()
+    try:
+        return RepriceJob(changes, redis_client=client).run()
+    finally:
+        client.close()
+
+
+@pytest.fixture
+def carts(harness):
+    harness.change(1, PRODUCT, 2, 10.5)
+    assert harness.flush() == 1
+    # Cart 2 exists only in Redis until the next flush
+    harness.change(2, PRODUCT, 5, 10.5)
+    return harness
+
+
+def test_reprice_covers_unflushed_lines(carts):
+    report = _reprice(carts, {PRODUCT: 12.0})
+    assert report["lines"] == 1
+    assert report["unflushed_lines"] == 1
+    assert {price for _, price in carts.redis_carts().values()} == {12.0}
+
+    carts.flush()
+    assert carts.postgres_carts() == carts.redis_carts()
+    assert carts.dirty() == set()
+
+
+def test_reprice_during_flush_is_flushed_again(carts, monkeypatch):
+    write_batch = write_behind._write_batch
+
+    def reprice_then_write(*args):
+        # The snapshot being written still has the old price
+        _reprice(carts, {PRODUCT: 12.0})
+        write_batch(*args)
+
+    monkeypatch.setattr(write_behind, "_write_batch", reprice_then_write)
+    carts.flush()
+    assert carts.dirty() == {"1", "2"}
+
+    monkeypatch.undo()
+    carts.flush()
+    assert {price for _, price in carts.postgres_carts().values()} == {12.0}
+    assert carts.postgres_carts() == carts.redis_carts()
@@ -0,0 +1,97 @@
+"""Crash consistency of the cart write-behind flusher (cart_service/write_behind.py).
+
+A crash is simulated by raising out of flush_once at the given point; the
+flush lock is released by its finally block as it would be by its TTL.
+Whatever the point, running flush_once again must leave cart_items equal to
+the carts in Redis and cart:dirty empty.
+"""
+import pytest
+
+import write_behind
+from write_behind import WriteBehindFlusher
+
+
+class Crash(Exception):
+    pass
+
+
+@pytest.fixture
+def carts(harness):
+    harness.change(1, "a" * 24, 2, 10.5)
+    harness.change(1, "b" * 24, 1, 3.0)
+    harness.change(2, "a" * 24, 5, 10.5)
+    return harness
+
+
+def test_flush_persists_dirty_carts(carts):
+    assert carts.flush() == 2
+    assert carts.postgres_carts() == carts.redis_carts()
+    assert carts.dirty() == set()
+
+
+def test_crash_after_commit_before_ack(carts, monkeypatch):
+    async def crash(*args, **kwargs):
+        raise Crash()
+
+    async def flush(redis):
+        flusher = WriteBehindFlusher(redis)
+        monkeypatch.setattr(flusher, "_ack", crash)
+        await flusher.flush_once()
+
+    with pytest.raises(Crash):
+        carts.run(flush)
+    # Committed but not acknowledged: the carts are flushed again
+    assert carts.postgres_carts() == carts.redis_carts()
+    assert carts.dirty() == {"1", "2"}
+
+    assert carts.flush() == 2
+    assert carts.postgres_carts() == carts.redis_carts()
+    assert carts.dirty() == set()
+
+
+def test_crash_between_snapshot_and_upsert(carts, monkeypatch):
+    def crash(*args):
+        # A request changes cart 1 after its snapshot was read, then the flusher dies
+        carts.change(1, "b" * 24, 0)
+        carts.change(1, "c" * 24, 4, 7.25)
+        raise Crash()
+
+    monkeypatch.setattr(write_behind, "_write_batch", crash)
+    with pytest.raises(Crash):
+        carts.flush()
+    assert carts.postgres_carts() == {}
+    assert carts.dirty() == {"1", "2"}
+
+    monkeypatch.undo()
+    assert carts.flush() == 2
+    assert carts.postgres_carts() == carts.redis_carts()
+    assert carts.dirty() == set()
+
+
+def test_cart_changed_mid_flush_stays_dirty(carts, monkeypatch):
+    write_batch = write_behind._write_batch
+
+    def change_then_write(*args):
+        carts.change(1, "b" * 24, 0)
+        write_batch(*args)
+
+    monkeypatch.setattr(write_behind, "_write_batch", change_then_write)
+    assert carts.flush() == 1
+    # Postgres has the snapshot of cart 1, Redis the newer state, and the marker remains
+    assert (1, "b" * 24) not in carts.redis_carts()
+    assert (1, "b" * 24) in carts.postgres_carts()
+    assert carts.dirty() == {"1"}
+
+    monkeypatch.undo()
+    assert carts.flush() == 1
+    assert carts.postgres_carts() == carts.redis_carts()
+    assert carts.dirty() == set()
+
+
+def test_rejected_cart_does_not_block_the_batch(carts):
+    # A token of a user that is gone since init_db reseeded users
+    carts.change(99, "a" * 24, 1, 10.5)
+    assert carts.flush() == 3
+    assert carts.postgres_carts() == {key: value for key, value in carts.redis_carts().items()
+                                      if key[0] != 99}
+    assert carts.dirty() == set()
@@ -4,9 +4,10 @@ from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status, Request
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
-from redis import Redis
+from redis.asyncio import Redis
 import crud, schemas, models
-from database import get_db, get_redis
+from common.cache import TwoTierCache
+from database import get_db, async_redis, cache_redis, cache_bus
 from typing import Optional, Tuple
 import os
 import logging
@@ -20,6 +21,17 @@ ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
 REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "7"))
 
+# Cache config: L1 is kept coherent by cache_bus invalidations, its TTL is only a backstop
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL_SECONDS", "300"))
+AUTH_CACHE_L1_TTL = float(os.getenv("AUTH_CACHE_L1_TTL_SECONDS", "60"))
+
+# username -> user record with password hash (None for unknown usernames)
+auth_user_cache = TwoTierCache("auth_user", cache_redis, ttl=AUTH_CACHE_TTL, l1_ttl=AUTH_CACHE_L1_TTL,
+                               bus=cache_bus)
+# access token -> user record; keyed by a digest, a whole JWT is several hundred bytes per key
+token_cache = TwoTierCache("user_token", cache_redis, ttl=AUTH_CACHE_TTL, l1_ttl=AUTH_CACHE_L1_TTL,
+                           bus=cache_bus, hash_keys=True)
+
 # Password context
 pwd_context = CryptContext(
     schemes=["bcrypt", "argon2"],
@@ -51,37 +63,24 @@ def get_password_hash(password: str) -> str:
     """Generate secure password hash"""
     return pwd_context.hash(password)
 
+def auth_record(user) -> dict:
+    """auth_user_cache entry: UserOut fields plus the password hash"""
+    return {**schemas.UserOut.record(user), "password_hash": user.password_hash}
+
 async def authenticate_user(
     db: Session,
     username: str,
-    password: str,
-    redis: Optional[Redis] = None
-) -> Optional[models.User]:
+    password: str
+) -> Optional[schemas.UserOut]:
     """Authenticate user with cache support"""
-    cache_key = f"auth_user:{username}"
-    
-    # Try to get from cache
-    if redis:
-        cached_user = redis.get(cache_key)
-        if cached_user:
-            user_data = schemas.UserOut.from_redis_dict(json.loads(cached_user))
-            if verify_password(password, user_data.password_hash):
-                return user_data
-    
-    # Database lookup
-    user = crud.get_user_by_username(db, username, redis=redis)
-    if not user or not verify_password(password, user.password_hash):
+    async def load():
+        user = crud.get_user_by_username(db, username)
+        return auth_record(user) if user else None
+
+    record = await auth_user_cache.get_or_load(username, load)
+    if not record or not verify_password(password, record["password_hash"]):
         return None
-    
-    # Update cache
-    if redis:
-        redis.setex(
-            cache_key,
-            timedelta(minutes=5),
-            json.dumps(user.to_redis_dict())
-        )
-    
-    return user
+    return schemas.UserOut.from_cache(record)
 
 def create_tokens(
     data: dict,
@@ -107,7 +106,6 @@ def create_tokens(
 async def get_current_user(
     request: Request,
     db: Session = Depends(get_db),
-    redis: Redis = Depends(get_redis),
     token: str = Depends(oauth2_scheme)
 ) -> models.User:
     """Get current user from token with cache support"""
@@ -117,11 +115,9 @@ async def get_current_user(
         headers={"WWW-Authenticate": "Bearer"},
     )
     
-    cache_key = f"user_token:{token}"
-    if redis:
-        cached_user = redis.get(cache_key)
-        if cached_user:
-            return schemas.UserOut.from_redis_dict(json.loads(cached_user))
+    cached_user = await token_cache.get(token)
+    if cached_user:
+        return schemas.UserOut.from_cache(cached_user)
     
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
@@ -133,30 +129,25 @@ async def get_current_user(
         logger.error(f"JWT error: {e}")
         raise credentials_exception
     
-    user = crud.get_user_by_username(db, username, redis=redis)
+    user = crud.get_user_by_username(db, username)
     if user is None:
         raise credentials_exception
     
     # Verify token is not revoked
-    if await is_token_revoked(token, redis):
+    if await is_token_revoked(token, async_redis):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Token has been revoked"
         )
     
     # Cache user data
-    if redis:
-        redis.setex(
-            cache_key,
-            timedelta(minutes=5),
-            json.dumps(user.to_redis_dict())
-        )
+    await token_cache.set(token, schemas.UserOut.record(user))
     
     return user
 
 async def is_token_revoked(token: str, redis: Redis) -> bool:
     """Check if token is in revocation list"""
-    return redis.sismember("revoked_tokens", token)
+    return bool(await redis.sismember("revoked_tokens", token))
 
 async def revoke_token(token: str, redis: Redis) -> None:
     """Add token to revocation list"""
@@ -165,7 +156,9 @@ async def revoke_token(token: str, redis: Redis) -> None:
         expire_time = datetime.fromtimestamp(payload["exp"])
         ttl = (expire_time - datetime.utcnow()).total_seconds()
         if ttl > 0:
-            redis.sadd("revoked_tokens", token)
-            redis.expire("revoked_tokens", int(ttl))
+            await redis.sadd("revoked_tokens", token)
+            await redis.expire("revoked_tokens", int(ttl))
+        # Drop the cached user in every worker, otherwise the token keeps working until the TTL
+        await token_cache.invalidate(token)
     except JWTError:
         pass
\ No newline at end of file
@@ -0,0 +1,102 @@
+"""Лаборатория стратегий кеширования.
+
+Один и тот же «запрос к БД» (неблокирующая задержка LAB_QUERY_MS) отдается
+под разными стратегиями, выбираемыми на каждый запрос:
+
+- none      — без кеша, каждый запрос идет в «БД»;
+- lru       — LRU в памяти процесса с TTL;
+- redis     — только Redis;
+- two_tier  — common.cache: LRU процесса (короткий TTL) поверх Redis,
+              инвалидация рассылается воркерам через pub/sub;
+- swr       — stale-while-revalidate (common.swr): после мягкого TTL отдается
+              устаревшее значение, а обновляет его в фоне один воркер.
+
+У каждой стратегии свои ключи в Redis и свои метрики, чтобы сравнивать их
+в равных условиях.
+"""
+import asyncio
+import json
+import os
+import time
+from typing import Tuple
+
+from prometheus_client import Counter, Histogram
+from redis.exceptions import RedisError
+
+from common.cache import LRUCache, TwoTierCache
+from common.swr import SWRCache
+from database import async_redis, cache_redis, cache_bus
+
+LAB_QUERY_SECONDS = float(os.getenv("LAB_QUERY_MS", "10")) / 1000
+LAB_TTL_SECONDS = int(os.getenv("LAB_TTL_SECONDS", "30"))
+LAB_LRU_SIZE = int(os.getenv("LAB_LRU_SIZE", "10000"))
+# L1 двухуровневого кеша живет недолго, чтобы расхождение между воркерами было ограничено
+LAB_L1_TTL_SECONDS = float(os.getenv("LAB_L1_TTL_SECONDS", "1"))
+LAB_SWR_SOFT_TTL_SECONDS = float(os.getenv("LAB_SWR_SOFT_TTL_SECONDS", "10"))
+
+STRATEGIES = ("none", "lru", "redis", "two_tier", "swr")
+
+LAB_REQUESTS = Counter("cache_lab_requests_total", "Запросы к лаборатории кеша",
+                       ["strategy", "result"])
+LAB_DURATION = Histogram("cache_lab_request_duration_seconds", "Время ответа по стратегии",
+                         ["strategy"], buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1))
+LAB_QUERIES = Counter("cache_lab_backend_queries_total", "Обращения к «БД» по стратегии", ["strategy"])
+LAB_ERRORS = Counter("cache_lab_errors_total", "Ошибки Redis по стратегии", ["strategy"])
+
+
+async def simulated_query(strategy: str, key: str) -> dict:
+    """Имитация запроса к БД без блокировки event loop"""
+    started = time.perf_counter()
+    await asyncio.sleep(LAB_QUERY_SECONDS)
+    LAB_QUERIES.labels(strategy).inc()
+    return {"key": key, "computed_at": time.time(), "query_time": time.perf_counter() - started}
+
+
+class CacheLab:
+    def __init__(self):
+        self.lru = LRUCache(LAB_LRU_SIZE, LAB_TTL_SECONDS)
+        self.two_tier = TwoTierCache("lab_two_tier", cache_redis, ttl=LAB_TTL_SECONDS,
+                                     l1_ttl=LAB_L1_TTL_SECONDS, l1_size=LAB_LRU_SIZE, bus=cache_bus)
+        self.redis = async_redis
+        self.swr = SWRCache("lab_swr", LAB_SWR_SOFT_TTL_SECONDS, LAB_TTL_SECONDS, cache_redis)
+
+    async def get(self, strategy: str, key: str) -> Tuple[dict, str]:
+        started = time.perf_counter()
+        try:
+            value, result = await getattr(self, f"_{strategy}")(key)
+        except RedisError:
+            LAB_ERRORS.labels(strategy).inc()
+            raise
+        LAB_REQUESTS.labels(strategy, result).inc()
+        LAB_DURATION.labels(strategy).observe(time.perf_counter() - started)
+        return value, result
+
+    async def _none(self, key: str) -> Tuple[dict, str]:
+        return await simulated_query("none", key), "miss"
+
+    async def _lru(self, key: str) -> Tuple[dict, str]:
+        value = self.lru.get(key)
+        if value is not None:
+            return value, "hit"
+        value = await simulated_query("lru", key)
+        self.lru.set(key, value)
+        return value, "miss"
+
+    async def _redis(self, key: str) -> Tuple[dict, str]:
+        redis_key = f"lab:redis:{key}"
+        cached = await self.redis.get(redis_key)
+        if cached is not None:
+            return json.loads(cached), "hit"
+        value = await simulated_query("redis", key)
+        await self.redis.setex(redis_key, LAB_TTL_SECONDS, json.dumps(value))
+        return value, "miss"
+
+    async def _two_tier(self, key: str) -> Tuple[dict, str]:
+        return await self.two_tier.fetch(key, lambda: simulated_query("two_tier", key))
+
+    async def _swr(self, key: str) -> Tuple[dict, str]:
+        # Ошибки Redis SWRCache не пробрасывает, а считает сам (swr_cache_requests_total{result="error"})
+        return await self.swr.fetch(key, lambda: simulated_query("swr", key))
+
+
+lab = CacheLab()
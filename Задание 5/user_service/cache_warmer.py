@@ -0,0 +1,113 @@
+"""Прогрев кешей пользователей после холодного старта.
+
+Последние активные пользователи (по last_login, никогда не входившие - в
+конце) читаются из PostgreSQL серверным курсором (yield_per), без загрузки
+всей выборки в память, и пачками пишутся в Redis через pipeline: одна
+пачка - один round trip. Каждый пользователь попадает в оба кеша поиска по
+логину: auth_user_cache (вход) и SWR-кеш load_user (GET /users/{username}).
+
+Размер пачки подстраивается под задержку Redis (AIMD): пока pipeline
+выполняется быстрее WARMUP_REDIS_LATENCY_MS, пачка растёт на шаг; если
+медленнее, она уменьшается вдвое и прогрев делает паузу той же длины, чтобы
+не отнимать Redis у живых запросов. Записи идут с NX, поэтому значения,
+уже закешированные трафиком, не перезаписываются.
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Callable, Optional
+
+from prometheus_client import Counter, Histogram
+from sqlalchemy import select
+
+import models
+
+logger = logging.getLogger(__name__)
+
+WARMUP_USERS = int(os.getenv("WARMUP_USERS", "10000"))
+WARMUP_BATCH_SIZE = int(os.getenv("WARMUP_BATCH_SIZE", "500"))
+WARMUP_MIN_BATCH_SIZE = int(os.getenv("WARMUP_MIN_BATCH_SIZE", "20"))
+WARMUP_REDIS_LATENCY_MS = float(os.getenv("WARMUP_REDIS_LATENCY_MS", "5"))
+
+WARMUP_KEYS = Counter("cache_warmup_keys_total", "Cache entries written by the warm-up", ["namespace"])
+WARMUP_BATCH_DURATION = Histogram("cache_warmup_batch_seconds", "Redis time per warm-up pipeline",
+                                  buckets=(.001, .0025, .005, .01, .025, .05, .1, .25))
+
+
+class RateController:
+    """AIMD-размер пачки, удерживающий время одного pipeline ниже цели"""
+
+    def __init__(self, target: float, max_size: int, min_size: int):
+        self.target = target
+        self.max_size = max_size
+        self.min_size = min(min_size, max_size)
+        self.size = max_size
+        self.step = max(1, max_size // 10)
+
+    def observe(self, elapsed: float) -> float:
+        """Учитывает время пачки; возвращает паузу перед следующей"""
+        if elapsed > self.target:
+            self.size = max(self.min_size, self.size // 2)
+            return elapsed
+        self.size = min(self.max_size, self.size + self.step)
+        return 0.0
+
+
+async def warm_user_caches(session_factory: Callable, redis, caches, limit: int = WARMUP_USERS,
+                           batch_size: int = WARMUP_BATCH_SIZE, min_batch_size: int = WARMUP_MIN_BATCH_SIZE,
+                           latency_target: float = WARMUP_REDIS_LATENCY_MS / 1000) -> int:
+    """Прогревает caches - пары (кеш с методом stage, функция пользователь -> значение).
+
+    Возвращает число прогретых пользователей.
+    """
+    controller = RateController(latency_target, batch_size, min_batch_size)
+    query = (
+        select(models.User)
+        .order_by(models.User.last_login.desc().nulls_last())
+        .limit(limit)
+        .execution_options(yield_per=batch_size)
+    )
+    db = session_factory()
+    warmed = 0
+    try:
+        result = await asyncio.to_thread(db.scalars, query)
+        while True:
+            users = await asyncio.to_thread(result.fetchmany, controller.size)
+            if not users:
+                break
+            # Поколение перечитывается на каждую пачку: сброс пространства имён во время прогрева
+            # оставит в старом поколении не больше одной пачки
+            generations = [await cache.keys.generation() for cache, _ in caches]
+            pipe = redis.pipeline(transaction=False)
+            for user in users:
+                for (cache, value), generation in zip(caches, generations):
+                    cache.stage(pipe, generation, user.username, value(user))
+            started = time.perf_counter()
+            await pipe.execute()
+            elapsed = time.perf_counter() - started
+            WARMUP_BATCH_DURATION.observe(elapsed)
+            for cache, _ in caches:
+                WARMUP_KEYS.labels(cache.namespace).inc(len(users))
+            warmed += len(users)
+            pause = controller.observe(elapsed)
+            if pause:
+                await asyncio.sleep(pause)
+    finally:
+        await asyncio.to_thread(db.close)
+    return warmed
+
+
+async def run_warmup(session_factory: Callable, redis, caches, timeout: Optional[float] = None) -> int:
+    """warm_user_caches с ограничением по времени; ошибки только логируются - холодный кеш не повод не стартовать"""
+    started = time.perf_counter()
+    try:
+        warmed = await asyncio.wait_for(warm_user_caches(session_factory, redis, caches), timeout)
+    except asyncio.TimeoutError:
+        logger.warning(f"Прогрев кеша прерван через {timeout} с")
+        return 0
+    except Exception:
+        logger.exception("Прогрев кеша не удался")
+        return 0
+    logger.info(f"Кеш прогрет: {warmed} пользователей за {time.perf_counter() - started:.2f} с")
+    return warmed
@@ -1,103 +1,70 @@
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from models import User
+from schemas import UserCreate, UserUpdate
+from typing import Optional, Tuple
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Numeric, ForeignKey
-from sqlalchemy.sql import func
-from sqlalchemy.orm import relationship
-from database import Base
-from passlib.context import CryptContext
-from typing import Optional, Dict, Any
-import json
-from enum import Enum as PyEnum
-from sqlalchemy import Enum as SqlEnum, Index
+import hashlib
+import logging
 
-# Password context
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+logger = logging.getLogger(__name__)
 
-class UserRole(str, PyEnum):
-    USER = "user"
-    ADMIN = "admin"
-    MANAGER = "manager"
+def get_user(db: Session, user_id: int):
+    return db.query(User).filter(User.id == user_id).first()
 
-class User(Base):
-    __tablename__ = "users"
-    
-    id = Column(Integer, primary_key=True, index=True)
-    username = Column(String(50), unique=True, nullable=False)
-    email = Column(String(255), unique=True, nullable=False)
-    hashed_password = Column(String(255), nullable=False)
-    full_name = Column(String(100), nullable=True)
-    is_active = Column(Boolean, default=True)
-    role = Column(SqlEnum(UserRole), default=UserRole.USER)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
-    last_login = Column(DateTime(timezone=True), nullable=True)
-    login_count = Column(Integer, default=0)
-    
-    # Relationships
-    cart_items = relationship("CartItem", back_populates="user", cascade="all, delete-orphan")
-    
-    # Indexes
-    __table_args__ = (
-        Index('idx_user_email', 'email', postgresql_using='hash'),
-        Index('idx_user_username', 'username', postgresql_using='hash'),
-    )
-    
-    def set_password(self, password: str):
-        """Хеширование пароля"""
-        self.hashed_password = pwd_context.hash(password)
-    
-    def verify_password(self, password: str) -> bool:
-        """Проверка пароля"""
-        return pwd_context.verify(password, self.hashed_password)
-    
-    def to_dict(self) -> Dict[str, Any]:
-        """Сериализация в словарь"""
-        return {
-            "id": self.id,
-            "username": self.username,
-            "email": self.email,
-            "full_name": self.full_name,
-            "is_active": self.is_active,
-            "role": self.role.value if self.role else None,
-            "created_at": self.created_at.isoformat() if self.created_at else None,
-            "last_login": self.last_login.isoformat() if self.last_login else None,
-            "login_count": self.login_count
-        }
+def get_user_by_email(db: Session, email: str):
+    return db.query(User).filter(User.email == email).first()
 
-class Product(Base):
-    __tablename__ = "products"
-    
-    id = Column(Integer, primary_key=True, index=True)
-    name = Column(String(100), nullable=False)
-    description = Column(String(500), nullable=True)
-    price = Column(Numeric(10, 2), nullable=False)
-    stock_quantity = Column(Integer, default=0)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
-    updated_at = Column(DateTime(timezone=True), onupdate=func.now(), nullable=True)
-    
-    # Relationships
-    cart_items = relationship("CartItem", back_populates="product")
-    
-    # Indexes
-    __table_args__ = (
-        Index('idx_product_name', 'name'),
-        Index('idx_product_price', 'price'),
-    )
+def get_user_by_username(db: Session, username: str, redis=None):
+    return db.query(User).filter(User.username == username).first()
+
+def get_user_version(db: Session, username: str) -> Optional[Tuple[int, datetime]]:
+    """Only id and modification time, for conditional requests"""
+    row = db.query(User.id, func.coalesce(User.updated_at, User.created_at)) \
+        .filter(User.username == username).first()
+    return tuple(row) if row else None
+
+def get_users(db: Session, skip: int = 0, limit: int = 100):
+    return db.query(User).order_by(User.id).offset(skip).limit(limit).all()
+
+def get_users_digest(db: Session, skip: int = 0, limit: int = 100) -> str:
+    digest = hashlib.sha1()
+    rows = db.query(User.id, func.coalesce(User.updated_at, User.created_at)) \
+        .order_by(User.id).offset(skip).limit(limit)
+    for user_id, modified in rows:
+        digest.update(f"{user_id}:{modified.timestamp() if modified else 0};".encode())
+    return digest.hexdigest()
+
+def create_user(db: Session, user: UserCreate):
+    try:
+        db_user = User(
+            username=user.username,
+            email=user.email,
+            full_name=user.full_name
+        )
+        db_user.set_password(user.password)
+        db.add(db_user)
+        db.commit()
+        db.refresh(db_user)
+        return db_user
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error creating user: {e}")
+        raise
 
-class CartItem(Base):
-    __tablename__ = "cart_items"
+def update_user(db: Session, user_id: int, user: UserUpdate):
+    db_user = get_user(db, user_id)
+    if not db_user:
+        return None
     
-    id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'))
-    product_id = Column(Integer, ForeignKey('products.id', ondelete='CASCADE'))
-    quantity = Column(Integer, default=1)
-    price_at_add = Column(Numeric(10, 2), nullable=False)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
-    updated_at = Column(DateTime(timezone=True), onupdate=func.now(), nullable=True)
+    update_data = user.dict(exclude_unset=True)
+    if 'password' in update_data:
+        db_user.set_password(update_data['password'])
     
-    # Relationships
-    user = relationship("User", back_populates="cart_items")
-    product = relationship("Product", back_populates="cart_items")
+    for key, value in update_data.items():
+        if key != 'password':
+            setattr(db_user, key, value)
     
-    # Constraints
-    __table_args__ = (
-        Index('idx_cart_user_product', 'user_id', 'product_id', unique=True),
-    )
\ No newline at end of file
+    db.commit()
+    db.refresh(db_user)
+    return db_user
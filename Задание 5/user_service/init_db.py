@@ -1,11 +1,11 @@
 import os
 import time
-import json
 from sqlalchemy import create_engine, text
 from sqlalchemy.exc import OperationalError
 from redis import Redis
 from datetime import datetime
 import logging
+from cache_deploy import run_deploy_hook
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -54,14 +54,9 @@ def wait_for_dependencies():
     if not db_ready or not redis_ready:
         raise ConnectionError("Failed to connect to dependencies")
 
-def clear_redis_cache(redis: Redis):
-    """Clear all Redis cache keys"""
-    try:
-        redis.flushall()
-        logger.info("Redis cache cleared")
-    except Exception as e:
-        logger.error(f"Error clearing Redis cache: {e}")
-        raise
+# initialize_database пересоздаёт эти таблицы с нуля: кеши их данных устаревают,
+# а корзины cart_service в Redis ссылаются на исчезнувшие строки (cache_deploy.STATE_KEYS)
+REWRITTEN_TABLES = ("users", "products", "cart_items")
 
 def initialize_database():
     """Initialize database schema and sample data"""
@@ -87,7 +82,8 @@ def initialize_database():
             role VARCHAR(20) DEFAULT 'user',
             created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
             last_login TIMESTAMP WITH TIME ZONE,
-            login_count INTEGER DEFAULT 0
+            login_count INTEGER DEFAULT 0,
+            updated_at TIMESTAMP WITH TIME ZONE
         );
         """))
         
@@ -107,7 +103,7 @@ def initialize_database():
         CREATE TABLE cart_items (
             id SERIAL PRIMARY KEY,
             user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-            product_id INTEGER NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+            product_id VARCHAR(24) NOT NULL,
             quantity INTEGER NOT NULL DEFAULT 1 CHECK (quantity > 0),
             price_at_add NUMERIC(10, 2) NOT NULL,
             created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
@@ -119,6 +115,7 @@ def initialize_database():
         # Create indexes
         conn.execute(text("""
         CREATE INDEX idx_user_email ON users(email);
+        CREATE INDEX idx_user_last_login ON users(last_login DESC NULLS LAST);
         CREATE INDEX idx_product_name ON products(name);
         CREATE INDEX idx_cart_user ON cart_items(user_id);
         """))
@@ -141,34 +138,20 @@ def initialize_database():
             ('Телефон', 'Смартфон последней модели', 50000.00, 25);
         """))
         
-        conn.execute(text("""
-        INSERT INTO cart_items (user_id, product_id, quantity, price_at_add)
-        VALUES 
-            (2, 1, 2, 1200.00),
-            (2, 3, 1, 250.00),
-            (3, 2, 1, 75000.00),
-            (3, 4, 1, 50000.00);
-        """))
+        # cart_items references product_service (MongoDB) ids and is filled by
+        # cart_service's write-behind flusher, so no sample rows here
         
         logger.info("Database schema initialized with sample data")
 
 def initialize_redis(redis: Redis):
-    """Initialize Redis with default values"""
+    """Initialize Redis configuration"""
     try:
         # Set configuration values
         redis.config_set("maxmemory", "100mb")
         redis.config_set("maxmemory-policy", "allkeys-lru")
         
-        # Create sample cache entries
-        sample_users = [
-            {"id": 1, "username": "admin", "role": "admin"},
-            {"id": 2, "username": "alice", "role": "user"}
-        ]
-        
-        for user in sample_users:
-            redis.set(f"user:{user['id']}", json.dumps(user))
-        
-        logger.info("Redis initialized with sample data")
+        # Кеши пользователей прогревает сам сервис при старте (cache_warmer)
+        logger.info("Redis configured")
     except Exception as e:
         logger.error(f"Error initializing Redis: {e}")
         raise
@@ -179,9 +162,11 @@ if __name__ == "__main__":
         wait_for_dependencies()
         
         redis = get_redis_connection()
-        clear_redis_cache(redis)
         
         initialize_database()
+        # Вместо FLUSHALL: сбрасываются только поколения кешей пересозданных таблиц,
+        # отозванные токены и кеши других сервисов переживают перезапуск
+        run_deploy_hook(create_engine(DATABASE_URL), redis, REWRITTEN_TABLES)
         initialize_redis(redis)
         
         logger.info("Initialization completed successfully")
@@ -1,4 +1,4 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, Query, status, Request, Response
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.responses import RedirectResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
@@ -6,12 +6,20 @@ from sqlalchemy.orm import Session
 from sqlalchemy import text
 from typing import List
 import crud, schemas, models, auth
-from database import SessionLocal, engine
+from database import SessionLocal, engine, redis_pool, async_redis, cache_redis, cache_bus, get_db as get_db_session
 from datetime import timedelta, datetime
+from common.etag import make_etag, etag_matches, http_date, not_modified_since
+from cache_lab import STRATEGIES, lab, simulated_query
+from cache_warmer import run_warmup
+from common.loopwatch import install_loop_diagnostics
+from common.metrics import PrometheusMiddleware
+from common.swr import swr_cached
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from redis.exceptions import RedisError
 import redis
-import json
-import os
+import asyncio
 import logging
+import os
 import platform
 import time
 
@@ -19,6 +27,15 @@ import time
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Мягкий TTL — сколько значение считается свежим, жесткий — сколько его еще можно отдавать,
+# пока один воркер обновляет кеш в фоне
+USER_CACHE_SOFT_TTL = float(os.getenv("USER_CACHE_SOFT_TTL_SECONDS", "30"))
+USER_CACHE_HARD_TTL = float(os.getenv("USER_CACHE_HARD_TTL_SECONDS", "300"))
+CACHED_SOFT_TTL = float(os.getenv("CACHED_SOFT_TTL_SECONDS", "10"))
+CACHED_HARD_TTL = float(os.getenv("CACHED_HARD_TTL_SECONDS", "30"))
+# Сколько ждать прогрева кеша, прежде чем всё равно объявить готовность
+WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT_SECONDS", "60"))
+
 # Создание таблиц в базе данных
 models.Base.metadata.create_all(bind=engine)
 
@@ -39,14 +56,14 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Метрики HTTP и рантайма; добавлен последним, чтобы быть внешним слоем и учитывать CORS
+app.add_middleware(PrometheusMiddleware)
+# LOOP_DIAGNOSTICS=1: поиск блокирующих вызовов в async-обработчиках, отчёт на /admin/loop/blocking
+install_loop_diagnostics(app)
 
 # Инициализация Redis
 try:
-    redis_client = redis.Redis(
-        host=os.getenv('REDIS_HOST', 'redis'),
-        port=6379,
-        decode_responses=True
-    )
+    redis_client = redis.Redis(connection_pool=redis_pool)
     # Проверка соединения с Redis
     redis_client.ping()
 except Exception as e:
@@ -56,6 +73,10 @@ except Exception as e:
 # Схема аутентификации
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# Готовность к трафику (/ready): выставляется после прогрева кеша
+ready = False
+_warmup_task = None
+
 def get_db():
     db = SessionLocal()
     try:
@@ -76,10 +97,18 @@ async def startup_event():
     logger.info("Запуск User Service")
     logger.info(f"Версия Python: {platform.python_version()}")
     logger.info(f"Система: {platform.system()} {platform.release()}")
+    await cache_bus.start()
+    global _warmup_task
+    _warmup_task = asyncio.create_task(warm_up())
 
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info("Остановка User Service")
+    if _warmup_task:
+        _warmup_task.cancel()
+    await cache_bus.stop()
+    await async_redis.close()
+    await cache_redis.close()
     if redis_client:
         redis_client.close()
 
@@ -129,6 +158,17 @@ async def health_check():
         }
     }
 
+@app.get("/ready", tags=["Мониторинг"])
+async def readiness_check():
+    """Готовность принимать трафик: 503, пока кеш пользователей прогревается"""
+    if not ready:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Кеш пользователей прогревается",
+            headers={"Retry-After": "5"}
+        )
+    return {"status": "ready", "service": "user_service"}
+
 @app.post("/users/", response_model=schemas.UserOut, status_code=status.HTTP_201_CREATED)
 async def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
     """Создание нового пользователя"""
@@ -136,56 +176,122 @@ async def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
         db_user = crud.create_user(db=db, user=user)
         if redis_client:
             redis_client.delete("all_users")
+        # Снимаем закешированное «не найден» для этого логина
+        await load_user.invalidate(db_user.username)
+        await auth.auth_user_cache.invalidate(db_user.username)
         return db_user
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.get("/users/", response_model=List[schemas.UserOut])
-async def read_users(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+async def read_users(request: Request, response: Response, skip: int = 0, limit: int = 100,
+                     db: Session = Depends(get_db)):
     """Получение списка пользователей"""
     try:
+        etag = make_etag("users", skip, limit, crud.get_users_digest(db, skip=skip, limit=limit))
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+        response.headers["ETag"] = etag
         return crud.get_users(db, skip=skip, limit=limit)
     except Exception as e:
         raise HTTPException(status_code=500, detail="Ошибка сервера")
 
+def _read_user_snapshot(username: str):
+    with get_db_session() as db:
+        user = crud.get_user_by_username(db, username)
+        return schemas.UserOut.from_orm(user) if user else None
+
+@swr_cached("user", soft_ttl=USER_CACHE_SOFT_TTL, hard_ttl=USER_CACHE_HARD_TTL, redis=cache_redis,
+            encode=lambda user: schemas.UserOut.record(user) if user else None,
+            decode=lambda data: schemas.UserOut.from_cache(data) if data else None)
+async def load_user(username: str):
+    """Пользователь по логину (или None) через SWR-кеш; запрос к БД уходит в поток"""
+    return await asyncio.to_thread(_read_user_snapshot, username)
+
+async def warm_up():
+    """Прогрев кешей поиска по логину последними активными пользователями, затем готовность"""
+    global ready
+    await run_warmup(SessionLocal, cache_redis, [
+        (auth.auth_user_cache, auth.auth_record),
+        (load_user.cache, schemas.UserOut.from_orm),
+    ], timeout=WARMUP_TIMEOUT)
+    ready = True
+
+@app.get("/users/{username}", response_model=schemas.UserOut)
+async def read_user(username: str, request: Request, response: Response):
+    """Поиск пользователя по логину"""
+    user = await load_user(username)
+    if user is None:
+        raise HTTPException(status_code=404, detail="Пользователь не найден")
+    modified = user.updated_at or user.created_at
+    # Тег и дата строятся по закешированному снимку, так что 304 тоже обходится без БД
+    etag = make_etag("user", user.id, int(modified.timestamp() * 1_000_000))
+    headers = {"ETag": etag, "Last-Modified": http_date(modified)}
+    if_none_match = request.headers.get("if-none-match")
+    if etag_matches(if_none_match, etag) or (
+        not if_none_match and not_modified_since(request.headers.get("if-modified-since"), modified)
+    ):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    response.headers.update(headers)
+    return user
+
 @app.post("/token", response_model=schemas.Token)
 async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
     """Аутентификация и получение токена"""
-    user = auth.authenticate_user(db, form_data.username, form_data.password)
+    user = await auth.authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Неверное имя пользователя или пароль",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    access_token = auth.create_access_token(
-        data={"sub": user.username},
+    # uid нужен другим сервисам (cart_service) для привязки данных к пользователю,
+    # role — для их административных эндпоинтов
+    access_token, _ = auth.create_tokens(
+        data={"sub": user.username, "uid": user.id, "role": user.role.value},
         expires_delta=timedelta(minutes=auth.ACCESS_TOKEN_EXPIRE_MINUTES)
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
+async def _lab_get(strategy: str, key: str):
+    try:
+        return await lab.get(strategy, key)
+    except RedisError:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Сервис Redis недоступен"
+        )
+
+@app.get("/api/lab", tags=["Тестирование"])
+async def cache_lab(strategy: str = Query("redis", regex="^(" + "|".join(STRATEGIES) + ")$"),
+                    key: str = Query("test", max_length=64)):
+    """Один и тот же запрос под выбранной стратегией кеширования (см. cache_lab.py)"""
+    start_time = time.perf_counter()
+    data, result = await _lab_get(strategy, key)
+    return {
+        "strategy": strategy,
+        "cache": result,
+        "data": data,
+        "elapsed": time.perf_counter() - start_time
+    }
+
 @app.get("/api/uncached", tags=["Тестирование"])
-async def uncached_data(db: Session = Depends(get_db)):
-    """Эндпоинт без кеширования (для тестирования производительности)"""
-    start_time = time.time()
-    # Имитация запроса к БД
-    time.sleep(0.01)
+async def uncached_data():
+    """Эндпоинт без кеширования (стратегия none лаборатории кеша)"""
+    data, _ = await _lab_get("none", "test")
     return {
         "message": "Данные без кеширования",
-        "query_time": time.time() - start_time
+        "query_time": data["query_time"]
     }
 
 @app.get("/api/cached", tags=["Тестирование"])
-async def cached_data(redis: redis.Redis = Depends(get_redis)):
-    """Эндпоинт с кешированием (для тестирования производительности)"""
-    start_time = time.time()
-    
-    cached = redis.get("test_cache")
-    if not cached:
-        # Имитация долгого запроса
-        time.sleep(0.01)
-        data = {"message": "Кешированные данные", "query_time": time.time() - start_time}
-        redis.setex("test_cache", 30, json.dumps(data))  # Кеш на 30 секунд
-        return data
-    
-    return json.loads(cached)
\ No newline at end of file
+@swr_cached("api_cached", soft_ttl=CACHED_SOFT_TTL, hard_ttl=CACHED_HARD_TTL, redis=cache_redis,
+            key=lambda: "test")
+async def cached_data():
+    """Эндпоинт с кешированием в Redis: stale-while-revalidate, обновляет один воркер"""
+    data = await simulated_query("cached", "test")
+    return {"message": "Кешированные данные", "query_time": data["query_time"]}
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
\ No newline at end of file
@@ -6,7 +6,7 @@ from database import Base
 from passlib.context import CryptContext
 from typing import Dict, Any
 from enum import Enum as PyEnum
-from sqlalchemy import Enum as SqlEnum, Index
+from sqlalchemy import Enum as SqlEnum, Index, text
 
 # Password context
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -21,23 +21,30 @@ class User(Base):
     __table_args__ = (
         Index('idx_user_email', 'email', postgresql_using='hash'),
         Index('idx_user_username', 'username', postgresql_using='hash'),
+        # прогрев кеша: последние активные; в SQLite NULLS LAST в индексе не поддерживается
+        Index('idx_user_last_login', text('last_login DESC NULLS LAST')).ddl_if(dialect='postgresql'),
         {'extend_existing': True}  # Должен быть ОТДЕЛЬНЫМ элементом в кортеже
     )
     
     id = Column(Integer, primary_key=True, index=True)
     username = Column(String(50), unique=True, nullable=False)
     email = Column(String(255), unique=True, nullable=False)
-    hashed_password = Column(String(255), nullable=False)
+    hashed_password = Column("password_hash", String(255), nullable=False)
     full_name = Column(String(100), nullable=True)
     is_active = Column(Boolean, default=True)
     role = Column(SqlEnum(UserRole), default=UserRole.USER)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     last_login = Column(DateTime(timezone=True), nullable=True)
     login_count = Column(Integer, default=0)
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now(), nullable=True)
     
     # Relationships
     cart_items = relationship("CartItem", back_populates="user", cascade="all, delete-orphan")
     
+    @property
+    def password_hash(self) -> str:
+        return self.hashed_password
+    
     def set_password(self, password: str):
         """Хеширование пароля"""
         self.hashed_password = pwd_context.hash(password)
@@ -57,7 +64,8 @@ class User(Base):
             "role": self.role.value,
             "created_at": self.created_at.isoformat() if self.created_at else None,
             "last_login": self.last_login.isoformat() if self.last_login else None,
-            "login_count": self.login_count
+            "login_count": self.login_count,
+            "updated_at": self.updated_at.isoformat() if self.updated_at else None
         }
 
 class Product(Base):
@@ -76,9 +84,6 @@ class Product(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now(), nullable=True)
     
-    # Relationships
-    cart_items = relationship("CartItem", back_populates="product")
-    
     def to_dict(self) -> Dict[str, Any]:
         """Сериализация в словарь"""
         return {
@@ -100,7 +105,8 @@ class CartItem(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'))
-    product_id = Column(Integer, ForeignKey('products.id', ondelete='CASCADE'))
+    # ObjectId товара из product_service (MongoDB)
+    product_id = Column(String(24), nullable=False)
     quantity = Column(Integer, default=1)
     price_at_add = Column(Numeric(10, 2), nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -108,7 +114,6 @@ class CartItem(Base):
     
     # Relationships
     user = relationship("User", back_populates="cart_items")
-    product = relationship("Product", back_populates="cart_items")
     
     def to_dict(self) -> Dict[str, Any]:
         """Сериализация в словарь"""
@@ -54,6 +54,7 @@ class UserOut(UserBase):
     created_at: datetime
     last_login: Optional[datetime] = None
     login_count: int = 0
+    updated_at: Optional[datetime] = None
 
     class Config:
         orm_mode = True
@@ -74,17 +75,33 @@ class UserOut(UserBase):
         """Convert model to dict suitable for Redis storage"""
         data = self.dict()
         data['created_at'] = data['created_at'].isoformat()
-        if data['last_login']:
-            data['last_login'] = data['last_login'].isoformat()
+        for field in ('last_login', 'updated_at'):
+            if data[field]:
+                data[field] = data[field].isoformat()
         return data
 
+    @classmethod
+    def record(cls, user) -> Dict[str, Any]:
+        """Plain dict of the fields of an ORM user or UserOut, for common.codec cache entries"""
+        data = {field: getattr(user, field) for field in cls.__fields__}
+        data['role'] = UserRole(data['role'] or UserRole.USER).value
+        return data
+
+    @classmethod
+    def from_cache(cls, data: Dict[str, Any]):
+        """Trusted fast path for entries written by record(): no validation, datetimes already decoded"""
+        values = {field: data[field] for field in cls.__fields__ if field in data}
+        values['role'] = UserRole(values['role'])
+        return cls.construct(**values)
+
     @classmethod
     def from_redis_dict(cls, data: Dict[str, Any]):
         """Create model from Redis-stored dict"""
         if 'created_at' in data:
             data['created_at'] = datetime.fromisoformat(data['created_at'])
-        if 'last_login' in data and data['last_login']:
-            data['last_login'] = datetime.fromisoformat(data['last_login'])
+        for field in ('last_login', 'updated_at'):
+            if data.get(field):
+                data[field] = datetime.fromisoformat(data[field])
         return cls(**data)
 
 class Token(BaseModel):